@@ -1,52 +1,201 @@
 import struct
+import numpy as np
+
+# Texturas ya abiertas en este proceso, por nombre de archivo. Los procesos
+# del rasterizador por tiles reciben la textura por nombre y la abren una
+# sola vez en lugar de copiar sus pixeles en cada tarea
+_loaded = {}
 
 class BMPTexture:
-    def __init__(self, filename):
+    def __init__(self, filename = None, pixels = None):
+        self.filename = filename
         self.width = 0
         self.height = 0
-        self.pixels = []
-        self.load(filename)
-    
+
+        # Pixeles (alto, ancho, 3) RGB en uint8. La fila 0 es la de abajo,
+        # que corresponde a v = 0
+        self.pixels = np.zeros((0, 0, 3), dtype = np.uint8)
+
+        # Cadena de mipmaps, se construye la primera vez que se necesita
+        self.mipmaps = None
+
+        # pixels permite crear la textura desde un arreglo ya cargado
+        # (por ejemplo una imagen de pygame) en lugar de un archivo BMP
+        if pixels is not None:
+            self.pixels = np.ascontiguousarray(pixels[:, :, :3], dtype = np.uint8)
+            self.height, self.width = self.pixels.shape[:2]
+        elif filename is not None:
+            self.load(filename)
+
+    def __reduce__(self):
+        if self.filename is None:
+            return (BMPTexture, (None, np.asarray(self.pixels)))
+        return (_openTexture, (self.filename,))
+
     def load(self, filename):
         with open(filename, 'rb') as file:
             if file.read(2) != b'BM':
                 raise ValueError("No es un archivo BMP válido")
-            
+
             file.seek(10)
             pixel_data_offset = struct.unpack('<I', file.read(4))[0]
-            
+
             file.seek(18)
-            self.width = struct.unpack('<I', file.read(4))[0]
-            self.height = struct.unpack('<I', file.read(4))[0]
+            self.width = struct.unpack('<i', file.read(4))[0]
+            height = struct.unpack('<i', file.read(4))[0]
             file.seek(28)
             bits_per_pixel = struct.unpack('<H', file.read(2))[0]
-            
+
             if bits_per_pixel != 24:
                 raise ValueError("Solo se admiten archivos BMP de 24 bits")
-            
-            file.seek(pixel_data_offset)
-            self.pixels = [[(0, 0, 0) for _ in range(self.height)] for _ in range(self.width)]
-            
-            for y in range(self.height-1, -1, -1):
-                for x in range(self.width):
-                    b, g, r = struct.unpack('<BBB', file.read(3))
-                    self.pixels[x][y] = (r/255, g/255, b/255)  
-                
-                padding = (4 - (self.width * 3) % 4) % 4
-                file.read(padding)
-    
+
+        # Una altura negativa indica filas de arriba hacia abajo
+        self.height = abs(height)
+        rowSize = (self.width * 3 + 3) // 4 * 4
+
+        # El bloque de pixeles se mapea de una vez; las filas incluyen su
+        # relleno, que se descarta con el recorte
+        data = np.memmap(filename, dtype = np.uint8, mode = 'r', offset = pixel_data_offset,
+                         shape = (self.height, rowSize))
+
+        pixels = data[:, :self.width * 3].reshape(self.height, self.width, 3)[:, :, ::-1]
+        if height < 0:
+            pixels = pixels[::-1]
+
+        self.pixels = pixels
+        self.mipmaps = None
+
     def get_color(self, u, v):
         """Obtiene el color en las coordenadas de textura (u, v) normalizadas (0-1)"""
-        if not self.pixels:
-            return (1, 1, 1)  
-        
+        if self.pixels.size == 0:
+            return (1, 1, 1)
+
         u = u % 1.0
         v = v % 1.0
-        
+
         x = int(u * (self.width - 1))
-        y = int((1 - v) * (self.height - 1))  
-        
+        y = int((1 - v) * (self.height - 1))
+
         x = max(0, min(self.width - 1, x))
         y = max(0, min(self.height - 1, y))
-        
-        return self.pixels[x][y]
\ No newline at end of file
+
+        r, g, b = self.pixels[self.height - 1 - y, x]
+        return (r/255, g/255, b/255)
+
+    def build_mipmaps(self):
+        # Cada nivel promedia bloques de 2x2 del anterior hasta llegar a 1x1.
+        # Los lados impares repiten su ultima fila o columna
+        self.mipmaps = [self.pixels]
+        level = self.pixels
+
+        while level.shape[0] > 1 or level.shape[1] > 1:
+            h, w = level.shape[:2]
+            padded = np.pad(level, ((0, h % 2), (0, w % 2), (0, 0)), mode = 'edge').astype(np.uint16)
+
+            level = (padded[0::2, 0::2] + padded[1::2, 0::2] + padded[0::2, 1::2] + padded[1::2, 1::2] + 2) // 4
+            level = level.astype(np.uint8)
+
+            if h == 1:
+                level = level[:1]
+            if w == 1:
+                level = level[:, :1]
+
+            self.mipmaps.append(level)
+
+        return self.mipmaps
+
+    def get_lod(self, uvArea, screenArea):
+        # Nivel de detalle a partir de cuantos texels cubre cada pixel:
+        # uvArea es el area en coordenadas de textura y screenArea el area
+        # en pixeles de la misma region
+        texels = np.abs(uvArea) * self.width * self.height
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            lod = 0.5 * np.log2(texels / np.abs(screenArea))
+        return np.nan_to_num(lod, nan = 0.0, posinf = 0.0, neginf = 0.0)
+
+    def sample(self, u, v, filter = "bilinear", wrap = "repeat", lod = None):
+        # Muestrea la textura en arreglos de coordenadas (u, v) y retorna
+        # colores (N,3) en rango 0-1.
+        #   filter: "nearest" o "bilinear"
+        #   wrap:   "repeat" o "clamp"
+        #   lod:    None usa solo la textura completa; un valor o arreglo de
+        #           valores elige el mipmap (interpolando entre los dos
+        #           niveles mas cercanos si el filtro es bilinear)
+        u = np.nan_to_num(np.asarray(u, dtype = float))
+        v = np.nan_to_num(np.asarray(v, dtype = float))
+
+        if self.pixels.size == 0:
+            return np.ones(u.shape + (3,))
+
+        if lod is None:
+            return self._sample_level(self.pixels, u, v, filter, wrap)
+
+        if self.mipmaps is None:
+            self.build_mipmaps()
+
+        top = len(self.mipmaps) - 1
+        lod = np.clip(np.broadcast_to(lod, u.shape), 0, top)
+
+        if filter == "nearest":
+            levels = np.rint(lod).astype(np.int64)
+            weights = np.zeros(u.shape)
+        else:
+            levels = np.floor(lod).astype(np.int64)
+            weights = lod - levels
+
+        colors = np.empty(u.shape + (3,))
+
+        # Se muestrea por grupos de fragmentos que usan el mismo nivel
+        for level in np.unique(levels):
+            mask = levels == level
+            color = self._sample_level(self.mipmaps[level], u[mask], v[mask], filter, wrap)
+
+            blend = weights[mask] > 0
+            if blend.any():
+                upper = self._sample_level(self.mipmaps[min(level + 1, top)], u[mask][blend], v[mask][blend], filter, wrap)
+                t = weights[mask][blend][:, None]
+                color[blend] = color[blend] * (1 - t) + upper * t
+
+            colors[mask] = color
+
+        return colors
+
+    def _sample_level(self, level, u, v, filter, wrap):
+        h, w = level.shape[:2]
+
+        def fix(index, size):
+            if wrap == "clamp":
+                return np.clip(index, 0, size - 1)
+            return np.mod(index, size)
+
+        if filter == "nearest":
+            x = fix(np.floor(u * w).astype(np.int64), w)
+            y = fix(np.floor(v * h).astype(np.int64), h)
+            return level[y, x] / 255
+
+        # Bilinear entre los cuatro texels mas cercanos a (u, v)
+        s = u * w - 0.5
+        t = v * h - 0.5
+        x0 = np.floor(s)
+        y0 = np.floor(t)
+        fx = (s - x0)[:, None]
+        fy = (t - y0)[:, None]
+
+        x0 = x0.astype(np.int64)
+        y0 = y0.astype(np.int64)
+        x1 = fix(x0 + 1, w)
+        y1 = fix(y0 + 1, h)
+        x0 = fix(x0, w)
+        y0 = fix(y0, h)
+
+        bottom = level[y0, x0] * (1 - fx) + level[y0, x1] * fx
+        top = level[y1, x0] * (1 - fx) + level[y1, x1] * fx
+
+        return (bottom * (1 - fy) + top * fy) / 255
+
+
+def _openTexture(filename):
+    texture = _loaded.get(filename)
+    if texture is None:
+        texture = _loaded[filename] = BMPTexture(filename)
+    return texture
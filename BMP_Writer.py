@@ -1,43 +1,46 @@
 import struct
+import numpy as np
 
-def GenerateBMP(filename: str, width: int, height: int, byteDepth: int, colorBuffer: list[list[tuple[int, int, int]]]) -> None:
-    
-    def char(c: str) -> bytes:
-        # 1 byte
-        return struct.pack("<c", c.encode("ascii"))
-
-    def word(w: int) -> bytes:
-        # 2 bytes
-        return struct.pack("<H", w)
-
-    def dword(d: int) -> bytes:
-        # 4 bytes
-        return struct.pack("<L", d)
-
-    with open(filename, "wb") as file:
-        # Header
-        file.write(char("B"))
-        file.write(char("M"))
-        file.write(dword(14 + 40 + (width * height * byteDepth)))
-        file.write(dword(0))
-        file.write(dword(14 + 40))
-        
-        # Info Header
-        file.write(dword(40))
-        file.write(dword(width))
-        file.write(dword(height))
-        file.write(word(1))
-        file.write(word(byteDepth * 8))
-        file.write(dword(0))
-        file.write(dword(width * height * byteDepth))
-        file.write(dword(0))
-        file.write(dword(0))
-        file.write(dword(0))
-        file.write(dword(0))
-        
-        # Color table
-        for y in range(height):
-            for x in range(width):
-                color = colorBuffer[x][y]
-                for i in range(len(color) - 1, -1, -1):
-                    file.write(color[i].to_bytes(1, "little"))
+def GenerateBMP(filename: "str | object", width: int, height: int, byteDepth: int, colorBuffer: "np.ndarray | list[list[tuple[int, int, int]]]") -> None:
+    # filename puede ser una ruta, un archivo abierto en modo binario o un
+    # buffer escribible (bytearray, memoryview) de al menos el tamano del BMP.
+    # colorBuffer es el arreglo (alto, ancho, 3) del Renderer o una lista [x][y]
+    # de colores RGB. byteDepth 3 escribe BGR y 4 escribe BGRA opaco.
+
+    # Cada fila del BMP ocupa un multiplo de 4 bytes
+    rowSize = (width * byteDepth + 3) // 4 * 4
+    imageSize = rowSize * height
+
+    header = struct.pack("<2sIHHI", b"BM", 14 + 40 + imageSize, 0, 0, 14 + 40)
+
+    infoHeader = struct.pack("<IiiHHIIiiII",
+                             40,                # Tamano del encabezado
+                             width,
+                             height,            # Positivo: filas de abajo hacia arriba
+                             1,                 # Planos
+                             byteDepth * 8,     # Bits por pixel
+                             0,                 # Sin compresion
+                             imageSize,
+                             0, 0, 0, 0)
+
+    # Toda la imagen se arma en un solo arreglo con el relleno de cada fila
+    if isinstance(colorBuffer, np.ndarray):
+        pixels = colorBuffer[:height, :width, :3]
+    else:
+        pixels = np.array(colorBuffer, dtype = np.uint8)[:width, :height, :3].transpose(1, 0, 2)
+
+    image = np.zeros((height, rowSize), dtype = np.uint8)
+    rows = image[:, :width * byteDepth].reshape(height, width, byteDepth)
+    rows[:, :, 0:3] = pixels[:, :, ::-1]
+    if byteDepth == 4:
+        rows[:, :, 3] = 255
+
+    data = header + infoHeader + image.tobytes()
+
+    if isinstance(filename, (bytearray, memoryview)):
+        memoryview(filename).cast("B")[:len(data)] = data
+    elif hasattr(filename, "write"):
+        filename.write(data)
+    else:
+        with open(filename, "wb") as file:
+            file.write(data)
@@ -0,0 +1,395 @@
+import argparse
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import shaders
+from gl import *
+from model import Model, InstancedModel
+from OBJLoader import OBJ
+from BMP_Writer import GenerateBMP
+from BMPTexture import BMPTexture
+
+# Benchmark sin ventana sobre las mallas y shaders del repositorio. Cada
+# caso es malla x primitiva x shader x resolucion con una pose fija, y se
+# reporta fps, tiempo por etapa, memoria pico y un checksum de la imagen:
+#   python Benchmark.py --save baseline.json
+#   python Benchmark.py --baseline baseline.json
+# Con --baseline el programa termina con error si alguna imagen cambio o
+# algun caso es mas lento que la tolerancia, y se niega a comparar si el
+# baseline se guardo con otras opciones (--raster, --frames, --lod).
+#
+# Con --verify no se mide nada: se comprueba que los caminos que deben dar
+# la misma imagen la den (directo, diferido y por tiles; frame completo y
+# glUpdate parcial; InstancedModel y modelos separados; BMP escrito y leido
+# con anchos impares) y el programa termina con error si alguno difiere:
+#   python Benchmark.py --verify
+
+MESHES = ["Penguin.obj", "butterfly.obj", "eyeball.obj"]
+PRIMITIVES = {"points": POINTS, "lines": LINES, "triangles": TRIANGLES}
+SHADERS = ["fragmentShader", "flatShader", "gouradShader", "RainbowShader", "oceanShader",
+           "discoShader", "fireShader", "textureShader"]
+RESOLUTIONS = ["320x240", "640x480"]
+
+# Textura de cada malla para textureShader
+TEXTURES = {"Penguin.obj": "PenguinTexture.png"}
+
+# Puntos y lineas no usan el fragment shader, se miden con uno solo
+UNSHADED_SHADER = "fragmentShader"
+
+SEED = 1234
+
+# Procesos del rasterizador por tiles en --verify
+VERIFY_WORKERS = 2
+
+# Lado de los puntos en la prueba de glUpdate de --verify
+VERIFY_POINT_SIZE = 9
+
+# Anchos de las imagenes BMP de --verify, con y sin relleno en las filas
+VERIFY_WIDTHS = [1, 2, 3, 5, 7, 101]
+
+
+def parseArguments(argv = None):
+    parser = argparse.ArgumentParser(description = "Benchmark the renderer on the bundled meshes and shaders.")
+
+    parser.add_argument("--mesh", nargs = "+", default = MESHES)
+    parser.add_argument("--primitive", nargs = "+", choices = PRIMITIVES, default = list(PRIMITIVES))
+    parser.add_argument("--shader", nargs = "+", default = SHADERS)
+    parser.add_argument("--resolution", nargs = "+", default = RESOLUTIONS, help = "WIDTHxHEIGHT")
+    parser.add_argument("--raster", choices = ("scanline", "edge"), default = "edge")
+    parser.add_argument("--frames", type = int, default = 3, help = "timed frames per case")
+    parser.add_argument("--warmup", type = int, default = 1, help = "untimed frames per case")
+    parser.add_argument("--lod", type = float, metavar = "PIXELS",
+                        help = "use simplified meshes whose screen-space error stays under PIXELS")
+
+    parser.add_argument("--save", help = "write the results to this JSON file")
+    parser.add_argument("--baseline", help = "compare against results saved with --save")
+    parser.add_argument("--tolerance", type = float, default = 0.10,
+                        help = "allowed slowdown against the baseline, 0.10 = 10%%")
+    parser.add_argument("--verify", action = "store_true",
+                        help = "check that equivalent render paths produce identical images, at the first resolution")
+
+    return parser.parse_args(argv)
+
+
+def fitModel(obj):
+    # Centra la malla frente a la camara y la escala a un tamano fijo,
+    # para que mallas con unidades distintas ocupen lo mismo en pantalla
+    vertices, normals, texcoords, indices = obj.indexedMesh()
+    model = Model(vertices, normals, indices, texcoords)
+
+    low = np.asarray(obj.vertices).min(axis = 0)
+    high = np.asarray(obj.vertices).max(axis = 0)
+    size = max(float((high - low).max()), 1e-9)
+    scale = 2.5 / size
+    center = (low + high) / 2
+
+    model.scale = [scale] * 3
+    model.rotation = [15, 30, 0]
+
+    # La traslacion se aplica despues de rotar y escalar, asi que el centro
+    # se lleva al origen con la misma rotacion y escala
+    offset = np.asarray(model.GetLocalMatrix())[:3, :3] @ center
+    model.translation = [-offset[0], -offset[1], -5 - offset[2]]
+
+    model.vertexShader = shaders.batchVertexShader
+    return model
+
+
+def loadTexture(filename):
+    # La textura es opcional: sin pygame textureShader usa el color actual
+    try:
+        from RenderCLI import loadTexture
+        return loadTexture(filename)
+    except ImportError:
+        return None
+
+
+def cases(args):
+    for mesh in args.mesh:
+        for primitive in args.primitive:
+            shaderNames = args.shader if primitive == "triangles" else [UNSHADED_SHADER]
+            for shaderName in shaderNames:
+                for resolution in args.resolution:
+                    yield mesh, primitive, shaderName, resolution
+
+
+def runCase(model, primitive, shaderName, resolution, args):
+    width, height = (int(value) for value in resolution.lower().split("x"))
+
+    rend = Renderer(OffscreenTarget(width, height))
+    rend.primitiveType = PRIMITIVES[primitive]
+    rend.rasterMode = EDGE_FUNCTION if args.raster == "edge" else SCANLINE
+    rend.cullFace = CULL_BACK
+    rend.lodThreshold = args.lod
+    rend.models.append(model)
+
+    model.fragmentShader = getattr(shaders, shaderName)
+
+    def frame():
+        shaders.seedShaders(SEED)
+        rend.glClear()
+        rend.glRender()
+
+    for _ in range(args.warmup):
+        frame()
+    rend.profiler.reset()
+
+    start = time.perf_counter()
+    for _ in range(args.frames):
+        frame()
+    elapsed = time.perf_counter() - start
+    rend.profiler.endFrame()
+
+    # La memoria se mide en un frame aparte porque tracemalloc
+    # hace mas lento todo lo que mide
+    tracemalloc.start()
+    frame()
+    _, peakMemory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    aggregate = rend.profiler.aggregate()
+    frameTime = elapsed / max(args.frames, 1)
+
+    return {"fps": 1 / frameTime if frameTime > 0 else None,
+            "frameTime": frameTime,
+            "stages": {name: timer["mean"] for name, timer in aggregate["timers"].items()},
+            "counters": {name: counter["mean"] for name, counter in aggregate["counters"].items()},
+            "peakMemory": peakMemory,
+            "checksum": hashlib.sha1(np.ascontiguousarray(rend.frameBuffer).tobytes()).hexdigest()}
+
+
+def runSettings(args):
+    # Lo que cambia las imagenes o los tiempos de todos los casos
+    return {"raster": args.raster, "frames": args.frames, "seed": SEED, "lod": args.lod}
+
+
+def compareSettings(settings, stored):
+    # Retorna los mensajes de las opciones distintas a las del baseline; con
+    # cualquiera de ellas las imagenes y los tiempos no se pueden comparar
+    stored = stored or {}
+    return [f"MISMATCH {name}: baseline used {stored.get(name)!r}, this run uses {value!r}"
+            for name, value in settings.items() if stored.get(name) != value]
+
+
+def compare(results, baseline, tolerance):
+    # Retorna los mensajes de los casos que cambiaron de imagen o se
+    # volvieron mas lentos que la tolerancia
+    problems = []
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+
+        if result["checksum"] != previous["checksum"]:
+            problems.append(f"CHANGED  {name}: image checksum differs from the baseline")
+
+        if result["frameTime"] > previous["frameTime"] * (1 + tolerance):
+            slowdown = result["frameTime"] / previous["frameTime"] - 1
+            problems.append(f"SLOWER   {name}: {previous['frameTime'] * 1000:.1f} ms -> "
+                            f"{result['frameTime'] * 1000:.1f} ms (+{slowdown:.0%})")
+
+    return problems
+
+
+def renderImage(rend, models):
+    shaders.seedShaders(SEED)
+    rend.models = list(models)
+    rend.glClear()
+    rend.glRender()
+    return rend.frameBuffer.copy()
+
+
+def verifyPaths(model, width, height, args):
+    # Directo, diferido y por tiles con cada shader que no cambia entre
+    # frames. Retorna una lista de (caso, imagenes que deben ser iguales)
+    renderers = {"edge": Renderer(OffscreenTarget(width, height)),
+                 "deferred": Renderer(OffscreenTarget(width, height)),
+                 "parallel": Renderer(OffscreenTarget(width, height))}
+    renderers["deferred"].deferred = True
+    renderers["parallel"].glParallel(VERIFY_WORKERS)
+
+    for rend in renderers.values():
+        rend.rasterMode = EDGE_FUNCTION
+        rend.cullFace = CULL_BACK
+
+    cases = []
+    try:
+        for shaderName in args.shader:
+            model.fragmentShader = getattr(shaders, shaderName)
+            if getattr(model.fragmentShader, "isAnimated", False):
+                continue
+            images = [renderImage(rend, [model]) for rend in renderers.values()]
+            cases.append((f"{shaderName} edge/deferred/parallel", images))
+    finally:
+        renderers["parallel"].glParallel(0)
+
+    return cases
+
+
+def verifyUpdate(obj, width, height):
+    # Dos copias de la malla; despues de mover una, glUpdate redibuja solo
+    # su rectangulo y debe quedar igual que un frame completo. Los puntos
+    # grandes se salen de los vertices, asi que tambien se prueban
+    cases = []
+    for primitive, pointSize in (("triangles", 1), ("points", VERIFY_POINT_SIZE)):
+        models = [fitModel(obj), fitModel(obj)]
+        for model, offset in zip(models, (-0.8, 0.8)):
+            model.translation = [model.translation[0] + offset] + list(model.translation[1:])
+            model.fragmentShader = shaders.gouradShader
+
+        rend = Renderer(OffscreenTarget(width, height))
+        rend.rasterMode = EDGE_FUNCTION
+        rend.cullFace = CULL_BACK
+        rend.primitiveType = PRIMITIVES[primitive]
+        rend.pointSize = pointSize
+        rend.models = models
+        rend.glUpdate()
+
+        models[0].rotation = [15, 45, 0]
+        rect = rend.glUpdate()
+        partial = rend.frameBuffer.copy()
+
+        name = f"glUpdate partial redraw {primitive}"
+        if rect == (0, 0, width, height):
+            name += " (redrew the whole frame)"
+        cases.append((name, [partial, renderImage(rend, models)]))
+    return cases
+
+
+def verifyInstances(obj, width, height):
+    # Una cuadricula de copias como modelos separados y como un solo
+    # InstancedModel, con la misma transformacion cada una
+    separate = []
+    for x in (-1, 1):
+        for y in (-1, 1):
+            model = fitModel(obj)
+            model.scale = [value * 0.5 for value in model.scale]
+            model.rotation = [15 * y, 30 + 20 * x, 0]
+            model.translation = [model.translation[0] + x, model.translation[1] + y, model.translation[2]]
+            model.fragmentShader = shaders.gouradShader
+            separate.append(model)
+
+    first = separate[0]
+    instanced = InstancedModel(first.vertices, first.normals, first.indices, first.texcoords,
+                               [model.translation for model in separate],
+                               [model.rotation for model in separate],
+                               [model.scale for model in separate])
+    instanced.vertexShader = shaders.batchVertexShader
+    instanced.fragmentShader = shaders.gouradShader
+
+    cases = []
+    for primitive, primitiveType in PRIMITIVES.items():
+        rend = Renderer(OffscreenTarget(width, height))
+        rend.rasterMode = EDGE_FUNCTION
+        rend.cullFace = CULL_BACK
+        rend.primitiveType = primitiveType
+        cases.append((f"InstancedModel {primitive}", [renderImage(rend, separate), renderImage(rend, [instanced])]))
+    return cases
+
+
+def verifyBMP():
+    # Imagenes al azar escritas con GenerateBMP y leidas con BMPTexture
+    rng = np.random.default_rng(SEED)
+    cases = []
+    with tempfile.TemporaryDirectory() as directory:
+        for width in VERIFY_WIDTHS:
+            image = rng.integers(0, 256, (3, width, 3), dtype = np.uint8)
+            filename = os.path.join(directory, f"{width}.bmp")
+            GenerateBMP(filename, width, 3, 3, image)
+
+            # np.array copia los pixeles para soltar el archivo mapeado
+            cases.append((f"BMP round trip width {width}", [image, np.array(BMPTexture(filename).pixels)]))
+    return cases
+
+
+def verify(args):
+    # Retorna los mensajes de los casos cuyas imagenes no son iguales
+    width, height = (int(value) for value in args.resolution[0].lower().split("x"))
+
+    cases = verifyBMP()
+    for mesh in args.mesh:
+        obj = OBJ(mesh)
+        model = fitModel(obj)
+        if mesh in TEXTURES:
+            model.texture = loadTexture(TEXTURES[mesh])
+
+        cases += [(f"{mesh} {name}", images) for name, images in verifyPaths(model, width, height, args)]
+        cases += [(f"{mesh} {name}", images) for name, images in verifyUpdate(obj, width, height)]
+        cases += [(f"{mesh} {name}", images) for name, images in verifyInstances(obj, width, height)]
+
+    problems = []
+    for name, images in cases:
+        same = all(np.array_equal(images[0], image) for image in images[1:])
+        print(f"{'ok' if same else 'DIFFERS':<8} {name}")
+        if not same:
+            problems.append(f"DIFFERS  {name}: the images are not identical")
+    return problems
+
+
+def main(argv = None):
+    args = parseArguments(argv)
+
+    if args.verify:
+        problems = verify(args)
+        for problem in problems:
+            print(problem)
+        return 1 if problems else 0
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as file:
+            saved = json.load(file)
+
+        # Se rechaza antes de medir nada
+        mismatches = compareSettings(runSettings(args), saved.get("settings"))
+        if mismatches:
+            for mismatch in mismatches:
+                print(mismatch)
+            print("The baseline was saved with different settings, run with the same options or save a new one")
+            return 1
+
+        baseline = saved["results"]
+
+    models = {}
+    results = {}
+
+    print(f"{'case':<48} {'fps':>8} {'ms':>9} {'peak MB':>8}  checksum")
+    for mesh, primitive, shaderName, resolution in cases(args):
+        if mesh not in models:
+            obj = OBJ(mesh)
+            models[mesh] = fitModel(obj)
+            if args.lod is not None:
+                models[mesh].lods = obj.lodChain()
+            if mesh in TEXTURES:
+                models[mesh].texture = loadTexture(TEXTURES[mesh])
+
+        name = f"{mesh}/{primitive}/{shaderName}/{resolution}"
+        result = runCase(models[mesh], primitive, shaderName, resolution, args)
+        results[name] = result
+
+        print(f"{name:<48} {result['fps']:>8.2f} {result['frameTime'] * 1000:>9.1f} "
+              f"{result['peakMemory'] / 2**20:>8.1f}  {result['checksum'][:12]}")
+
+    if args.save:
+        with open(args.save, "w") as file:
+            json.dump({"settings": runSettings(args), "results": results}, file, indent = 2)
+
+    if baseline is not None:
+        problems = compare(results, baseline, args.tolerance)
+        for problem in problems:
+            print(problem)
+
+        if problems:
+            return 1
+        print("No regressions against the baseline")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,21 +1,41 @@
 from MathLib import *
+from Transform import Transform
 
-class Camera(object):
+class Camera(Transform):
     def __init__(self):
-        self.translation = [0, 0, 0]
-        self.rotation = [0, 0, 0]  
+        super().__init__()
+
+        self._viewMatrix = None
+        self._viewVersion = None
+
+    def BuildLocalMatrix(self):
+        # La camara no tiene escala, solo traslacion y rotacion
+        translateMat = TranslationMatrix(*self.translation)
+
+        rotateMat = RotationMatrix(*self.rotation)
+
+        return translateMat * rotateMat
 
     def GetViewMatrix(self):
-        translateMat = TranslationMatrix(self.translation[0],
-                                         self.translation[1],
-                                         self.translation[2])
-        
-        rotateMat = RotationMatrix(self.rotation[0],
-                                   self.rotation[1],
-                                   self.rotation[2])
-        
-        cameMatrix = translateMat * rotateMat
-
-        return np.linalg.inv(cameMatrix)  
-
-        
\ No newline at end of file
+        # Inversa de la matriz de la camara. Como es una transformacion
+        # rigida, la inversa es la rotacion transpuesta con la traslacion
+        # rotada y negada, sin invertir una matriz general. Pedir la matriz
+        # de mundo mantiene al dia worldVersion
+        self.GetWorldMatrix()
+
+        if self._viewMatrix is None or self._viewVersion != self.worldVersion:
+            local = np.asarray(self.GetLocalMatrix())
+            rotation = local[:3, :3].T
+
+            viewMatrix = np.identity(4)
+            viewMatrix[:3, :3] = rotation
+            viewMatrix[:3, 3] = -rotation @ local[:3, 3]
+
+            if self.parent is not None:
+                viewMatrix = viewMatrix @ np.linalg.inv(self.parent.GetWorldMatrix())
+
+            self._viewMatrix = np.matrix(viewMatrix)
+            self._viewMatrix.flags.writeable = False
+            self._viewVersion = self.worldVersion
+
+        return self._viewMatrix
@@ -1,5 +1,5 @@
 import numpy as np
-from math import pi, sin, cos, isclose
+from math import pi, sin, cos, isclose, isfinite, ceil, floor
 
 def barycentricCoords(A, B, C, P):
 	#Se saca el area de los subtriangulos y del tirangulo
@@ -39,6 +39,75 @@ def barycentricCoords(A, B, C, P):
 
 
 
+def edgeFunctionRaster(A, B, C, minX, minY, maxX, maxY):
+	# Rasteriza el triangulo ABC con funciones de arista sobre su
+	# rectangulo envolvente, recortado a [minX, maxX) x [minY, maxY).
+	# Retorna las coordenadas de los pixeles cubiertos, sus coordenadas
+	# baricentricas (N,3) y la profundidad interpolada, o None.
+
+	xs = (A[0], B[0], C[0])
+	ys = (A[1], B[1], C[1])
+
+	if not all(isfinite(c) for c in xs + ys):
+		return None
+
+	x0 = max(minX, ceil(min(xs)))
+	x1 = min(maxX - 1, floor(max(xs)))
+	y0 = max(minY, ceil(min(ys)))
+	y1 = min(maxY - 1, floor(max(ys)))
+
+	if x0 > x1 or y0 > y1:
+		return None
+
+	area = (B[0] - A[0]) * (C[1] - A[1]) - (B[1] - A[1]) * (C[0] - A[0])
+	if area == 0:
+		return None
+
+	# Se trabaja siempre en orden antihorario; si viene en orden horario
+	# se intercambian B y C y luego se regresan sus coordenadas
+	swapped = area < 0
+	if swapped:
+		B, C = C, B
+		area = -area
+
+	px = np.arange(x0, x1 + 1, dtype = np.float64)
+	py = np.arange(y0, y1 + 1, dtype = np.float64)[:, None]
+
+	edges = []
+	mask = True
+	for (a, b) in ((B, C), (C, A), (A, B)):
+		dx = b[0] - a[0]
+		dy = b[1] - a[1]
+		e = dx * (py - a[1]) - dy * (px - a[0])
+
+		# Regla superior-izquierda: los pixeles exactamente sobre una
+		# arista solo se dibujan si es arista izquierda o superior
+		if dy < 0 or (dy == 0 and dx < 0):
+			mask = mask & (e >= 0)
+		else:
+			mask = mask & (e > 0)
+		edges.append(e)
+
+	rows, cols = np.nonzero(mask)
+
+	if len(rows) == 0:
+		return None
+
+	bCoords = np.empty((len(rows), 3))
+	for i in range(3):
+		bCoords[:, i] = edges[i][rows, cols]
+	bCoords /= area
+
+	if swapped:
+		bCoords[:, [1, 2]] = bCoords[:, [2, 1]]
+		B, C = C, B
+
+	z = bCoords @ (A[2], B[2], C[2])
+
+	return cols + x0, rows + y0, bCoords, z
+
+
+
 def TranslationMatrix(x, y, z):
 	
 	return np.matrix([[1, 0, 0, x],
@@ -80,4 +149,38 @@ def RotationMatrix(pitch, yaw, roll):
 						 [0,0,1,0],
 						 [0,0,0,1]])
 	
-	return pitchMat * yawMat * rollMat
\ No newline at end of file
+	return pitchMat * yawMat * rollMat
+
+
+
+def TransformMatrices(translations, rotations, scales):
+	# Version en lote de TranslationMatrix * RotationMatrix * ScaleMatrix:
+	# recibe arreglos (I,3) y retorna las matrices (I,4,4)
+	translations = np.asarray(translations, dtype = float).reshape(-1, 3)
+	pitch, yaw, roll = np.radians(np.asarray(rotations, dtype = float).reshape(-1, 3)).T
+	scales = np.asarray(scales, dtype = float).reshape(-1, 3)
+
+	count = len(translations)
+	ones = np.ones(count)
+	zeros = np.zeros(count)
+
+	def matrices(rows):
+		return np.stack([np.stack(row, axis = 1) for row in rows], axis = 1)
+
+	pitchMat = matrices([[ones, zeros, zeros],
+						 [zeros, np.cos(pitch), -np.sin(pitch)],
+						 [zeros, np.sin(pitch), np.cos(pitch)]])
+
+	yawMat = matrices([[np.cos(yaw), zeros, np.sin(yaw)],
+					   [zeros, ones, zeros],
+					   [-np.sin(yaw), zeros, np.cos(yaw)]])
+
+	rollMat = matrices([[np.cos(roll), -np.sin(roll), zeros],
+						[np.sin(roll), np.cos(roll), zeros],
+						[zeros, zeros, ones]])
+
+	result = np.zeros((count, 4, 4))
+	result[:, :3, :3] = pitchMat @ yawMat @ rollMat * scales[:, None, :]
+	result[:, :3, 3] = translations
+	result[:, 3, 3] = 1
+	return result
@@ -0,0 +1,132 @@
+import os
+import json
+import struct
+import hashlib
+import numpy as np
+
+# Cache binario de mallas. Un archivo guarda varios arreglos con tipo fijo
+# (posiciones, normales, indices, etc.) seguidos de un encabezado JSON que
+# describe donde esta cada uno. Al leerlo los arreglos se abren con
+# memoria mapeada, sin copiar ni volver a interpretar el texto del OBJ.
+#
+# Formato:
+#   "MSHC"                        4 bytes
+#   largo del encabezado          uint32
+#   encabezado JSON               {"source": ..., "arrays": {...}}
+#   datos de los arreglos         alineados a 64 bytes
+
+MAGIC = b"MSHC"
+ALIGNMENT = 64
+
+
+def sourceFingerprint(filename, version):
+	# Identifica el archivo fuente sin leerlo. Si cambia el tamano, la
+	# fecha de modificacion o la version del parser, el cache deja de ser
+	# valido. El hash del contenido (sourceDigest) se guarda aparte y solo
+	# se calcula si todo esto coincide
+	stat = os.stat(filename)
+
+	return {"size": stat.st_size,
+			"mtime": stat.st_mtime_ns,
+			"version": version}
+
+
+def sourceDigest(filename):
+	digest = hashlib.sha1()
+	with open(filename, "rb") as file:
+		for chunk in iter(lambda: file.read(1 << 20), b""):
+			digest.update(chunk)
+	return digest.hexdigest()
+
+
+def writeMeshCache(cacheFilename, arrays, fingerprint, sourceFilename = None):
+	# Con sourceFilename tambien se guarda el hash de su contenido
+	source = dict(fingerprint)
+	if sourceFilename is not None:
+		source["sha1"] = sourceDigest(sourceFilename)
+
+	header = {"source": source, "arrays": {}}
+
+	# El largo del encabezado cambia los desplazamientos de los datos y
+	# los desplazamientos cambian el largo del encabezado, asi que se
+	# recalcula hasta que su largo no cambie
+	headerBytes = b""
+	while True:
+		offset = len(MAGIC) + 4 + len(headerBytes)
+		for name, array in arrays.items():
+			offset = (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+			header["arrays"][name] = {"dtype": array.dtype.str,
+									  "shape": list(array.shape),
+									  "offset": offset}
+			offset += array.nbytes
+
+		previous = headerBytes
+		headerBytes = json.dumps(header).encode("utf-8")
+		if len(headerBytes) == len(previous):
+			break
+
+	# Se escribe a un archivo temporal y luego se reemplaza para que un
+	# proceso que lea al mismo tiempo nunca vea un cache a medias
+	temporary = f"{cacheFilename}.{os.getpid()}.tmp"
+	with open(temporary, "wb") as file:
+		file.write(MAGIC)
+		file.write(struct.pack("<I", len(headerBytes)))
+		file.write(headerBytes)
+
+		for name, array in arrays.items():
+			offset = header["arrays"][name]["offset"]
+			assert file.tell() <= offset, "mesh cache header overlaps the array data"
+			file.write(b"\0" * (offset - file.tell()))
+			file.write(np.ascontiguousarray(array).tobytes())
+
+	os.replace(temporary, cacheFilename)
+
+
+def readMeshCache(cacheFilename, fingerprint, sourceFilename = None):
+	# Retorna un diccionario de arreglos de solo lectura mapeados desde el
+	# archivo, o None si el cache no existe, esta danado o no corresponde a
+	# la fuente. Con sourceFilename tambien se compara el hash de su
+	# contenido, solo si el resto del fingerprint coincide
+	try:
+		with open(cacheFilename, "rb") as file:
+			if file.read(len(MAGIC)) != MAGIC:
+				return None
+
+			headerLength = struct.unpack("<I", file.read(4))[0]
+			header = json.loads(file.read(headerLength).decode("utf-8"))
+			fileSize = os.fstat(file.fileno()).st_size
+	except (OSError, ValueError, struct.error):
+		return None
+
+	if not isinstance(header, dict) or not isinstance(header.get("source"), dict):
+		return None
+
+	source = dict(header["source"])
+	digest = source.pop("sha1", None)
+	if source != fingerprint:
+		return None
+	if sourceFilename is not None and digest != sourceDigest(sourceFilename):
+		return None
+
+	# Un cache cortado o con un encabezado que no corresponde a los datos
+	# se descarta en lugar de mapear fuera del archivo
+	arrays = {}
+	try:
+		for name, info in header["arrays"].items():
+			shape = tuple(info["shape"])
+			dtype = np.dtype(info["dtype"])
+			offset = info["offset"]
+
+			if offset < 0 or offset + int(np.prod(shape)) * dtype.itemsize > fileSize:
+				return None
+
+			if 0 in shape:
+				# mmap no admite regiones vacias
+				arrays[name] = np.empty(shape, dtype = dtype)
+			else:
+				arrays[name] = np.memmap(cacheFilename, dtype = dtype, mode = "r",
+										 offset = offset, shape = shape)
+	except (OSError, ValueError, TypeError, KeyError, AttributeError):
+		return None
+
+	return arrays
@@ -0,0 +1,104 @@
+import numpy as np
+
+# Particion de una malla en grupos pequenos de triangulos cercanos
+# (meshlets). Cada meshlet guarda una esfera envolvente y un cono con las
+# normales de sus triangulos, para que el renderer descarte grupos
+# completos fuera del volumen de vista o de espaldas antes de transformar
+# sus vertices.
+#
+# Los triangulos se agrupan primero por la direccion de su normal y dentro
+# de cada direccion se ordenan por el codigo de Morton de su centro, asi
+# que cada meshlet es una region compacta con normales parecidas y un cono
+# angosto.
+
+MESHLET_TRIANGLES = 64
+NORMAL_CELLS = 3
+
+
+def buildMeshlets(positions, indices, maxTriangles = MESHLET_TRIANGLES):
+    # Retorna un diccionario de arreglos:
+    #   triangles (T,)    indices de triangulo ordenados por meshlet
+    #   offsets   (M+1,)  el meshlet i son triangles[offsets[i]:offsets[i+1]]
+    #   centers   (M,3)   centro de la esfera envolvente
+    #   radii     (M,)    radio de la esfera envolvente
+    #   coneAxes  (M,3)   normal promedio del meshlet
+    #   coneSines (M,)    seno del angulo entre el eje y la normal mas
+    #                     alejada; 1 o mas si el cono no sirve para descartar
+    positions = np.asarray(positions, dtype = float).reshape(-1, 3)
+    indices = np.asarray(indices).reshape(-1, 3)
+    count = len(indices)
+
+    if count == 0:
+        return {"triangles": np.zeros(0, dtype = np.int64), "offsets": np.zeros(1, dtype = np.int64),
+                "centers": np.zeros((0, 3)), "radii": np.zeros(0),
+                "coneAxes": np.zeros((0, 3)), "coneSines": np.zeros(0)}
+
+    corners = positions[indices]
+    normals = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+    lengths = np.linalg.norm(normals, axis = 1)
+    with np.errstate(invalid = "ignore", divide = "ignore"):
+        normals = np.nan_to_num(normals / lengths[:, None])
+
+    # Direccion de la normal: la cara del cubo hacia la que apunta (+x, -x,
+    # +y, ...) dividida en NORMAL_CELLS x NORMAL_CELLS celdas
+    axis = np.abs(normals).argmax(axis = 1)
+    major = normals[np.arange(count), axis]
+    with np.errstate(invalid = "ignore", divide = "ignore"):
+        minor = np.nan_to_num(np.stack((normals[np.arange(count), (axis + 1) % 3],
+                                        normals[np.arange(count), (axis + 2) % 3]), axis = 1) / np.abs(major)[:, None])
+    cells = np.clip(((minor + 1) / 2 * NORMAL_CELLS).astype(np.int64), 0, NORMAL_CELLS - 1)
+    direction = ((axis * 2 + (major < 0)) * NORMAL_CELLS + cells[:, 0]) * NORMAL_CELLS + cells[:, 1]
+
+    order = np.lexsort((_mortonCodes(corners.mean(axis = 1)), direction))
+    direction = direction[order]
+
+    # Cada direccion se parte en bloques de maxTriangles
+    starts = np.flatnonzero(np.r_[True, direction[1:] != direction[:-1]])
+    sizes = np.diff(np.r_[starts, count])
+    chunks = -(-sizes // maxTriangles)
+    offsets = np.concatenate([start + np.arange(chunk) * maxTriangles for start, chunk in zip(starts, chunks)])
+    offsets = np.r_[offsets, count]
+
+    corners = corners[order]
+    normals = normals[order]
+    first = offsets[:-1]
+
+    # Esfera: centro de la caja envolvente y la distancia a la esquina mas lejana
+    points = corners.reshape(-1, 3)
+    low = np.minimum.reduceat(points, first * 3)
+    high = np.maximum.reduceat(points, first * 3)
+    centers = (low + high) / 2
+
+    owner = np.repeat(np.arange(len(first)), np.diff(offsets) * 3)
+    distances = np.linalg.norm(points - centers[owner], axis = 1)
+    radii = np.maximum.reduceat(distances, first * 3)
+
+    # Cono: los triangulos sin area no se dibujan con el descarte de caras
+    # activo, asi que no cuentan
+    axes = np.add.reduceat(normals, first)
+    with np.errstate(invalid = "ignore", divide = "ignore"):
+        axes = np.nan_to_num(axes / np.linalg.norm(axes, axis = 1, keepdims = True))
+
+    owner = owner[::3]
+    cosines = np.einsum("ij,ij->i", normals, axes[owner])
+    cosines[lengths[order] == 0] = 1
+    minCosine = np.minimum.reduceat(cosines, first)
+
+    sines = np.where(minCosine > 0, np.sqrt(np.maximum(1 - minCosine ** 2, 0)), 1.0)
+
+    return {"triangles": order, "offsets": offsets,
+            "centers": centers, "radii": radii,
+            "coneAxes": axes, "coneSines": sines}
+
+
+def _mortonCodes(points):
+    # Codigo de Morton de 30 bits de cada punto (N,3) dentro de su caja
+    low = points.min(axis = 0)
+    size = np.maximum(points.max(axis = 0) - low, 1e-12)
+    cells = np.clip(((points - low) / size * 1023).astype(np.int64), 0, 1023)
+
+    codes = np.zeros(len(points), dtype = np.int64)
+    for bit in range(10):
+        for component in range(3):
+            codes |= ((cells[:, component] >> bit) & 1) << (3 * bit + component)
+    return codes
@@ -1,37 +1,263 @@
+import warnings
+from itertools import chain
 import numpy as np
+from MeshCache import sourceFingerprint, readMeshCache, writeMeshCache
+from Simplify import SIMPLIFY_VERSION, simplifyChain
+
+# Cambiar cuando cambie lo que produce el parser, para invalidar los caches
+PARSER_VERSION = 2
 
 class OBJ:
-    def __init__(self, filename):
-        self.vertices = []
-        self.texcoords = []
-        self.normals = []
-        self.faces = []  # Cada cara almacenará (v, vt, vn)
-        self.load(filename)
-        
-    def load(self, filename):
-        with open(filename) as f:
-            for line in f:
-                if line.startswith('v '):  # Vértices geométricos
-                    vertex = list(map(float, line.strip().split()[1:4]))
-                    self.vertices.extend(vertex)
-                elif line.startswith('vn '):  # Normales
-                    normal = list(map(float, line.strip().split()[1:4]))
-                    self.normals.extend(normal)
-                elif line.startswith('f '):  # Caras
-                    face_vertices = line.strip().split()[1:]
-                    if len(face_vertices) == 3:  # Triángulos
-                        face = []
-                        for v in face_vertices:
-                            parts = v.split('/')
-                            vertex_index = int(parts[0]) - 1  # v
-                            normal_index = int(parts[2]) - 1 if len(parts) > 2 and parts[2] else None  # vn
-                            face.append((vertex_index, normal_index))
-                        self.faces.append(face)
-                    elif len(face_vertices) > 3:  # Polígonos (se triangulan)
-                        for i in range(1, len(face_vertices)-1):
-                            face = [
-                                (int(face_vertices[0].split('/')[0]) - 1, int(face_vertices[0].split('/')[2]) - 1 if len(face_vertices[0].split('/')) > 2 else None),
-                                (int(face_vertices[i].split('/')[0]) - 1, int(face_vertices[i].split('/')[2]) - 1 if len(face_vertices[i].split('/')) > 2 else None),
-                                (int(face_vertices[i+1].split('/')[0]) - 1, int(face_vertices[i+1].split('/')[2]) - 1 if len(face_vertices[i+1].split('/')) > 2 else None)
-                            ]
-                            self.faces.append(face)
\ No newline at end of file
+    def __init__(self, filename, cache = True, chunkSize = None):
+        # Los datos quedan en arreglos con tipo fijo:
+        #   vertices  (V,3) float32
+        #   texcoords (T,2) float32
+        #   normals   (N,3) float32
+        #   faces     (F,3,3) int32, cada esquina es (v, vt, vn) y -1 si falta
+        self.vertices = np.zeros((0, 3), dtype = np.float32)
+        self.texcoords = np.zeros((0, 2), dtype = np.float32)
+        self.normals = np.zeros((0, 3), dtype = np.float32)
+        self.faces = np.zeros((0, 3, 3), dtype = np.int32)
+
+        self.filename = filename
+        self.cache = cache
+
+        # Con cache = True la malla se guarda en filename.meshcache despues
+        # de interpretarla y las siguientes veces se carga de ahi
+        # chunkSize lee archivos muy grandes por bloques de ese tamano
+        if cache:
+            self.loadCached(filename, chunkSize)
+        else:
+            self.load(filename, chunkSize)
+
+    def loadCached(self, filename, chunkSize = None):
+        cacheFilename = filename + ".meshcache"
+        fingerprint = sourceFingerprint(filename, PARSER_VERSION)
+
+        arrays = readMeshCache(cacheFilename, fingerprint, filename)
+        if arrays is not None:
+            self.vertices = arrays["vertices"]
+            self.texcoords = arrays["texcoords"]
+            self.normals = arrays["normals"]
+            self.faces = arrays["faces"]
+            return
+
+        self.load(filename, chunkSize)
+
+        try:
+            writeMeshCache(cacheFilename, {"vertices": self.vertices,
+                                           "texcoords": self.texcoords,
+                                           "normals": self.normals,
+                                           "faces": self.faces}, fingerprint, filename)
+        except OSError as e:
+            print(f"Warning: could not write mesh cache {cacheFilename}: {e}")
+
+    def indexedMesh(self):
+        # Retorna los vertices unicos de la malla (una combinacion v/vt/vn
+        # distinta por vertice) y el buffer de indices (F,3) hacia ellos:
+        #   vertices (U,3), normals (U,3), texcoords (U,2), indices (F,3)
+        # Las normales y texcoords que faltan quedan en (0,0,1) y (0,0)
+        unique, indices = np.unique(self.faces.reshape(-1, 3), axis = 0, return_inverse = True)
+
+        vertices = np.asarray(self.vertices)[unique[:, 0]]
+
+        normals = np.tile(np.array([0, 0, 1], dtype = np.float32), (len(unique), 1))
+        hasNormal = unique[:, 2] >= 0
+        normals[hasNormal] = np.asarray(self.normals)[unique[hasNormal, 2]]
+
+        texcoords = np.zeros((len(unique), 2), dtype = np.float32)
+        hasTexcoord = unique[:, 1] >= 0
+        texcoords[hasTexcoord] = np.asarray(self.texcoords)[unique[hasTexcoord, 1]]
+
+        return vertices, normals, texcoords, indices.reshape(-1, 3).astype(np.int32)
+
+    def lodChain(self, ratio = 0.5, minTriangles = 64):
+        # Niveles de detalle de la malla de indexedMesh, como los retorna
+        # Simplify.simplifyChain. Simplificar toma unos segundos en mallas
+        # de miles de triangulos, asi que con cache = True la cadena se
+        # guarda en filename.lod.meshcache
+        cacheFilename = self.filename + ".lod.meshcache"
+        fingerprint = None
+
+        if self.cache:
+            fingerprint = dict(sourceFingerprint(self.filename, PARSER_VERSION),
+                               simplifyVersion = SIMPLIFY_VERSION, ratio = ratio, minTriangles = minTriangles)
+
+            arrays = readMeshCache(cacheFilename, fingerprint, self.filename)
+            if arrays is not None:
+                return [(arrays[f"vertexIds{level}"], arrays[f"indices{level}"], float(error))
+                        for level, error in enumerate(arrays["errors"])]
+
+        vertices, _, _, indices = self.indexedMesh()
+        levels = simplifyChain(vertices, indices, ratio, minTriangles)
+
+        if self.cache:
+            arrays = {"errors": np.array([error for _, _, error in levels], dtype = np.float64)}
+            for level, (vertexIds, levelIndices, _) in enumerate(levels):
+                arrays[f"vertexIds{level}"] = vertexIds
+                arrays[f"indices{level}"] = levelIndices
+
+            try:
+                writeMeshCache(cacheFilename, arrays, fingerprint, self.filename)
+            except OSError as e:
+                print(f"Warning: could not write mesh cache {cacheFilename}: {e}")
+
+        return levels
+
+    def load(self, filename, chunkSize = None):
+        # Lee el archivo por bloques de chunkSize bytes (todo de una vez si es
+        # None). Cada bloque se clasifica por tipo de linea y se convierte
+        # a numeros en lote, asi que la memoria extra queda acotada por el
+        # tamano del bloque
+        vertices = _ArrayBuilder((3,), np.float32)
+        texcoords = _ArrayBuilder((2,), np.float32)
+        normals = _ArrayBuilder((3,), np.float32)
+        faces = _ArrayBuilder((3, 3), np.int32)
+
+        with open(filename, "rb") as f:
+            rest = b""
+            while True:
+                chunk = f.read(chunkSize or -1)
+                if not chunk:
+                    break
+
+                lines = (rest + chunk).split(b"\n")
+                # La ultima linea puede estar incompleta
+                rest = lines.pop()
+                self.parseLines(lines, vertices, texcoords, normals, faces)
+
+            if rest:
+                self.parseLines([rest], vertices, texcoords, normals, faces)
+
+        self.vertices = vertices.array()
+        self.texcoords = texcoords.array()
+        self.normals = normals.array()
+        self.faces = faces.array()
+
+        # Validar que todas las caras apunten a datos existentes
+        for column, data, name in ((0, self.vertices, "vertex"),
+                                   (1, self.texcoords, "texcoord"),
+                                   (2, self.normals, "normal")):
+            indices = self.faces[:, :, column]
+            if len(indices) and (indices.max() >= len(data) or indices.min() < (0 if column == 0 else -1)):
+                raise ValueError(f"Invalid {name} index in {filename}")
+
+    def parseLines(self, lines, vertices, texcoords, normals, faces):
+        vLines = []
+        vtLines = []
+        vnLines = []
+        fLines = []
+
+        # Cantidad de v, vt y vn leidos antes de cada cara, para resolver
+        # los indices negativos (relativos)
+        before = []
+
+        for line in lines:
+            head = line[:3]
+            if head[:2] == b"v ":
+                vLines.append(line[2:])
+            elif head == b"vt ":
+                vtLines.append(line[3:])
+            elif head == b"vn ":
+                vnLines.append(line[3:])
+            elif head[:2] == b"f ":
+                fLines.append(line[2:])
+                before.append((len(vLines), len(vtLines), len(vnLines)))
+
+        counts = (vertices.size, texcoords.size, normals.size)
+
+        vertices.extend(_parseFloats(vLines, 3))
+        texcoords.extend(_parseFloats(vtLines, 2))
+        normals.extend(_parseFloats(vnLines, 3))
+
+        if fLines:
+            faces.extend(_parseFaces(fLines, np.add(before, counts)))
+
+
+class _ArrayBuilder(object):
+    # Arreglo que crece duplicando su capacidad, para llenar datos de
+    # tamano desconocido sin listas de Python intermedias
+    def __init__(self, shape, dtype):
+        self.data = np.empty((0,) + shape, dtype = dtype)
+        self.size = 0
+
+    def extend(self, values):
+        end = self.size + len(values)
+        if end > len(self.data):
+            grown = np.empty((max(end, 2 * len(self.data)),) + self.data.shape[1:], dtype = self.data.dtype)
+            grown[:self.size] = self.data[:self.size]
+            self.data = grown
+
+        self.data[self.size:end] = values
+        self.size = end
+
+    def array(self):
+        return self.data[:self.size].copy()
+
+
+def _parseNumbers(text, dtype):
+    # Convierte texto separado por espacios de una sola vez. Retorna None si
+    # hay algo que no es un numero
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        try:
+            return np.fromstring(text, dtype = dtype, sep = " ")
+        except (ValueError, DeprecationWarning):
+            return None
+
+
+def _parseFloats(lines, components):
+    if not lines:
+        return np.zeros((0, components), dtype = np.float32)
+
+    values = _parseNumbers(b" ".join(lines), np.float64)
+    if values is not None and len(values) == len(lines) * components:
+        return values.reshape(-1, components)
+
+    # Lineas con componentes de mas (w, colores) o de menos
+    rows = np.zeros((len(lines), components))
+    for i, line in enumerate(lines):
+        parts = line.split()[:components]
+        rows[i, :len(parts)] = list(map(float, parts))
+    return rows
+
+
+def _parseFaces(lines, before):
+    # Retorna las caras trianguladas (F,3,3) con indices desde 0 y -1 donde
+    # falta el dato. before tiene (v, vt, vn) leidos antes de cada linea
+    parts = [line.split() for line in lines]
+    sizes = np.fromiter(map(len, parts), dtype = np.int64, count = len(parts))
+    corners = list(chain.from_iterable(parts))
+    joined = b" ".join(corners)
+
+    # Todas las esquinas suelen tener el mismo formato: v, v/vt, v//vn o
+    # v/vt/vn. En OBJ los indices empiezan en 1, asi que 0 significa que falta
+    width = corners[0].count(b"/") + 1 if corners else 1
+    doubles = joined.count(b"//")
+    uniform = joined.count(b"/") == len(corners) * (width - 1) and doubles in (0, len(corners))
+
+    values = None
+    if uniform:
+        values = _parseNumbers(joined.replace(b"//", b"/0/").replace(b"/", b" "), np.int64)
+
+    if values is not None and len(values) == len(corners) * width:
+        indices = np.zeros((len(corners), 3), dtype = np.int64)
+        indices[:, :width] = values.reshape(-1, width)
+    else:
+        indices = np.zeros((len(corners), 3), dtype = np.int64)
+        for i, corner in enumerate(corners):
+            for j, part in enumerate(corner.split(b"/")[:3]):
+                if part:
+                    indices[i, j] = int(part)
+
+    # Indices positivos empiezan en 1, los negativos son relativos a lo
+    # leido antes de la cara
+    base = np.repeat(before, sizes, axis = 0)
+    indices = np.where(indices > 0, indices - 1, np.where(indices < 0, base + indices, -1))
+
+    # Triangulacion en abanico de los poligonos: (0, i, i+1)
+    triangles = np.maximum(sizes - 2, 0)
+    starts = np.repeat(np.cumsum(sizes) - sizes, triangles)
+    local = np.arange(triangles.sum()) - np.repeat(np.cumsum(triangles) - triangles, triangles) + 1
+
+    return indices[np.stack((starts, starts + local, starts + local + 1), axis = 1)]
@@ -0,0 +1,154 @@
+import json
+from time import perf_counter
+from collections import deque
+from contextlib import contextmanager
+
+# Tiempos y contadores del pipeline por frame. Cada etapa se mide con
+# with profiler.stage("nombre"); las etapas anidadas descuentan su tiempo
+# de la etapa que las contiene, asi que los tiempos de un frame suman su
+# duracion medida. Los frames terminados se guardan en un historial para
+# calcular promedios.
+
+# Mensajes de error que se guardan por frame
+MAX_ERRORS = 10
+
+
+def describeError(error):
+	return f"{type(error).__name__}: {error}"
+
+
+class FrameProfiler(object):
+	def __init__(self, history = 120):
+		self.enabled = True
+		self.history = deque(maxlen = history)
+
+		self.timers = {}
+		self.counters = {}
+		self.errors = []
+
+		self._frameStart = None
+		self._stack = []
+
+	def reset(self):
+		# Descarta el historial y el frame abierto
+		self.history.clear()
+		self._frameStart = None
+		self._stack = []
+
+	def beginFrame(self):
+		# Cierra el frame anterior si sigue abierto y empieza uno nuevo
+		if self._frameStart is not None:
+			self.endFrame()
+
+		self.timers = {}
+		self.counters = {}
+		self.errors = []
+		self._stack = []
+		self._frameStart = perf_counter()
+
+	def endFrame(self):
+		if self._frameStart is None:
+			return None
+
+		record = {"frameTime": perf_counter() - self._frameStart,
+				  "timers": dict(self.timers),
+				  "counters": dict(self.counters),
+				  "errors": list(self.errors)}
+		record["counters"].update(self.derived(self.counters))
+
+		self.history.append(record)
+		self._frameStart = None
+		return record
+
+	@contextmanager
+	def stage(self, name):
+		if not self.enabled:
+			yield
+			return
+
+		entry = [perf_counter(), 0.0]
+		self._stack.append(entry)
+		try:
+			yield
+		finally:
+			self._stack.pop()
+			elapsed = perf_counter() - entry[0]
+			self.timers[name] = self.timers.get(name, 0.0) + elapsed - entry[1]
+			if self._stack:
+				self._stack[-1][1] += elapsed
+
+	def add(self, name, value = 1):
+		self.counters[name] = self.counters.get(name, 0) + value
+
+	def shaderError(self, error):
+		self.shaderErrors(1, [describeError(error)])
+
+	def shaderErrors(self, count, messages):
+		# Errores ya descritos, por ejemplo los de los procesos del
+		# rasterizador por tiles. Solo se guardan los primeros mensajes de
+		# cada frame
+		self.add("shaderErrors", count)
+		self.errors.extend(messages[:max(MAX_ERRORS - len(self.errors), 0)])
+
+	def derived(self, counters):
+		# Proporciones calculadas a partir de los contadores
+		result = {}
+
+		covered = counters.get("pixelsCovered", 0)
+		if covered:
+			result["overdraw"] = counters.get("fragmentsPassed", 0) / covered
+
+		tested = counters.get("fragmentsTested", 0)
+		if tested:
+			result["depthPassRate"] = counters.get("fragmentsPassed", 0) / tested
+
+		return result
+
+	def frameStats(self):
+		# Ultimo frame terminado, o None
+		return self.history[-1] if self.history else None
+
+	def aggregate(self):
+		# Promedio, minimo y maximo de cada tiempo y contador en el historial
+		frames = list(self.history)
+		if not frames:
+			return {"frames": 0}
+
+		def summary(values):
+			return {"mean": sum(values) / len(frames), "min": min(values), "max": max(values)}
+
+		def collect(key):
+			names = sorted(set().union(*(frame[key] for frame in frames)))
+			return {name: summary([frame[key].get(name, 0) for frame in frames]) for name in names}
+
+		frameTimes = [frame["frameTime"] for frame in frames]
+		result = {"frames": len(frames),
+				  "frameTime": summary(frameTimes),
+				  "timers": collect("timers"),
+				  "counters": collect("counters")}
+
+		meanTime = result["frameTime"]["mean"]
+		if meanTime > 0:
+			result["fps"] = 1 / meanTime
+
+		return result
+
+	def toJSON(self, indent = None):
+		return json.dumps({"frame": self.frameStats(), "aggregate": self.aggregate()}, indent = indent)
+
+	def overlayLines(self):
+		# Texto corto del ultimo frame para dibujarlo sobre la ventana
+		frame = self.frameStats()
+		if frame is None:
+			return []
+
+		counters = frame["counters"]
+		lines = [f"{frame['frameTime'] * 1000:.1f} ms"]
+		lines += [f"{name} {time * 1000:.1f} ms" for name, time in sorted(frame["timers"].items(),
+																		   key = lambda item: -item[1])]
+		lines.append(f"tris {counters.get('submitted', 0)} -> {counters.get('trianglesRasterized', 0)}")
+		lines.append(f"frags {counters.get('fragmentsTested', 0)} / {counters.get('fragmentsShaded', 0)}")
+		lines.append(f"overdraw {counters.get('overdraw', 0):.2f}")
+		if counters.get("shaderErrors"):
+			lines.append(f"shader errors {counters['shaderErrors']}")
+		return lines
@@ -5,6 +5,7 @@ from BMP_Writer import GenerateBMP
 from model import Model
 from shaders import *
 from OBJLoader import OBJ
+from BMPTexture import BMPTexture
 
 width = 800
 height = 600
@@ -12,32 +13,38 @@ height = 600
 screen = pygame.display.set_mode((width, height), pygame.SCALED)
 clock = pygame.time.Clock()
 
+# Tiempos y contadores del ultimo frame sobre la ventana, tecla P
+pygame.font.init()
+font = pygame.font.SysFont(None, 18)
+showStats = False
+
 rend = Renderer(screen)
 
 rend.primitiveType = TRIANGLES
+rend.rasterMode = EDGE_FUNCTION
+rend.cullFace = CULL_BACK
 
 obj_model = OBJ("Penguin.obj")
 
-model = Model()
-model.vertices = []
-model.normals = []
+# Vértices únicos de la malla y buffer de índices hacia ellos, para
+# transformar cada vértice una sola vez por frame
+vertices, normals, texcoords, indices = obj_model.indexedMesh()
+model = Model(vertices, normals, indices, texcoords)
+
+# Niveles de detalle para cuando el modelo se ve pequeño (tecla X); el
+# renderer elige uno en cada frame y la tecla L lo desactiva
+model.lods = obj_model.lodChain()
 
-# Cargar vértices y normales por cada cara
-for face in obj_model.faces:
-    for vertex_index, normal_index in face:
-        # Añadir vértices (x, y, z)
-        model.vertices.extend(obj_model.vertices[vertex_index*3 : vertex_index*3+3])
-        
-        # Añadir normales (nx, ny, nz) si existen
-        if normal_index is not None and obj_model.normals:
-            model.normals.extend(obj_model.normals[normal_index*3 : normal_index*3+3])
+# La textura se carga con pygame y se guarda con la fila de abajo primero
+image = pygame.surfarray.array3d(pygame.image.load("PenguinTexture.png"))
+model.texture = BMPTexture(pixels = image.swapaxes(0, 1)[::-1])
 
 # Configurar transformación y shaders
 #model.translation[0] = width / 2
 #model.translation[1] = height / 3
 model.translation[2] = -5
 model.scale = [(i*2) for i in model.scale]
-model.vertexShader = vertexShader
+model.vertexShader = batchVertexShader
 model.fragmentShader = fireShader
 #model.rotation[1] = 180
 
@@ -75,6 +82,21 @@ while isRunning:
                 model.fragmentShader = discoShader
             elif event.key == pygame.K_0:
                 model.fragmentShader = fireShader
+            elif event.key == pygame.K_t:
+                model.fragmentShader = textureShader
+            elif event.key == pygame.K_r:
+                # Alternar entre rasterizador por lineas y por funciones de arista
+                rend.rasterMode = EDGE_FUNCTION if rend.rasterMode == SCANLINE else SCANLINE
+            elif event.key == pygame.K_g:
+                # Alternar sombreado diferido
+                rend.deferred = not rend.deferred
+            elif event.key == pygame.K_l:
+                # Alternar niveles de detalle
+                rend.lodThreshold = None if rend.lodThreshold is not None else 1.0
+            elif event.key == pygame.K_p:
+                showStats = not showStats
+                rend.glPresent()
+                pygame.display.flip()
 
     keys = pygame.key.get_pressed()
     if keys[pygame.K_RIGHT]:
@@ -104,9 +126,20 @@ while isRunning:
 
     
 
-    rend.glClear()
-    rend.glRender()
-    pygame.display.flip()
+    # Solo se dibuja y presenta lo que cambio desde el frame anterior
+    rect = rend.glUpdate()
+    if rect is not None and showStats:
+        # El texto tapa parte de la imagen, se presenta todo el frame
+        rend.glPresent()
+        for i, line in enumerate(rend.profiler.overlayLines()):
+            screen.blit(font.render(line, True, (255, 255, 0)), (5, 5 + i * 16))
+        with rend.profiler.stage("flip"):
+            pygame.display.flip()
+    elif rect is not None:
+        rend.glPresent(rect)
+        x0, y0, x1, y1 = rect
+        with rend.profiler.stage("flip"):
+            pygame.display.update(pygame.Rect(x0, height - y1, x1 - x0, y1 - y0))
 
 rend.glClear()
 GenerateBMP("output.bmp", width, height, 3, rend.frameBuffer)
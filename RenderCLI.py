@@ -0,0 +1,169 @@
+import argparse
+import os
+import numpy as np
+import shaders
+from gl import *
+from BMP_Writer import GenerateBMP
+from model import Model, InstancedModel
+from OBJLoader import OBJ
+from BMPTexture import BMPTexture
+
+# Render sin ventana desde la linea de comandos, por ejemplo:
+#   python RenderCLI.py Penguin.obj --shader gouradShader --frames 36 --spin 0 10 0 --output out/frame_{:03d}.bmp
+
+PRIMITIVES = {"points": POINTS, "lines": LINES, "triangles": TRIANGLES}
+RASTER_MODES = {"scanline": SCANLINE, "edge": EDGE_FUNCTION}
+CULL_MODES = {"none": CULL_NONE, "back": CULL_BACK, "front": CULL_FRONT}
+
+
+def parseArguments(argv = None):
+    parser = argparse.ArgumentParser(description = "Render an OBJ mesh without a display.")
+
+    parser.add_argument("mesh", help = "OBJ file to render")
+    parser.add_argument("--width", type = int, default = 800)
+    parser.add_argument("--height", type = int, default = 600)
+    parser.add_argument("--frames", type = int, default = 1)
+
+    parser.add_argument("--translate", type = float, nargs = 3, default = [0, 0, -5], metavar = ("X", "Y", "Z"))
+    parser.add_argument("--rotate", type = float, nargs = 3, default = [0, 0, 0], metavar = ("PITCH", "YAW", "ROLL"))
+    parser.add_argument("--scale", type = float, nargs = 3, default = [2, 2, 2], metavar = ("X", "Y", "Z"))
+    parser.add_argument("--instances", type = int, default = 1, metavar = "N",
+                        help = "draw N copies of the mesh on a grid, as one instanced model")
+    parser.add_argument("--spin", type = float, nargs = 3, default = [0, 0, 0], metavar = ("PITCH", "YAW", "ROLL"),
+                        help = "rotation added to the model every frame, in degrees")
+
+    parser.add_argument("--camera", type = float, nargs = 3, default = [0, 0, 0], metavar = ("X", "Y", "Z"))
+    parser.add_argument("--camera-rotate", type = float, nargs = 3, default = [0, 0, 0], metavar = ("PITCH", "YAW", "ROLL"))
+
+    parser.add_argument("--shader", default = "gouradShader", help = "fragment shader name from shaders.py")
+    parser.add_argument("--texture", help = "image used by textureShader (BMP, or any format pygame can load)")
+    parser.add_argument("--primitive", choices = PRIMITIVES, default = "triangles")
+    parser.add_argument("--raster", choices = RASTER_MODES, default = "edge")
+    parser.add_argument("--cull", choices = CULL_MODES, default = "back")
+    parser.add_argument("--deferred", action = "store_true")
+    parser.add_argument("--workers", type = int, default = 0, help = "processes for tile rasterization, 0 = serial")
+    parser.add_argument("--depth-sort", action = "store_true", help = "draw models and meshlets front to back")
+    parser.add_argument("--lod", type = float, metavar = "PIXELS",
+                        help = "use simplified meshes whose screen-space error stays under PIXELS")
+
+    parser.add_argument("--format", choices = ("bmp", "raw"), default = "bmp",
+                        help = "raw writes the uint8 RGB buffer, bottom row first")
+    parser.add_argument("--output", default = "frame_{:04d}",
+                        help = "output filename pattern, formatted with the frame number")
+    parser.add_argument("--stats", help = "write per-stage timings and pipeline counters to this JSON file")
+
+    return parser.parse_args(argv)
+
+
+def loadModel(args):
+    obj = OBJ(args.mesh)
+    vertices, normals, texcoords, indices = obj.indexedMesh()
+
+    if args.instances > 1:
+        spacing = np.ptp(np.asarray(vertices, dtype = float).reshape(-1, 3), axis = 0).max() * 1.25
+        model = InstancedModel(vertices, normals, indices, texcoords, instanceGrid(args.instances, spacing))
+    else:
+        model = Model(vertices, normals, indices, texcoords)
+
+    model.translation = list(args.translate)
+    model.rotation = list(args.rotate)
+    model.scale = list(args.scale)
+
+    if args.lod is not None:
+        model.lods = obj.lodChain()
+
+    model.vertexShader = shaders.batchVertexShader
+    model.fragmentShader = getattr(shaders, args.shader, None)
+
+    if not callable(model.fragmentShader):
+        raise SystemExit(f"Unknown shader: {args.shader}")
+
+    if args.texture:
+        model.texture = loadTexture(args.texture)
+
+    return model
+
+
+def instanceGrid(count, spacing):
+    # Traslaciones (count,3) de una cuadricula casi cuadrada en el plano XY,
+    # centrada en el origen, con las filas de arriba hacia abajo
+    columns = int(np.ceil(np.sqrt(count)))
+    rows = -(-count // columns)
+    cells = np.arange(count)
+
+    x = (cells % columns - (columns - 1) / 2) * spacing
+    y = ((rows - 1) / 2 - cells // columns) * spacing
+    return np.column_stack((x, y, np.zeros(count)))
+
+
+def loadTexture(filename):
+    if filename.lower().endswith(".bmp"):
+        return BMPTexture(filename)
+
+    # Otros formatos se leen con pygame, solo si se piden
+    import pygame
+    image = pygame.surfarray.array3d(pygame.image.load(filename))
+    return BMPTexture(pixels = image.swapaxes(0, 1)[::-1])
+
+
+def writeFrame(rend, filename, fileFormat):
+    directory = os.path.dirname(filename)
+    if directory:
+        os.makedirs(directory, exist_ok = True)
+
+    if fileFormat == "bmp":
+        GenerateBMP(filename, rend.width, rend.height, 3, rend.frameBuffer)
+    else:
+        with open(filename, "wb") as file:
+            file.write(np.ascontiguousarray(rend.frameBuffer).tobytes())
+
+
+def main(argv = None):
+    args = parseArguments(argv)
+
+    rend = Renderer(OffscreenTarget(args.width, args.height))
+    rend.primitiveType = PRIMITIVES[args.primitive]
+    rend.rasterMode = RASTER_MODES[args.raster]
+    rend.cullFace = CULL_MODES[args.cull]
+    rend.deferred = args.deferred
+    rend.lodThreshold = args.lod
+    rend.depthSort = args.depth_sort
+
+    rend.camera.translation = list(args.camera)
+    rend.camera.rotation = list(args.camera_rotate)
+
+    if args.workers:
+        if args.raster != "edge" or args.deferred:
+            print("Warning: --workers only applies to --raster edge without --deferred, rendering in one process")
+        else:
+            rend.glParallel(args.workers)
+
+    model = loadModel(args)
+    rend.models.append(model)
+
+    extension = "." + args.format
+    for frame in range(args.frames):
+        # Los frames que no cambian (sin --spin) no se vuelven a dibujar
+        rend.glUpdate()
+
+        filename = args.output.format(frame)
+        if not filename.endswith(extension):
+            filename += extension
+
+        with rend.profiler.stage("write"):
+            writeFrame(rend, filename, args.format)
+        print(filename)
+
+        model.rotation = [r + s for r, s in zip(model.rotation, args.spin)]
+
+    rend.profiler.endFrame()
+    if args.stats:
+        with open(args.stats, "w") as file:
+            file.write(rend.profiler.toJSON(indent = 2))
+
+    if args.workers:
+        rend.glParallel(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,562 @@
+import ast
+import math
+import random
+import inspect
+import builtins
+import textwrap
+import functools
+import numpy as np
+
+# Compilador de fragment shaders escritos pixel por pixel a kernels de numpy.
+#
+# El shader se escribe como siempre, con escalares, math.sin, min/max e if:
+#
+#     def stripes(**kwargs):
+#         u, v, w = kwargs["bCoords"]
+#         if math.sin(u * 40) > 0:
+#             return [1, 1, 1]
+#         return kwargs["pixelColor"]
+#
+# compileShader lee su codigo y lo reescribe para que cada variable sea un
+# arreglo con un valor por fragmento. Los if con condiciones distintas por
+# fragmento ejecutan ambas ramas y cada asignacion se aplica solo a los
+# fragmentos de su rama (np.where); los return marcan los fragmentos que ya
+# terminaron. Las condiciones iguales para todos (por ejemplo sobre
+# uniforms) siguen siendo if normales.
+#
+# Se admiten asignaciones, if/elif/else, return, for sobre rangos iguales
+# para todos, expresiones con and/or/not e if en linea, y las funciones de
+# math, min, max, abs, round, int, float, pow, random.random y np.dot. Un
+# shader con while, break, try, with o funciones anidadas no se compila.
+
+class ShaderCompileError(Exception):
+    pass
+
+
+def compileShader(shader):
+    # Retorna un shader en lote (isBatch) equivalente a shader, que recibe
+    # los mismos kwargs que los demas shaders en lote
+    if shader.__code__.co_freevars:
+        raise ShaderCompileError(f"{shader.__name__} uses variables from an enclosing function")
+
+    try:
+        source = textwrap.dedent(inspect.getsource(shader))
+    except (OSError, TypeError) as e:
+        raise ShaderCompileError(f"source of {shader.__name__} is not available: {e}")
+
+    function = ast.parse(source).body[0]
+    if not isinstance(function, ast.FunctionDef):
+        raise ShaderCompileError(f"{shader.__name__} is not a function definition")
+
+    function.decorator_list = []
+    function.args.args.insert(0, ast.arg(arg = "__lanes"))
+    function.body = _Rewriter().block(function.body, None)
+
+    module = ast.fix_missing_locations(ast.Module(body = [function], type_ignores = []))
+    code = compile(module, inspect.getsourcefile(shader) or "<shader>", "exec")
+
+    namespace = dict(shader.__globals__)
+    namespace.update(_vectorGlobals(shader.__globals__))
+    exec(code, namespace)
+    scalarKernel = namespace[function.name]
+
+    @functools.wraps(shader)
+    def kernel(**kwargs):
+        verts = kwargs.pop("verts")
+        bCoords = kwargs.pop("bCoords")
+        pixelColor = kwargs.pop("pixelColor")
+        kwargs.pop("attributes", None)
+
+        # El shader ve listas como antes, pero cada componente es la
+        # columna de todos los fragmentos
+        kwargs["verts"] = [[verts[:, i, k] for k in range(verts.shape[2])] for i in range(verts.shape[1])]
+        kwargs["bCoords"] = [bCoords[:, i] for i in range(bCoords.shape[1])]
+        kwargs["pixelColor"] = [pixelColor[:, i] for i in range(pixelColor.shape[1])]
+
+        lanes = _Lanes(len(bCoords), pixelColor)
+        _current.append(lanes)
+        try:
+            scalarKernel(lanes, **kwargs)
+        finally:
+            _current.pop()
+
+        return lanes.out
+
+    kernel.isBatch = True
+    kernel.scalarShader = shader
+    return kernel
+
+
+# Lotes en ejecucion, para que random.random() sepa cuantos valores generar
+_current = []
+
+_UNDEFINED = object()
+
+
+class _Lanes(object):
+    # Estado de una ejecucion: los colores de salida y los fragmentos que
+    # ya llegaron a un return. Una mascara es None (todos los fragmentos),
+    # False (ninguno) o un arreglo booleano
+    def __init__(self, count, pixelColor):
+        self.count = count
+        self.out = np.array(pixelColor, dtype = float)
+        self.done = None
+
+    def active(self, mask):
+        if mask is False or self.done is None:
+            return mask
+        remaining = ~self.done
+        return remaining if mask is None else mask & remaining
+
+    def live(self, mask):
+        return mask is not False and (mask is None or bool(mask.any()))
+
+    def split(self, mask, condition):
+        if _isUniform(condition):
+            return (mask, False) if condition else (False, mask)
+
+        condition = np.broadcast_to(np.asarray(condition, dtype = bool), (self.count,))
+        if mask is None:
+            return condition, ~condition
+        return mask & condition, mask & ~condition
+
+    def select(self, mask, new, old):
+        if mask is None:
+            return new
+        if mask is False:
+            return old
+        if old is _UNDEFINED:
+            old = [0] * len(new) if isinstance(new, (list, tuple)) else 0
+
+        if isinstance(new, (list, tuple)) and isinstance(old, (list, tuple)) and len(new) == len(old):
+            return type(new)(self.select(mask, a, b) for a, b in zip(new, old))
+
+        try:
+            return np.where(mask, new, old)
+        except (TypeError, ValueError):
+            if mask.all():
+                return new
+            raise ShaderCompileError("a value that is not a number differs between fragments")
+
+    def ret(self, value, mask):
+        if mask is False:
+            return
+
+        colors = self.colors(value)
+        if mask is None:
+            self.out = colors
+            self.done = np.ones(self.count, dtype = bool)
+            return
+
+        self.out = np.where(mask[:, None], colors, self.out)
+        self.done = mask if self.done is None else self.done | mask
+
+    def colors(self, value):
+        # Igual que perPixelShader: lo que no es una lista deja el color
+        # actual y faltan componentes se completan con 0
+        if not isinstance(value, (list, tuple, np.ndarray)):
+            return self.out
+
+        components = list(value[:3])
+        components += [0] * (3 - len(components))
+        return np.column_stack([np.broadcast_to(np.asarray(c, dtype = float), (self.count,)) for c in components])
+
+    def setitem(self, target, index, value, mask):
+        old = target[index] if mask is not None else _UNDEFINED
+        target[index] = self.select(mask, value, old)
+
+    def unpack(self, value, count):
+        values = list(value)
+        if len(values) != count:
+            raise ValueError(f"expected {count} values to unpack, got {len(values)}")
+        return values
+
+    def and_(self, first, *rest):
+        result = first
+        for operand in rest:
+            if _isUniform(result) and not result:
+                return result
+            value = operand()
+            if _isUniform(result) and _isUniform(value):
+                result = value
+            else:
+                result = np.logical_and(result, value)
+        return result
+
+    def or_(self, first, *rest):
+        result = first
+        for operand in rest:
+            if _isUniform(result) and result:
+                return result
+            value = operand()
+            if _isUniform(result) and _isUniform(value):
+                result = value
+            else:
+                result = np.logical_or(result, value)
+        return result
+
+    def not_(self, value):
+        if _isUniform(value):
+            return not value
+        return np.logical_not(value)
+
+    def where(self, condition, then, otherwise):
+        if _isUniform(condition):
+            return then() if condition else otherwise()
+        return np.where(condition, then(), otherwise())
+
+
+def _isUniform(value):
+    # Un valor igual para todos los fragmentos: todo lo que no es arreglo
+    if isinstance(value, np.ndarray):
+        return value.ndim == 0
+    return not isinstance(value, (list, tuple))
+
+
+class _Rewriter(object):
+    # Reescribe los statements para ejecutarlos sobre todos los fragmentos.
+    # Cada bloque recibe el nombre de su mascara (None = todos)
+    def __init__(self):
+        self.counter = 0
+
+    def name(self, prefix):
+        self.counter += 1
+        return f"__{prefix}{self.counter}"
+
+    def call(self, method, *args):
+        return ast.Call(func = ast.Attribute(value = ast.Name(id = "__lanes", ctx = ast.Load()), attr = method, ctx = ast.Load()),
+                        args = list(args), keywords = [])
+
+    def mask(self, mask):
+        return ast.Constant(value = None) if mask is None else ast.Name(id = mask, ctx = ast.Load())
+
+    def active(self, mask):
+        return self.call("active", self.mask(mask))
+
+    def block(self, statements, mask):
+        result = []
+        mayHaveReturned = False
+
+        for statement in statements:
+            if isinstance(statement, ast.Expr) and isinstance(statement.value, ast.Constant):
+                continue
+
+            rewritten = self.statement(statement, mask)
+
+            # Despues de un return condicional, lo que sigue solo corre
+            # si quedan fragmentos activos
+            if mayHaveReturned:
+                rewritten = [ast.If(test = self.call("live", self.active(mask)), body = rewritten or [ast.Pass()], orelse = [])]
+
+            result += rewritten
+
+            if isinstance(statement, ast.Return) and mask is None and not mayHaveReturned:
+                result.append(ast.Return(value = None))
+                break
+            if any(isinstance(node, ast.Return) for node in ast.walk(statement)):
+                mayHaveReturned = True
+
+        return result
+
+    def statement(self, node, mask):
+        if isinstance(node, ast.Assign):
+            value = self.expression(node.value)
+            if len(node.targets) == 1:
+                return self.assign(node.targets[0], value, mask)
+
+            temporary = self.name("t")
+            result = [ast.Assign(targets = [ast.Name(id = temporary, ctx = ast.Store())], value = value)]
+            for target in node.targets:
+                result += self.assign(target, ast.Name(id = temporary, ctx = ast.Load()), mask)
+            return result
+
+        if isinstance(node, ast.AugAssign):
+            load = _asLoad(node.target)
+            value = ast.BinOp(left = self.expression(load), op = node.op, right = self.expression(node.value))
+            return self.assign(node.target, value, mask)
+
+        if isinstance(node, ast.AnnAssign):
+            if node.value is None:
+                return []
+            return self.assign(node.target, self.expression(node.value), mask)
+
+        if isinstance(node, ast.Return):
+            value = self.expression(node.value) if node.value is not None else ast.Constant(value = None)
+            return [ast.Expr(value = self.call("ret", value, self.active(mask)))]
+
+        if isinstance(node, ast.If):
+            condition = self.name("c")
+            thenMask = self.name("m")
+            elseMask = self.name("m")
+
+            result = [ast.Assign(targets = [ast.Name(id = condition, ctx = ast.Store())], value = self.expression(node.test)),
+                      ast.Assign(targets = [ast.Tuple(elts = [ast.Name(id = thenMask, ctx = ast.Store()),
+                                                              ast.Name(id = elseMask, ctx = ast.Store())], ctx = ast.Store())],
+                                 value = self.call("split", self.active(mask), ast.Name(id = condition, ctx = ast.Load())))]
+
+            for body, branchMask in ((node.body, thenMask), (node.orelse, elseMask)):
+                statements = self.block(body, branchMask)
+                if statements:
+                    result.append(ast.If(test = self.call("live", ast.Name(id = branchMask, ctx = ast.Load())),
+                                         body = statements, orelse = []))
+            return result
+
+        if isinstance(node, ast.For):
+            if node.orelse or any(isinstance(child, (ast.Break, ast.Continue)) for child in ast.walk(node)):
+                raise ShaderCompileError("break, continue and for/else are not supported")
+            if not isinstance(node.target, (ast.Name, ast.Tuple)):
+                raise ShaderCompileError("unsupported loop variable")
+
+            # El iterable debe ser el mismo para todos los fragmentos
+            body = self.block(node.body, mask)
+            return [ast.For(target = node.target, iter = self.expression(node.iter), body = body or [ast.Pass()], orelse = [])]
+
+        if isinstance(node, ast.Expr):
+            return [ast.Expr(value = self.expression(node.value))]
+
+        if isinstance(node, ast.Pass):
+            return []
+
+        raise ShaderCompileError(f"unsupported statement: {type(node).__name__}")
+
+    def assign(self, target, value, mask):
+        if isinstance(target, ast.Name):
+            old = ast.Call(func = ast.Attribute(value = ast.Call(func = ast.Name(id = "locals", ctx = ast.Load()), args = [], keywords = []),
+                                                attr = "get", ctx = ast.Load()),
+                           args = [ast.Constant(value = target.id), ast.Name(id = "__UNDEFINED", ctx = ast.Load())], keywords = [])
+            return [ast.Assign(targets = [ast.Name(id = target.id, ctx = ast.Store())],
+                               value = self.call("select", self.active(mask), value, old))]
+
+        if isinstance(target, (ast.Tuple, ast.List)):
+            if any(isinstance(element, ast.Starred) for element in target.elts):
+                raise ShaderCompileError("starred assignment is not supported")
+
+            temporary = self.name("t")
+            result = [ast.Assign(targets = [ast.Name(id = temporary, ctx = ast.Store())],
+                                 value = self.call("unpack", value, ast.Constant(value = len(target.elts))))]
+            for i, element in enumerate(target.elts):
+                item = ast.Subscript(value = ast.Name(id = temporary, ctx = ast.Load()), slice = ast.Constant(value = i), ctx = ast.Load())
+                result += self.assign(element, item, mask)
+            return result
+
+        if isinstance(target, ast.Subscript):
+            return [ast.Expr(value = self.call("setitem", self.expression(target.value), self.expression(target.slice),
+                                               value, self.active(mask)))]
+
+        raise ShaderCompileError(f"unsupported assignment target: {type(target).__name__}")
+
+    def expression(self, node):
+        return _ExpressionRewriter(self).visit(node)
+
+
+class _ExpressionRewriter(ast.NodeTransformer):
+    # and/or/not, comparaciones encadenadas e if en linea no funcionan con
+    # arreglos; se cambian por llamadas que tambien aceptan escalares. Los
+    # operandos que Python evalua solo a veces se envuelven en lambdas
+    def __init__(self, rewriter):
+        self.rewriter = rewriter
+
+    def lazy(self, node):
+        return ast.Lambda(args = ast.arguments(posonlyargs = [], args = [], vararg = None, kwonlyargs = [],
+                                               kw_defaults = [], kwarg = None, defaults = []),
+                          body = node)
+
+    def visit_BoolOp(self, node):
+        values = [self.visit(value) for value in node.values]
+        method = "and_" if isinstance(node.op, ast.And) else "or_"
+        return self.rewriter.call(method, values[0], *[self.lazy(value) for value in values[1:]])
+
+    def visit_UnaryOp(self, node):
+        if isinstance(node.op, ast.Not):
+            return self.rewriter.call("not_", self.visit(node.operand))
+        return self.generic_visit(node)
+
+    def visit_Compare(self, node):
+        if len(node.ops) == 1:
+            return self.generic_visit(node)
+
+        operands = [self.visit(node.left)] + [self.visit(comparator) for comparator in node.comparators]
+        pairs = [ast.Compare(left = operands[i], ops = [op], comparators = [operands[i + 1]]) for i, op in enumerate(node.ops)]
+        return self.rewriter.call("and_", pairs[0], *[self.lazy(pair) for pair in pairs[1:]])
+
+    def visit_IfExp(self, node):
+        return self.rewriter.call("where", self.visit(node.test), self.lazy(self.visit(node.body)), self.lazy(self.visit(node.orelse)))
+
+    def visit_NamedExpr(self, node):
+        raise ShaderCompileError("assignment expressions are not supported")
+
+    def visit_Lambda(self, node):
+        raise ShaderCompileError("lambdas are not supported")
+
+    def visit_Yield(self, node):
+        raise ShaderCompileError("generators are not supported")
+
+    visit_YieldFrom = visit_Yield
+    visit_Await = visit_Yield
+
+
+def _asLoad(node):
+    node = ast.parse(ast.unparse(node), mode = "eval").body
+    return node
+
+
+# Reemplazos de las funciones escalares que usan los shaders
+
+def _isScalar(*values):
+    return all(np.ndim(value) == 0 for value in values)
+
+
+def _min(*args):
+    if len(args) == 1:
+        args = tuple(args[0])
+    if _isScalar(*args):
+        return builtins.min(args)
+    return functools.reduce(np.minimum, args)
+
+
+def _max(*args):
+    if len(args) == 1:
+        args = tuple(args[0])
+    if _isScalar(*args):
+        return builtins.max(args)
+    return functools.reduce(np.maximum, args)
+
+
+def _abs(value):
+    return builtins.abs(value) if _isScalar(value) else np.abs(value)
+
+
+def _round(value, digits = None):
+    if _isScalar(value):
+        return builtins.round(value, digits)
+    return np.round(value, digits or 0)
+
+
+def _int(value, *args):
+    if args or isinstance(value, (str, bytes)) or _isScalar(value):
+        return builtins.int(value, *args)
+    return np.trunc(value)
+
+
+def _float(value = 0.0):
+    if isinstance(value, (str, bytes)) or _isScalar(value):
+        return builtins.float(value)
+    return np.asarray(value, dtype = float)
+
+
+def _pow(base, exponent, modulo = None):
+    if modulo is not None or _isScalar(base, exponent):
+        return builtins.pow(base, exponent, modulo)
+    return np.power(base, exponent)
+
+
+class _VectorMath(object):
+    # Funciones de math que aceptan arreglos. Las que no estan aqui se
+    # toman del modulo math
+    sin = staticmethod(np.sin)
+    cos = staticmethod(np.cos)
+    tan = staticmethod(np.tan)
+    asin = staticmethod(np.arcsin)
+    acos = staticmethod(np.arccos)
+    atan = staticmethod(np.arctan)
+    atan2 = staticmethod(np.arctan2)
+    sinh = staticmethod(np.sinh)
+    cosh = staticmethod(np.cosh)
+    tanh = staticmethod(np.tanh)
+    sqrt = staticmethod(np.sqrt)
+    exp = staticmethod(np.exp)
+    floor = staticmethod(np.floor)
+    ceil = staticmethod(np.ceil)
+    trunc = staticmethod(np.trunc)
+    fabs = staticmethod(np.fabs)
+    fmod = staticmethod(np.fmod)
+    hypot = staticmethod(np.hypot)
+    copysign = staticmethod(np.copysign)
+    radians = staticmethod(np.radians)
+    degrees = staticmethod(np.degrees)
+    isnan = staticmethod(np.isnan)
+    isinf = staticmethod(np.isinf)
+    isfinite = staticmethod(np.isfinite)
+    pow = staticmethod(np.power)
+
+    @staticmethod
+    def log(value, base = None):
+        return np.log(value) if base is None else np.log(value) / np.log(base)
+
+    log2 = staticmethod(np.log2)
+    log10 = staticmethod(np.log10)
+
+    def __getattr__(self, name):
+        return getattr(math, name)
+
+
+class _VectorRandom(object):
+    # random.random() y random.uniform() con un valor por fragmento
+    def random(self):
+        return np.random.random(_current[-1].count)
+
+    def uniform(self, low, high):
+        return np.random.uniform(low, high, _current[-1].count)
+
+    def __getattr__(self, name):
+        return getattr(random, name)
+
+
+class _LinearAlgebra(object):
+    @staticmethod
+    def norm(value, *args, **kwargs):
+        value = np.asarray(value, dtype = float)
+        if value.ndim < 2 or args or kwargs:
+            return np.linalg.norm(value, *args, **kwargs)
+        # Componentes en el primer eje y fragmentos en el segundo
+        return np.sqrt((value ** 2).sum(axis = 0))
+
+    def __getattr__(self, name):
+        return getattr(np.linalg, name)
+
+
+class _VectorNumpy(object):
+    # numpy con np.dot y np.linalg.norm para vectores armados con listas
+    # de columnas ([x, y, z] donde cada uno es un arreglo)
+    linalg = _LinearAlgebra()
+
+    @staticmethod
+    def dot(a, b, *args):
+        a = np.asarray(a, dtype = float)
+        b = np.asarray(b, dtype = float)
+        if args or (a.ndim <= 1 and b.ndim <= 1):
+            return np.dot(a, b, *args)
+
+        a = a.reshape(a.shape + (1,) * (2 - a.ndim))
+        b = b.reshape(b.shape + (1,) * (2 - b.ndim))
+        return (a * b).sum(axis = 0)
+
+    def __getattr__(self, name):
+        return getattr(np, name)
+
+
+_vectorNumpy = _VectorNumpy()
+_vectorMath = _VectorMath()
+_vectorRandom = _VectorRandom()
+
+
+def _vectorGlobals(namespace):
+    overrides = {"__UNDEFINED": _UNDEFINED,
+                 "min": _min,
+                 "max": _max,
+                 "abs": _abs,
+                 "round": _round,
+                 "int": _int,
+                 "float": _float,
+                 "pow": _pow}
+
+    # Los modulos se reemplazan con el nombre con que el shader los importo
+    for name, value in namespace.items():
+        if value is math:
+            overrides[name] = _vectorMath
+        elif value is random:
+            overrides[name] = _vectorRandom
+        elif value is np:
+            overrides[name] = _vectorNumpy
+
+    return overrides
@@ -0,0 +1,172 @@
+import heapq
+import numpy as np
+
+# Simplificacion de mallas por colapso de aristas con cuadricas (Garland y
+# Heckbert). Cada colapso junta un vertice con un vecino y el que queda es
+# uno de los originales, asi que las normales y coordenadas de textura de
+# cada nivel se toman de la malla completa sin recalcularlas.
+#
+# Los bordes de la malla se penalizan para que no se encojan. indexedMesh
+# separa los vertices en las costuras de textura, asi que las costuras
+# tambien son bordes y se conservan.
+
+# Cambiar cuando cambie lo que produce la simplificacion, para invalidar
+# los caches
+SIMPLIFY_VERSION = 1
+
+BOUNDARY_WEIGHT = 100.0
+
+
+def vertexQuadrics(positions, indices):
+    # Cuadrica (V,4,4) de cada vertice: la suma de las distancias al
+    # cuadrado a los planos de sus triangulos y, en los bordes, a un plano
+    # perpendicular al triangulo que pasa por la arista
+    a, b, c = (positions[indices[:, i]] for i in range(3))
+    normals = np.cross(b - a, c - a)
+    lengths = np.linalg.norm(normals, axis = 1, keepdims = True)
+
+    # Los triangulos degenerados no aportan un plano
+    with np.errstate(invalid = "ignore", divide = "ignore"):
+        normals = np.nan_to_num(normals / lengths)
+
+    planes = np.column_stack((normals, -np.einsum("ij,ij->i", normals, a)))
+    faceQuadrics = np.einsum("fi,fj->fij", planes, planes)
+
+    quadrics = np.zeros((len(positions), 4, 4))
+    for corner in range(3):
+        np.add.at(quadrics, indices[:, corner], faceQuadrics)
+
+    # Aristas que usa un solo triangulo
+    starts = indices.reshape(-1)
+    ends = np.roll(indices, -1, axis = 1).reshape(-1)
+    pairs = np.sort(np.column_stack((starts, ends)), axis = 1)
+    _, inverse, counts = np.unique(pairs, axis = 0, return_inverse = True, return_counts = True)
+    border = counts[inverse.reshape(-1)] == 1
+
+    if border.any():
+        edgeStarts = positions[starts[border]]
+        edgeNormals = np.cross(positions[ends[border]] - edgeStarts, np.repeat(normals, 3, axis = 0)[border])
+        with np.errstate(invalid = "ignore", divide = "ignore"):
+            edgeNormals = np.nan_to_num(edgeNormals / np.linalg.norm(edgeNormals, axis = 1, keepdims = True))
+
+        edgePlanes = np.column_stack((edgeNormals, -np.einsum("ij,ij->i", edgeNormals, edgeStarts)))
+        edgeQuadrics = BOUNDARY_WEIGHT * np.einsum("fi,fj->fij", edgePlanes, edgePlanes)
+        np.add.at(quadrics, starts[border], edgeQuadrics)
+        np.add.at(quadrics, ends[border], edgeQuadrics)
+
+    return quadrics
+
+
+def simplifyChain(positions, indices, ratio = 0.5, minTriangles = 64, maxLevels = 8):
+    # Cadena de niveles de detalle, del mas fino al mas grueso. Cada nivel
+    # tiene cerca de ratio veces los triangulos del anterior y se detiene
+    # antes de bajar de minTriangles. Retorna una lista de
+    # (vertexIds, indices, error):
+    #   vertexIds (U,)  vertices de la malla original que usa el nivel
+    #   indices   (T,3) triangulos con indices hacia vertexIds
+    #   error     distancia aproximada, en unidades del modelo, entre el
+    #             nivel y la malla original
+    positions = np.asarray(positions, dtype = float).reshape(-1, 3)
+    faces = np.asarray(indices, dtype = np.int64).reshape(-1, 3)
+
+    quadrics = vertexQuadrics(positions, faces)
+    homogeneous = np.column_stack((positions, np.ones(len(positions))))
+
+    faceList = faces.tolist()
+    alive = np.ones(len(faces), dtype = bool)
+    vertexFaces = [set() for _ in range(len(positions))]
+    for face, corners in enumerate(faceList):
+        for vertex in corners:
+            vertexFaces[vertex].add(face)
+
+    # Las entradas del heap guardan la version de sus dos vertices; si
+    # alguno cambio despues, la entrada ya no vale
+    version = [0] * len(positions)
+    heap = []
+
+    def collapseCost(source, target):
+        point = homogeneous[target]
+        return max(float(point @ (quadrics[source] + quadrics[target]) @ point), 0.0)
+
+    def push(a, b):
+        costA = collapseCost(a, b)
+        costB = collapseCost(b, a)
+        if costA <= costB:
+            heapq.heappush(heap, (costA, a, b, version[a], version[b]))
+        else:
+            heapq.heappush(heap, (costB, b, a, version[b], version[a]))
+
+    def neighbors(vertex):
+        return {other for face in vertexFaces[vertex] for other in faceList[face]} - {vertex}
+
+    def faceNormals(corners):
+        a, b, c = (positions[corners[:, i]] for i in range(3))
+        return np.cross(b - a, c - a)
+
+    def canCollapse(source, target):
+        # Los vecinos comunes deben ser solo los de los triangulos que se
+        # eliminan; si no, la malla deja de ser una superficie
+        shared = vertexFaces[source] & vertexFaces[target]
+        opposite = {other for face in shared for other in faceList[face]} - {source, target}
+        if neighbors(source) & neighbors(target) != opposite:
+            return False
+
+        # Ningun triangulo que se mueve puede quedar volteado
+        moving = vertexFaces[source] - shared
+        if not moving:
+            return True
+
+        corners = np.array([faceList[face] for face in moving])
+        moved = np.where(corners == source, target, corners)
+        return bool((np.einsum("ij,ij->i", faceNormals(corners), faceNormals(moved)) > 0).all())
+
+    pairs = np.sort(np.stack((faces, np.roll(faces, -1, axis = 1)), axis = 2).reshape(-1, 2), axis = 1)
+    for a, b in np.unique(pairs, axis = 0).tolist():
+        if a != b:
+            push(a, b)
+
+    levels = []
+    count = int(alive.sum())
+    target = int(count * ratio)
+    error = 0.0
+
+    while len(levels) < maxLevels and target >= minTriangles:
+        if count <= target or not heap:
+            if count == (len(levels[-1][1]) if levels else len(faces)):
+                break
+
+            live = np.asarray(faceList, dtype = np.int64)[alive]
+            vertexIds, local = np.unique(live, return_inverse = True)
+            levels.append((vertexIds, local.reshape(-1, 3).astype(np.int32), float(np.sqrt(error))))
+
+            target = int(count * ratio)
+            continue
+
+        cost, source, destination, sourceVersion, destinationVersion = heapq.heappop(heap)
+        if version[source] != sourceVersion or version[destination] != destinationVersion:
+            continue
+        if not canCollapse(source, destination):
+            continue
+
+        for face in vertexFaces[source]:
+            corners = faceList[face]
+            if destination in corners:
+                alive[face] = False
+                count -= 1
+                for vertex in corners:
+                    if vertex != source:
+                        vertexFaces[vertex].discard(face)
+            else:
+                corners[corners.index(source)] = destination
+                vertexFaces[destination].add(face)
+
+        vertexFaces[source] = set()
+        quadrics[destination] += quadrics[source]
+        error = max(error, cost)
+
+        version[source] += 1
+        version[destination] += 1
+        for other in neighbors(destination):
+            push(destination, other)
+
+    return levels
@@ -0,0 +1,245 @@
+import os
+import weakref
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from MathLib import edgeFunctionRaster
+from shaders import runFragmentShader
+from BMPTexture import BMPTexture
+from Profiler import MAX_ERRORS, describeError
+
+# Rasterizacion en paralelo por bloques (tiles) de pantalla. Los triangulos
+# se clasifican segun los tiles que toca su rectangulo envolvente y cada
+# proceso dibuja tiles completos sobre un frameBuffer y zBuffer en memoria
+# compartida, asi que dos procesos nunca escriben el mismo pixel.
+#
+# En Windows los procesos se crean con "spawn" y vuelven a importar el script
+# principal, que entonces debe estar protegido con if __name__ == "__main__".
+#
+# Las texturas cargadas desde un arreglo (por ejemplo una imagen de pygame)
+# no tienen un archivo que los procesos puedan abrir; sus pixeles se copian
+# una sola vez a memoria compartida y las tareas solo llevan su nombre.
+
+class TileRasterizer(object):
+	def __init__(self, width, height, workers = None, tileSize = 64):
+		self.width = width
+		self.height = height
+		self.tileSize = tileSize
+		self.workers = workers or os.cpu_count()
+
+		self.tilesX = (width + tileSize - 1) // tileSize
+		self.tilesY = (height + tileSize - 1) // tileSize
+
+		self.colorMemory = shared_memory.SharedMemory(create = True, size = width * height * 3)
+		self.depthMemory = shared_memory.SharedMemory(create = True, size = width * height * 4)
+
+		self.frameBuffer = np.ndarray((height, width, 3), dtype = np.uint8, buffer = self.colorMemory.buf)
+		self.zBuffer = np.ndarray((height, width), dtype = np.float32, buffer = self.depthMemory.buf)
+
+		self.pool = ProcessPoolExecutor(self.workers)
+
+		# Textura -> SharedTexture de las texturas sin archivo ya copiadas
+		self.textures = weakref.WeakKeyDictionary()
+
+		self._finalizer = weakref.finalize(self, _release, self.pool, self.colorMemory, self.depthMemory)
+
+	def close(self):
+		# Los arreglos apuntan a la memoria compartida y hay que
+		# soltarlos antes de cerrarla
+		self.frameBuffer = None
+		self.zBuffer = None
+		self._finalizer()
+
+		for shared in list(self.textures.values()):
+			shared.close()
+		self.textures.clear()
+
+	def shareUniforms(self, uniforms):
+		# Cambia la textura de los uniforms por su copia en memoria
+		# compartida si no tiene archivo. Las texturas con archivo ya se
+		# serializan solo con su nombre
+		texture = uniforms.get("texture")
+		if not isinstance(texture, BMPTexture) or texture.filename is not None:
+			return uniforms
+
+		shared = self.textures.get(texture)
+		if shared is None or shared.source is not texture.pixels:
+			if shared is not None:
+				shared.close()
+			shared = self.textures[texture] = SharedTexture(texture.pixels)
+
+		return dict(uniforms, texture = shared)
+
+	def binTriangles(self, triangles):
+		# Retorna una lista de (tile, indices de triangulos) con los
+		# triangulos en el mismo orden en que fueron enviados
+		xs = triangles[:, :, 0]
+		ys = triangles[:, :, 1]
+
+		with np.errstate(invalid = "ignore"):
+			x0 = np.ceil(xs.min(axis = 1))
+			x1 = np.floor(xs.max(axis = 1))
+			y0 = np.ceil(ys.min(axis = 1))
+			y1 = np.floor(ys.max(axis = 1))
+
+			valid = np.isfinite(triangles[:, :, 0:2]).all(axis = (1, 2))
+			valid &= (x0 <= x1) & (y0 <= y1)
+			valid &= (x1 >= 0) & (x0 <= self.width - 1) & (y1 >= 0) & (y0 <= self.height - 1)
+
+		indices = np.flatnonzero(valid)
+		if len(indices) == 0:
+			return []
+
+		tx0 = np.clip(x0[indices], 0, self.width - 1).astype(np.int64) // self.tileSize
+		tx1 = np.clip(x1[indices], 0, self.width - 1).astype(np.int64) // self.tileSize
+		ty0 = np.clip(y0[indices], 0, self.height - 1).astype(np.int64) // self.tileSize
+		ty1 = np.clip(y1[indices], 0, self.height - 1).astype(np.int64) // self.tileSize
+
+		columns = tx1 - tx0 + 1
+		counts = columns * (ty1 - ty0 + 1)
+
+		# Un par (tile, triangulo) por cada tile que toca cada triangulo
+		owner = np.repeat(np.arange(len(indices)), counts)
+		local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+		tiles = (ty0[owner] + local // columns[owner]) * self.tilesX + tx0[owner] + local % columns[owner]
+
+		order = np.argsort(tiles, kind = "stable")
+		tiles = tiles[order]
+		owner = indices[owner[order]]
+
+		starts = np.flatnonzero(np.r_[True, tiles[1:] != tiles[:-1]])
+		return list(zip(tiles[starts].tolist(), np.split(owner, starts[1:])))
+
+	def draw(self, triangles, shader, currColor, dirLight, uniforms, scissor = None):
+		# scissor (x0, y0, x1, y1) limita los tiles a ese rectangulo
+		sx0, sy0, sx1, sy1 = scissor or (0, 0, self.width, self.height)
+
+		uniforms = self.shareUniforms(uniforms)
+
+		tasks = []
+		for tile, indices in self.binTriangles(triangles):
+			x0 = (tile % self.tilesX) * self.tileSize
+			y0 = (tile // self.tilesX) * self.tileSize
+			rect = (max(x0, sx0), max(y0, sy0),
+					min(x0 + self.tileSize, self.width, sx1), min(y0 + self.tileSize, self.height, sy1))
+
+			if rect[0] >= rect[2] or rect[1] >= rect[3]:
+				continue
+
+			tasks.append((self.colorMemory.name, self.depthMemory.name, (self.height, self.width),
+						  rect, triangles[indices], shader, currColor, dirLight, uniforms))
+
+		# Retorna cuantos fragmentos se probaron y pasaron la prueba de
+		# profundidad en todos los tiles, cuantas veces fallo el shader y
+		# los primeros mensajes de error
+		tested = passed = errorCount = 0
+		messages = []
+		chunksize = max(1, len(tasks) // (self.workers * 4))
+		for tileTested, tilePassed, tileErrors, tileMessages in self.pool.map(rasterTile, tasks, chunksize = chunksize):
+			tested += tileTested
+			passed += tilePassed
+			errorCount += tileErrors
+			messages.extend(tileMessages[:max(MAX_ERRORS - len(messages), 0)])
+
+		return tested, passed, errorCount, messages
+
+
+class SharedTexture(object):
+	# Pixeles de una textura en un bloque de memoria compartida. Al
+	# serializarse solo viaja el nombre del bloque, y cada proceso abre la
+	# textura una sola vez
+	def __init__(self, pixels):
+		self.source = pixels
+		self.shape = pixels.shape
+
+		self.memory = shared_memory.SharedMemory(create = True, size = max(pixels.nbytes, 1))
+		np.ndarray(self.shape, dtype = np.uint8, buffer = self.memory.buf)[:] = pixels
+
+		self._finalizer = weakref.finalize(self, _unlink, self.memory)
+
+	def close(self):
+		self._finalizer()
+
+	def __reduce__(self):
+		return (_openSharedTexture, (self.memory.name, self.shape))
+
+
+def _unlink(memory):
+	memory.close()
+	memory.unlink()
+
+
+_sharedTextures = {}
+
+def _openSharedTexture(name, shape):
+	# Los nombres de los bloques no se repiten, asi que la textura abierta
+	# sigue siendo valida mientras el proceso viva
+	texture = _sharedTextures.get(name)
+	if texture is None:
+		pixels = np.ndarray(shape, dtype = np.uint8, buffer = _attach(name).buf)
+		texture = _sharedTextures[name] = BMPTexture(pixels = pixels)
+	return texture
+
+
+def _release(pool, *memories):
+	pool.shutdown()
+
+	for memory in memories:
+		try:
+			memory.close()
+		except BufferError:
+			pass
+		memory.unlink()
+
+
+_attached = {}
+
+def _attach(name):
+	# Cada proceso se conecta una sola vez a cada bloque de memoria. El
+	# proceso principal es el dueno y el unico que la libera
+	if name not in _attached:
+		_attached[name] = shared_memory.SharedMemory(name = name)
+
+	return _attached[name]
+
+
+def rasterTile(task):
+	colorName, depthName, (height, width), rect, triangles, shader, currColor, dirLight, uniforms = task
+
+	frameBuffer = np.ndarray((height, width, 3), dtype = np.uint8, buffer = _attach(colorName).buf)
+	zBuffer = np.ndarray((height, width), dtype = np.float32, buffer = _attach(depthName).buf)
+
+	x0, y0, x1, y1 = rect
+	tested = passed = 0
+
+	# Los errores del shader se cuentan aqui y se reportan al profiler del
+	# proceso principal
+	errors = []
+	def onError(error):
+		errors.append(describeError(error))
+
+	for verts in triangles:
+		A, B, C = verts.tolist()
+		raster = edgeFunctionRaster(A, B, C, x0, y0, x1, y1)
+
+		if raster is None:
+			continue
+
+		xs, ys, bCoords, z = raster
+
+		visible = z < zBuffer[ys, xs]
+		tested += len(xs)
+		if not visible.any():
+			continue
+
+		xs = xs[visible]
+		ys = ys[visible]
+		bCoords = bCoords[visible]
+		passed += len(xs)
+
+		zBuffer[ys, xs] = z[visible]
+		frameBuffer[ys, xs] = runFragmentShader(shader, np.broadcast_to(verts, (len(xs),) + verts.shape),
+												bCoords, bCoords @ verts, currColor, dirLight,
+												onError = onError, **uniforms)
+
+	return tested, passed, len(errors), errors[:MAX_ERRORS]
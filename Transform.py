@@ -0,0 +1,117 @@
+from MathLib import *
+import numpy as np
+
+class Transform(object):
+    # Nodo de una jerarquia de transformaciones. Guarda la matriz local
+    # (traslacion * rotacion * escala) y la matriz de mundo
+    # (padre * local) y solo las recalcula cuando cambian la traslacion,
+    # la rotacion o la escala del nodo o de alguno de sus padres.
+    #
+    # translation, rotation y scale se pueden reemplazar o modificar por
+    # componente (model.rotation[1] += 45); ambas formas marcan el nodo.
+    def __init__(self):
+        self.parent = None
+        self.children = []
+
+        self._localMatrix = None
+        self._worldMatrix = None
+
+        # Aumenta cada vez que cambia la matriz de mundo
+        self.worldVersion = 0
+
+        self.translation = [0, 0, 0]
+        self.rotation = [0, 0, 0]
+        self.scale = [1, 1, 1]
+
+    @property
+    def translation(self):
+        return self._translation
+
+    @translation.setter
+    def translation(self, values):
+        self._translation = _TransformVector(self, values)
+        self.MarkDirty()
+
+    @property
+    def rotation(self):
+        return self._rotation
+
+    @rotation.setter
+    def rotation(self, values):
+        self._rotation = _TransformVector(self, values)
+        self.MarkDirty()
+
+    @property
+    def scale(self):
+        return self._scale
+
+    @scale.setter
+    def scale(self, values):
+        self._scale = _TransformVector(self, values)
+        self.MarkDirty()
+
+    def AddChild(self, child):
+        if child.parent is not None:
+            child.parent.RemoveChild(child)
+        child.parent = self
+        self.children.append(child)
+        child.MarkDirty(local = False)
+        return child
+
+    def RemoveChild(self, child):
+        self.children.remove(child)
+        child.parent = None
+        child.MarkDirty(local = False)
+
+    def MarkDirty(self, local = True):
+        # Invalida la matriz local de este nodo y la de mundo de todo su
+        # subarbol. Un nodo que ya estaba invalido no necesita recorrer
+        # sus hijos otra vez
+        if local:
+            self._localMatrix = None
+
+        if self._worldMatrix is None:
+            return
+
+        self._worldMatrix = None
+        self.worldVersion += 1
+        for child in self.children:
+            child.MarkDirty(local = False)
+
+    def BuildLocalMatrix(self):
+        translateMat = TranslationMatrix(*self._translation)
+        rotateMat = RotationMatrix(*self._rotation)
+        scaleMat = ScaleMatrix(*self._scale)
+
+        return translateMat * rotateMat * scaleMat
+
+    def GetLocalMatrix(self):
+        if self._localMatrix is None:
+            self._localMatrix = _readOnly(self.BuildLocalMatrix())
+        return self._localMatrix
+
+    def GetWorldMatrix(self):
+        # Las matrices retornadas son compartidas y de solo lectura
+        if self._worldMatrix is None:
+            if self.parent is None:
+                self._worldMatrix = self.GetLocalMatrix()
+            else:
+                self._worldMatrix = _readOnly(self.parent.GetWorldMatrix() * self.GetLocalMatrix())
+        return self._worldMatrix
+
+
+class _TransformVector(list):
+    # Lista de tres componentes que avisa a su nodo cuando se modifica
+    def __init__(self, owner, values):
+        super().__init__(float(value) for value in values)
+        self.owner = owner
+
+    def __setitem__(self, index, value):
+        super().__setitem__(index, value)
+        self.owner.MarkDirty()
+
+
+def _readOnly(matrix):
+    matrix = np.matrix(matrix, dtype = float)
+    matrix.flags.writeable = False
+    return matrix
@@ -1,12 +1,50 @@
-from MathLib import barycentricCoords
+from MathLib import barycentricCoords, edgeFunctionRaster
 from math import isclose, tan, pi
 import numpy as np
-from camera import Camera
+from Camera import Camera
+from shaders import runFragmentShader
+from TileRaster import TileRasterizer
+from Profiler import FrameProfiler
 
 POINTS = 0
 LINES = 1
 TRIANGLES = 2
 
+# Modos de rasterizacion de triangulos
+SCANLINE = 0
+EDGE_FUNCTION = 1
+
+# Descarte de caras
+CULL_NONE = 0
+CULL_BACK = 1
+CULL_FRONT = 2
+
+# Orden de los vertices de las caras frontales
+CCW = 0
+CW = 1
+
+# Nombre de la etapa del profiler que dibuja cada tipo de primitiva
+STAGE_NAMES = {POINTS: "points", LINES: "lines", TRIANGLES: "raster"}
+
+# Triangulos que se rasterizan entre cada actualizacion de la piramide de
+# profundidad, ver glHiZOccluded
+OCCLUSION_BLOCK = 128
+
+# Margen de la prueba de oclusion por el redondeo de la profundidad
+# interpolada
+HIZ_EPSILON = 1e-6
+
+class OffscreenTarget(object):
+	# Destino de render sin ventana: no necesita pygame ni un driver de
+	# video, solo define el tamano. La imagen queda en Renderer.frameBuffer
+	def __init__(self, width, height):
+		self.width = width
+		self.height = height
+
+	def get_rect(self):
+		return (0, 0, self.width, self.height)
+
+
 class Renderer(object):
 	def __init__(self, screen):
 		self.screen = screen
@@ -19,15 +57,68 @@ class Renderer(object):
 		self.glColor(1,1,1)
 		self.glClearColor(0,0,0)
 
+		# En modo diferido la geometria solo escribe el G-buffer y el
+		# fragment shader corre una vez por pixel en glResolve
+		self.deferred = False
+
+		# Rasterizador en paralelo por tiles, ver glParallel
+		self.tileRasterizer = None
+
+		# Tiempos por etapa y contadores de cada frame, ver Profiler.py.
+		# Cada glClear empieza un frame nuevo
+		self.profiler = FrameProfiler()
+
+		# Rectangulo (x0, y0, x1, y1) fuera del cual no se dibuja, o None
+		# para toda la ventana. glUpdate lo usa para redibujar solo lo que
+		# cambio
+		self.scissor = None
+
+		# Rectangulo de pantalla que ocupo cada modelo en el ultimo frame y
+		# estado de la escena con el que se dibujo, ver glUpdate
+		self.screenBounds = {}
+		self.lastSceneKey = None
+		self.lastModelKeys = {}
+
 		self.glClear()
+		self.profiler.reset()
 
 		self.primitiveType = TRIANGLES
+		self.rasterMode = SCANLINE
+
+		# Las lineas del modo LINES se ocultan detras de lo que ya esta
+		# en el zBuffer
+		self.lineDepthTest = False
+
+		# Lado en pixeles del cuadrado de cada punto del modo POINTS
+		self.pointSize = 1
+
+		# Descarta meshlets completos fuera del volumen de vista o de
+		# espaldas antes de la etapa de vertices, ver glCullMeshlets
+		self.clusterCulling = True
+
+		# Descarta triangulos y modelos tapados por lo que ya esta en el
+		# zBuffer con una piramide de profundidades maximas (ver
+		# glHiZOccluded). No cambia la imagen
+		self.occlusionCulling = True
+
+		# Dibuja los modelos y sus meshlets de adelante hacia atras para que
+		# lo que tapa llegue primero al zBuffer. Cambia el orden de dibujo,
+		# asi que en pixeles con la misma profundidad puede cambiar cual queda
+		self.depthSort = False
+
+		# Error maximo en pixeles al elegir el nivel de detalle de los
+		# modelos con model.lods, o None para usar siempre la malla completa
+		self.lodThreshold = 1.0
+
+		self.cullFace = CULL_NONE
+		self.frontFace = CCW
 
 		self.models = []
 
 		self.activeModelMatrix = None
 		self.activeVertexShader = None
 		self.activeFragmentShader = None
+		self.activeUniforms = {}
 
 		self.dirLight = [1,0,0]
 
@@ -71,26 +162,141 @@ class Renderer(object):
 
 		self.currColor = [r,g,b]
 
-	def glClear(self):
+	def glClear(self, rect = None):
+		# rect (x0, y0, x1, y1) limpia solo esa region de los buffers
+		self.profiler.beginFrame()
+
+		with self.profiler.stage("clear"):
+			self.glClearBuffers(rect)
+
+	def glClearBuffers(self, rect):
 		color = [int(i * 255) for i in self.clearColor]
-		self.screen.fill(color)
 
-		self.frameBuffer = [[color for y in range(self.height)]
-							for x in range(self.width)]
-		
-		self.zBuffer = [[float("inf") for y in range(self.height)]
-				  		for x in range(self.width)]
-	
+		# Los buffers son arreglos contiguos que se reutilizan entre frames:
+		# color (alto, ancho, 3) en uint8 y profundidad (alto, ancho) en float32.
+		# La fila 0 es la de abajo, igual que en el BMP
+		if getattr(self, "frameBuffer", None) is None or self.frameBuffer.shape != (self.height, self.width, 3):
+			self.frameBuffer = np.empty((self.height, self.width, 3), dtype = np.uint8)
+			self.zBuffer = np.empty((self.height, self.width), dtype = np.float32)
 
+		if rect is None:
+			self.frameBuffer[:] = color
+			self.zBuffer.fill(np.inf)
+		else:
+			x0, y0, x1, y1 = rect
+			self.frameBuffer[y0:y1, x0:x1] = color
+			self.zBuffer[y0:y1, x0:x1] = np.inf
+
+		# Un frame dibujado sin glUpdate invalida el estado guardado
+		self.lastSceneKey = None
+
+		# La piramide de profundidad se vuelve a armar con el zBuffer limpio
+		self.hiZ = None
+		self.hiZDirty = None
+
+		# Contadores del ensamblaje de primitivas para este frame. Son los
+		# mismos contadores del profiler
+		self.primitiveStats = self.profiler.counters
+		self.primitiveStats.update({"verticesTransformed": 0,
+									"lodTrianglesSkipped": 0,
+									"meshletsTested": 0,
+									"meshletsFrustumCulled": 0,
+									"meshletsBackfaceCulled": 0,
+									"modelsOccluded": 0,
+									"instancesCulled": 0,
+									"occlusionCulled": 0,
+									"submitted": 0,
+									"frustumCulled": 0,
+									"backfaceCulled": 0,
+									"nearClipped": 0,
+									"clipGenerated": 0,
+									"assembled": 0,
+									"trianglesRasterized": 0,
+									"fragmentsTested": 0,
+									"fragmentsPassed": 0,
+									"fragmentsShaded": 0,
+									"pixelsCovered": 0,
+									"shaderErrors": 0})
+
+		if self.deferred:
+			# G-buffer: id del triangulo visible y sus coordenadas
+			# baricentricas; glResolve interpola con ellas todos los atributos.
+			# La profundidad es el mismo zBuffer
+			if getattr(self, "gTriangleId", None) is None or self.gTriangleId.shape != self.zBuffer.shape:
+				self.gTriangleId = np.empty((self.height, self.width), dtype = np.int32)
+				self.gBCoords = np.empty((self.height, self.width, 3), dtype = np.float32)
+
+			# Los ids son de los triangulos de este frame, asi que se
+			# limpian completos aunque solo se limpie un rectangulo
+			self.gTriangleId.fill(-1)
+			self.gBatches = []
+			self.gTriangleCount = 0
+
+
+	def glParallel(self, workers = None, tileSize = 64):
+		# Activa la rasterizacion de triangulos en varios procesos por tiles
+		# de tileSize x tileSize pixeles. workers = None usa todos los
+		# nucleos y workers = 0 regresa al rasterizador de un solo proceso.
+		# Los tiles se rasterizan con funciones de arista, asi que solo se
+		# usan con rasterMode EDGE_FUNCTION y sin modo diferido; en los
+		# demas casos se sigue dibujando en un solo proceso, ver glTiled
+		if self.tileRasterizer is not None:
+			self.frameBuffer = self.frameBuffer.copy()
+			self.zBuffer = self.zBuffer.copy()
+			self.tileRasterizer.close()
+			self.tileRasterizer = None
+
+		if workers == 0:
+			return
 
-	def glPoint(self, x, y, color):
-    # Pygame empieza a renderizar desde la esquina
-    # superior izquierda, hay que voltear la Y
+		self.tileRasterizer = TileRasterizer(self.width, self.height, workers, tileSize)
+
+		# Los buffers pasan a vivir en la memoria compartida
+		self.tileRasterizer.frameBuffer[:] = self.frameBuffer
+		self.tileRasterizer.zBuffer[:] = self.zBuffer
+		self.frameBuffer = self.tileRasterizer.frameBuffer
+		self.zBuffer = self.tileRasterizer.zBuffer
+
+
+	def glTiled(self):
+		# Los tiles dan la misma imagen que el rasterizador de un solo
+		# proceso solo con funciones de arista, y el modo diferido necesita
+		# el G-buffer de este proceso
+		return self.tileRasterizer is not None and self.rasterMode == EDGE_FUNCTION and not self.deferred
+
+	def glPresent(self, rect = None):
+		# Sin ventana no hay nada que copiar
+		if isinstance(self.screen, OffscreenTarget):
+			return
+
+		with self.profiler.stage("present"):
+			self.glPresentRect(rect)
+
+	def glPresentRect(self, rect):
+		# pygame solo se importa si hay una superficie donde presentar
+		import pygame.surfarray
+
+		# Copia el frameBuffer completo a la superficie de pygame en una sola
+		# operacion. Pygame empieza desde la esquina superior izquierda y
+		# espera el arreglo como (ancho, alto), hay que voltear la Y
+		if rect is None:
+			pygame.surfarray.blit_array(self.screen, self.frameBuffer[::-1].swapaxes(0, 1))
+			return
 
+		# Solo el rectangulo (x0, y0, x1, y1) que cambio
+		x0, y0, x1, y1 = rect
+		pixels = pygame.surfarray.pixels3d(self.screen)
+		pixels[x0:x1, self.height - y1:self.height - y0] = self.frameBuffer[y0:y1, x0:x1][::-1].swapaxes(0, 1)
+		del pixels
+
+
+	def glPoint(self, x, y, color):
 		x = round(x)
 		y = round(y)
 
-		if (0 <= x < self.width) and (0 <= y < self.height):
+		x0, y0, x1, y1 = self.glScissorRect()
+
+		if (x0 <= x < x1) and (y0 <= y < y1):
 			if color is None:
 				color = self.currColor
 			
@@ -105,10 +311,7 @@ class Renderer(object):
 				color = [int(i * 255) for i in self.currColor]
 
 			# Asegurar que solo tengamos 3 componentes RGB
-			color = color[:3]
-			
-			self.screen.set_at((x, self.height - 1 - y), color)
-			self.frameBuffer[x][y] = color
+			self.frameBuffer[y, x] = color[:3]
 
 
 	def glLine(self, p0, p1, color = None):
@@ -122,7 +325,7 @@ class Renderer(object):
 
 		# Si el punto 0 es igual que el punto 1, solamente dibujar un punto
 		if x0 == x1 and y0 == y1:
-			self.glPoint(x0, y0)
+			self.glPoint(x0, y0, color)
 			return
 
 		dy = abs(y1 - y0)
@@ -238,7 +441,13 @@ class Renderer(object):
 
 			D = [ A[0] + ((B[1] - A[1]) / (C[1] - A[1])) * (C[0] - A[0]), B[1] ]
 
-			u, v, w = barycentricCoords(A, B, C, D)
+			# Sin area (los tres vertices en una linea) ningun pixel tiene
+			# coordenadas baricentricas validas, asi que no hay nada que dibujar
+			bCoords = barycentricCoords(A, B, C, D)
+			if bCoords is None:
+				return
+
+			u, v, w = bCoords
 			for i in range(2, len(A)):
 				D.append(u*A[2] + v*B[2] + w*C[2])
 
@@ -251,7 +460,8 @@ class Renderer(object):
 		y = P[1]
 
 		# Si el punto no esta dentro de la ventana, lo descartamos
-		if not(0 <= x < self.width) or not (0 <= y < self.height):
+		x0, y0, x1, y1 = self.glScissorRect()
+		if not(x0 <= x < x1) or not (y0 <= y < y1):
 			return
 		
 		# Obtenemos las coordenadas baricentricas para el punto P
@@ -266,158 +476,1013 @@ class Renderer(object):
 		if not isclose(u+v+w, 1.0):
 			return
 
-		z = u * A[2] + v * B[2] + w * C[2]
+		self.glShadeFragments(np.array((A, B, C)), np.array([x]), np.array([y]), np.array([bCoords]))
+
+	def glTriangleEdge(self, A, B, C):
+		# Rasterizacion con funciones de arista: todos los pixeles cubiertos
+		# del rectangulo envolvente se calculan de una vez con numpy
+		raster = edgeFunctionRaster(A, B, C, *self.glScissorRect())
+
+		if raster is None:
+			return
+
+		xs, ys, bCoords, _ = raster
+		self.glShadeFragments(np.array((A, B, C)), xs, ys, bCoords)
 
-		# Si el valor de z para este punto es mayor que 
+	def glShadeFragments(self, verts, xs, ys, bCoords):
+		# verts: vertices (3,K) del triangulo. xs, ys y bCoords describen
+		# todos los fragmentos del triangulo que caen dentro de la ventana
+		z = bCoords @ verts[:, 2]
+
+		# Si el valor de z para un pixel es mayor que 
 		# el valor guardado en el zBuffer, el pizel esta mas lejos
 		#  entonces descarto el pixel
+		passed = z < self.zBuffer[ys, xs]
+
+		stats = self.primitiveStats
+		stats["fragmentsTested"] += len(xs)
+
+		if not passed.all():
+			xs = xs[passed]
+			ys = ys[passed]
+			bCoords = bCoords[passed]
+			z = z[passed]
 
-		if z >= self.zBuffer[x][y]:
+		if len(xs) == 0:
 			return
-		
-		self.zBuffer[x][y] = z
 
-		color = None
-		if self.activeFragmentShader:
-			try:
-				color = self.activeFragmentShader(verts = [A, B, C],
-												bCoords = [u, v, w],
-												pixelColor = self.currColor, 
-												dirLight = self.dirLight)
-			except Exception as e:
-				print(f"Error in fragment shader: {e}")
-				print(f"A = {A}, B = {B}, C = {C}")
-				color = self.currColor
+		stats["fragmentsPassed"] += len(xs)
+		self.zBuffer[ys, xs] = z
 
-		# Validar y corregir el color si es necesario
-		if color is None:
-			color = self.currColor
-		elif isinstance(color, (list, tuple)):
-			# Asegurar que el color tenga exactamente 3 componentes
-			if len(color) < 3:
-				color = list(color) + [0] * (3 - len(color))
-			elif len(color) > 3:
-				color = color[:3]
-			
-			# Asegurar que los valores estén en rango 0-1
-			color = [max(0, min(1, c)) if isinstance(c, (int, float)) else 0 for c in color]
-		else:
-			color = self.currColor
+		if self.deferred:
+			self.gTriangleId[ys, xs] = self.activeTriangleId
+			self.gBCoords[ys, xs] = bCoords
+			return
+
+		self.frameBuffer[ys, xs] = self.glRunFragmentShader(np.broadcast_to(verts, (len(xs),) + verts.shape),
+															bCoords, bCoords @ verts)
+
+	def glRunFragmentShader(self, verts, bCoords, attributes):
+		# Ejecuta el fragment shader activo sobre un lote de fragmentos y
+		# retorna sus colores (N,3) en uint8. verts es (N,3,K) y
+		# attributes (N,K) son los atributos ya interpolados
+		self.primitiveStats["fragmentsShaded"] += len(bCoords)
+
+		with self.profiler.stage("fragment"):
+			return runFragmentShader(self.activeFragmentShader, verts, bCoords, attributes,
+									 self.currColor, self.dirLight, onError = self.profiler.shaderError,
+									 **self.activeUniforms)
 
-		self.glPoint(x, y, color)
+	def glScissorRect(self):
+		if self.scissor is None:
+			return (0, 0, self.width, self.height)
+		return self.scissor
 
+	def glResolve(self):
+		# Pase de resolucion del modo diferido: el fragment shader de cada
+		# modelo corre exactamente una vez por cada pixel visible suyo
+		ids = self.gTriangleId.ravel()
+		bCoordsBuffer = self.gBCoords.reshape(-1, 3)
+		frameBuffer = self.frameBuffer.reshape(-1, 3)
 
+		for base, triangles, shader, uniforms in self.gBatches:
+			pixels = np.flatnonzero((ids >= base) & (ids < base + len(triangles)))
+
+			if len(pixels) == 0:
+				continue
+
+			verts = triangles[ids[pixels] - base]
+			bCoords = bCoordsBuffer[pixels].astype(float)
+
+			self.activeFragmentShader = shader
+			self.activeUniforms = uniforms
+			frameBuffer[pixels] = self.glRunFragmentShader(verts, bCoords,
+															np.einsum("ni,nik->nk", bCoords, verts))
 
 	def glRender(self):
-		for model in self.models:
+		# La matriz de vista solo cambia entre frames, no entre vertices
+		viewMatrix = self.camera.GetViewMatrix()
+
+		models = self.models
+		if self.depthSort:
+			models = sorted(models, key = lambda model: self.glModelDistance(model, viewMatrix))
+
+		for model in models:
 			self.activeModelMatrix = model.GetModelMatrix()
 			self.activeVertexShader = model.vertexShader
 			self.activeFragmentShader = model.fragmentShader
 
-			vertexBuffer = []
-			triangle_index = 0
-			
-			# Calcular número de vértices (cada vértice tiene 3 componentes: x, y, z)
-			vertex_count = len(model.vertices) // 3
-			has_normals = hasattr(model, 'normals') and model.normals and (len(model.normals) >= len(model.vertices))
-
-			# Procesar vértices de 3 en 3 para formar triángulos
-			for i in range(0, vertex_count, 3):  
-				for j in range(3):  # Para cada vértice del triángulo
-					vertex_idx = i + j
-					idx = vertex_idx * 3  # Índice en el array de vértices
-					
-					if idx + 2 >= len(model.vertices): 
-						break
-						
-					# Extraer coordenadas del vértice
-					x = model.vertices[idx]
-					y = model.vertices[idx + 1]
-					z = model.vertices[idx + 2]
-					
-					# Crear vértice
-					vertex = [x, y, z]
-					
-					# Extraer normal si está disponible
-					if has_normals and idx + 2 < len(model.normals):
-						nx = model.normals[idx]
-						ny = model.normals[idx + 1]
-						nz = model.normals[idx + 2]
-						normal = [nx, ny, nz]
-					else:
-						# Normal por defecto
-						normal = [0, 0, 1]
-
-					# Aplicar vertex shader si está disponible
-					if self.activeVertexShader:
-						# El vertex shader retorna (vt, nt) como tupla
-						vt, nt = self.activeVertexShader(
-							vertex,
-							modelMatrix=self.activeModelMatrix,
-							triangle_index=triangle_index,
-							normal=normal,
-							viewMatrix = self.camera.GetViewMatrix(),
-							projectionMatrix = self.projectionMatrix,
-							viewportMatrix = self.viewportMatrix)
-						
-						# Combinar posición transformada y normal transformada
-						# Convertir nt de numpy array a lista si es necesario
-						if hasattr(nt, 'tolist'):
-							nt = nt.tolist()
-						
-						transformed_vertex = vt + nt
-						
-						for component in transformed_vertex:
-							vertexBuffer.append(component)
-					else:
-						# Si no hay vertex shader, usar vértice original con normal
-						vertex_with_normal = vertex + normal
-						for component in vertex_with_normal:
-							vertexBuffer.append(component)
-				
-				triangle_index += 1
-
-			
-			self.glDrawPrimitives(vertexBuffer, 6)
-
+			# Solo las instancias dentro del volumen de vista pasan a la etapa
+			# de vertices
+			instances = None
+			if model.instanced:
+				instances = self.glCullInstances(model, viewMatrix)
+				if len(instances) == 0:
+					self.screenBounds[model] = None
+					continue
+
+			# Un modelo tapado por completo no pasa por ninguna etapa
+			elif self.occlusionCulling and self.primitiveType == TRIANGLES:
+				rect, nearest = self.glSphereScreenRect(model, viewMatrix)
+				if rect is not None and self.glHiZOccluded(np.array([rect]), np.array([nearest]))[0]:
+					self.primitiveStats["modelsOccluded"] += 1
+					self.screenBounds[model] = self.glBoundsRect(np.array(rect, dtype = float).reshape(2, 2))
+					continue
+
+			model.lodLevel = self.glSelectLOD(model, viewMatrix)
+			self.primitiveStats["lodTrianglesSkipped"] += model.GetTriangleCount(0) - model.GetTriangleCount(model.lodLevel)
+
+			indices = model.GetIndexArray()
+			vertexIds = None
+			visible = None
+
+			with self.profiler.stage("vertex"):
+				if getattr(self.activeVertexShader, "isBatch", False):
+					# Solo se transforman los vertices de los meshlets visibles
+					visible = None if model.instanced else self.glCullMeshlets(model, viewMatrix)
+					if visible is not None:
+						indices = indices[visible]
+						used = np.zeros(len(model.GetVertexArray()), dtype = bool)
+						used[indices] = True
+						vertexIds = np.flatnonzero(used)
+						indices = (np.cumsum(used) - 1)[indices]
+
+					positions, attributes = self.glVertexStage(model, viewMatrix, vertexIds, instances)
+				elif model.instanced:
+					# Los vertex shaders por vertice corren una vez por
+					# instancia con su matriz
+					vertexBuffer = []
+					for matrix in model.GetInstanceMatrices()[instances]:
+						self.activeModelMatrix = np.asmatrix(matrix)
+						vertexBuffer += self.glVertexStageLegacy(model, viewMatrix)
+					vertexBuffer = np.asarray(vertexBuffer, dtype = float).reshape(-1, 6)
+					positions = np.column_stack((vertexBuffer[:, 0:3], np.ones(len(vertexBuffer))))
+					attributes = vertexBuffer[:, 3:6]
+				else:
+					# Los vertex shaders por vertice ya dividen entre w
+					vertexBuffer = np.asarray(self.glVertexStageLegacy(model, viewMatrix), dtype = float).reshape(-1, 6)
+					positions = np.column_stack((vertexBuffer[:, 0:3], np.ones(len(vertexBuffer))))
+					attributes = vertexBuffer[:, 3:6]
+
+			self.primitiveStats["verticesTransformed"] += len(positions)
+
+			# Las coordenadas de textura no se transforman, solo viajan en el
+			# buffer de vertices detras de la normal para interpolarse
+			layout = {"position": slice(0, 3), "normal": slice(3, 6)}
+			texcoords = model.GetTexcoordArray()
+			if texcoords is not None:
+				if vertexIds is not None:
+					texcoords = texcoords[vertexIds]
+				if model.instanced:
+					texcoords = np.tile(texcoords, (len(instances), 1))
+				attributes = np.column_stack((attributes, texcoords))
+				layout["texcoord"] = slice(6, 8)
+
+			if model.instanced:
+				# Los indices de cada instancia apuntan a sus propios vertices
+				vertexCount = len(model.GetVertexArray())
+				indices = (indices + (np.arange(len(instances)) * vertexCount)[:, None, None]).reshape(-1, 3)
+
+				# El color de cada instancia viaja con sus vertices, ver
+				# runFragmentShader
+				if model.colors is not None:
+					first = 3 + attributes.shape[1]
+					attributes = np.column_stack((attributes, np.repeat(model.colors[instances], vertexCount, axis = 0)))
+					layout["color"] = slice(first, first + 3)
+
+			self.activeUniforms = {"layout": layout, "texture": model.texture}
+
+			with self.profiler.stage("assembly"):
+				vertexBuffer, triangleIds = self.glPrimitiveAssembly(positions, attributes, indices, sourceIds = True)
+
+			if visible is not None:
+				# Los ids y posiciones vuelven a ser los de la malla completa
+				# para las aristas y puntos del modelo
+				triangleIds = np.where(triangleIds >= 0, visible[np.maximum(triangleIds, 0)],
+									   -1 - visible[np.maximum(-1 - triangleIds, 0)])
+				if self.primitiveType in (LINES, POINTS):
+					full = np.full((len(model.GetVertexArray()), 4), np.nan)
+					full[vertexIds] = positions
+					positions = full
+
+			self.screenBounds[model] = self.glBoundsRect(vertexBuffer[:, 0:2])
+
+			with self.profiler.stage(STAGE_NAMES.get(self.primitiveType, "raster")):
+				if self.primitiveType == LINES:
+					self.glDrawWireframe(model, positions, vertexBuffer, triangleIds)
+				elif self.primitiveType == POINTS:
+					# Los puntos se dibujan como cuadrados, asi que el
+					# rectangulo sale de los puntos dibujados con su margen
+					points = self.glDrawPointCloud(model, positions, triangleIds)
+					self.screenBounds[model] = self.glBoundsRect(points[:, 0:2], self.glPointMargin())
+				else:
+					self.glDrawPrimitives(vertexBuffer, vertexBuffer.shape[1])
+
+		if self.deferred:
+			with self.profiler.stage("resolve"):
+				self.glResolve()
+
+		# Pixeles con alguna geometria, para calcular el overdraw
+		x0, y0, x1, y1 = self.glScissorRect()
+		self.primitiveStats["pixelsCovered"] += int(np.isfinite(self.zBuffer[y0:y1, x0:x1]).sum())
+
+
+	def glUpdate(self):
+		# Dibuja el frame solo si algo cambio desde el ultimo glUpdate.
+		# Si cambio la camara, la configuracion o la lista de modelos se
+		# redibuja todo; si solo cambiaron algunos modelos se limpia y
+		# redibuja el rectangulo que cubre donde estaban y donde quedaron.
+		# Retorna el rectangulo (x0, y0, x1, y1) redibujado, o None si el
+		# frame es igual al anterior.
+		#
+		# Los cambios dentro de los arreglos de vertices de un modelo no se
+		# detectan; hay que asignar un arreglo nuevo
+		viewMatrix = self.camera.GetViewMatrix()
+
+		sceneKey = self.glSceneKey()
+		modelKeys = {model: self.glModelKey(model) for model in self.models}
+
+		fullRect = (0, 0, self.width, self.height)
+		rect = fullRect
+
+		if sceneKey == self.lastSceneKey:
+			changed = [model for model in self.models if modelKeys[model] != self.lastModelKeys.get(model)]
+			if not changed:
+				return None
+
+			rect = None
+			for model in changed:
+				rect = self.glUnionRect(rect, self.screenBounds.get(model))
+				rect = self.glUnionRect(rect, self.glScreenBounds(model, viewMatrix))
+
+		if rect is not None:
+			if rect == fullRect:
+				self.glClear()
+			else:
+				self.glClear(rect)
+				self.scissor = rect
 
+			try:
+				self.glRender()
+			finally:
+				self.scissor = None
+
+		self.lastSceneKey = sceneKey
+		self.lastModelKeys = modelKeys
+
+		return rect
+
+	def glSceneKey(self):
+		# Todo lo que afecta a todos los modelos a la vez
+		return (self.width, self.height,
+				self.camera.worldVersion, id(self.camera),
+				self.viewportMatrix.tobytes(), self.projectionMatrix.tobytes(),
+				self.primitiveType, self.rasterMode, self.cullFace, self.frontFace, self.deferred, self.lineDepthTest, self.pointSize, self.lodThreshold, self.clusterCulling, self.depthSort,
+				tuple(self.currColor), tuple(self.clearColor), tuple(self.dirLight),
+				tuple(id(model) for model in self.models))
+
+	def glModelKey(self, model):
+		# Un shader animado cambia en cada frame
+		if getattr(model.fragmentShader, "isAnimated", False):
+			return object()
+
+		model.GetWorldMatrix()
+		return (model.worldVersion, model.vertexShader, model.fragmentShader, id(model.texture),
+				id(model.vertices), len(model.vertices), id(model.normals),
+				id(model.indices), id(model.texcoords), id(model.lods),
+				getattr(model, "instanceVersion", None))
+
+	def glScreenBounds(self, model, viewMatrix):
+		# Rectangulo de pantalla que ocupara el modelo, sin rasterizarlo.
+		# Si algun vertice queda detras de la camara, o el vertex shader no
+		# es en lote, se usa la ventana completa
+		if not getattr(model.vertexShader, "isBatch", False):
+			return (0, 0, self.width, self.height)
+
+		self.activeModelMatrix = model.GetModelMatrix()
+		self.activeVertexShader = model.vertexShader
+		model.lodLevel = self.glSelectLOD(model, viewMatrix)
+		positions, _ = self.glVertexStage(model, viewMatrix)
+
+		if len(positions) == 0:
+			return None
+
+		w = positions[:, 3:4]
+		if (w <= 0).any():
+			return (0, 0, self.width, self.height)
+
+		return self.glBoundsRect(positions[:, 0:2] / w, self.glPointMargin())
+
+	def glModelDistance(self, model, viewMatrix):
+		# Distancia del centro de la esfera envolvente a la camara, a lo
+		# largo de la direccion de vista
+		center, _ = model.GetBoundingSphere()
+		modelView = np.asarray(viewMatrix) @ np.asarray(model.GetModelMatrix())
+		return -(modelView @ np.append(center, 1))[2]
+
+	def glSphereScreenRect(self, model, viewMatrix):
+		# Rectangulo de pantalla (x0, y0, x1, y1) y profundidad mas cercana
+		# de la esfera envolvente del modelo, con la caja que la contiene en
+		# coordenadas de vista. (None, None) si la caja cruza el plano de
+		# la camara
+		center, radius = model.GetBoundingSphere()
+		modelView = np.asarray(viewMatrix) @ np.asarray(model.GetModelMatrix())
+		radius *= np.linalg.norm(modelView[:3, :3], axis = 0).max()
+		viewCenter = (modelView @ np.append(center, 1))[0:3]
+
+		if viewCenter[2] + radius >= 0:
+			return None, None
+
+		corners = viewCenter + radius * np.array([[x, y, z] for x in (-1, 1) for y in (-1, 1) for z in (-1, 1)])
+		clip = np.column_stack((corners, np.ones(8))) @ np.asarray(self.viewportMatrix * self.projectionMatrix).T
+		screen = self.glPerspectiveDivide(clip)
+
+		low = screen.min(axis = 0)
+		high = screen.max(axis = 0)
+		return (low[0], low[1], high[0], high[1]), low[2]
+
+	def glHiZLevels(self):
+		# Piramide de profundidades maximas: el nivel k guarda el maximo de
+		# cada bloque de 2^k x 2^k pixeles del zBuffer y el nivel 0 es el
+		# zBuffer mismo. Dentro de un frame el zBuffer solo baja, asi que
+		# una piramide atrasada sigue siendo valida; solo se recalcula la
+		# region hiZDirty para que descarte mas
+		if self.hiZ is None or self.hiZ[0] is not self.zBuffer:
+			levels = [self.zBuffer]
+			while levels[-1].shape[0] > 1 or levels[-1].shape[1] > 1:
+				levels.append(_blockMax(levels[-1]))
+			self.hiZ = levels
+
+		elif self.hiZDirty is not None:
+			x0, y0, x1, y1 = self.hiZDirty
+			for k in range(1, len(self.hiZ)):
+				x0, y0 = x0 // 2, y0 // 2
+				x1, y1 = (x1 + 1) // 2, (y1 + 1) // 2
+				self.hiZ[k][y0:y1, x0:x1] = _blockMax(self.hiZ[k - 1][2 * y0:2 * y1, 2 * x0:2 * x1])
+
+		self.hiZDirty = None
+		return self.hiZ
+
+	def glHiZOccluded(self, rects, nearest):
+		# Prueba de oclusion de rectangulos de pantalla (N,4) con la
+		# profundidad mas cercana (N,) de lo que cubren. Un rectangulo esta
+		# tapado si su profundidad queda detras de la maxima del zBuffer en
+		# todos sus pixeles dentro del scissor. Se consulta el nivel de la
+		# piramide donde el rectangulo toca a lo mas 5x5 bloques
+		levels = self.glHiZLevels()
+		sx0, sy0, sx1, sy1 = self.glScissorRect()
+
+		with np.errstate(invalid = "ignore"):
+			valid = np.isfinite(rects).all(axis = 1) & np.isfinite(nearest)
+		rects = np.where(valid[:, None], rects, 0)
+
+		x0 = np.clip(np.floor(rects[:, 0]) - 1, sx0, sx1 - 1).astype(np.int64)
+		y0 = np.clip(np.floor(rects[:, 1]) - 1, sy0, sy1 - 1).astype(np.int64)
+		x1 = np.clip(np.ceil(rects[:, 2]) + 1, sx0, sx1 - 1).astype(np.int64)
+		y1 = np.clip(np.ceil(rects[:, 3]) + 1, sy0, sy1 - 1).astype(np.int64)
+
+		size = np.maximum(x1 - x0, y1 - y0) + 1
+		level = np.maximum(np.ceil(np.log2(size)).astype(np.int64) - 2, 0)
+		steps = np.arange(5)
+
+		occluded = np.zeros(len(rects), dtype = bool)
+		for k in np.unique(level).tolist():
+			chosen = np.flatnonzero((level == k) & valid)
+			cx0, cy0, cx1, cy1 = (a[chosen, None] >> k for a in (x0, y0, x1, y1))
+
+			# Los bloques que sobran se repiten con el ultimo
+			columns = np.minimum(cx0 + steps, cx1)
+			rows = np.minimum(cy0 + steps, cy1)
+			farthest = levels[k][rows[:, :, None], columns[:, None, :]].max(axis = (1, 2))
+			occluded[chosen] = nearest[chosen] > farthest + HIZ_EPSILON
+
+		return occluded
+
+	def glSelectLOD(self, model, viewMatrix):
+		# Nivel de detalle mas grueso del modelo cuyo error, proyectado en
+		# pantalla, no pasa de lodThreshold pixeles. El error se proyecta a
+		# la distancia del punto de la esfera envolvente mas cercano a la
+		# camara, asi que ningun vertice del modelo queda con mas error
+		if not model.lods or model.instanced or self.lodThreshold is None:
+			return 0
+
+		center, radius = model.GetBoundingSphere()
+		modelView = np.asarray(viewMatrix) @ np.asarray(model.GetModelMatrix())
+
+		# La escala mas grande del modelo, incluida la de sus padres
+		scale = np.linalg.norm(modelView[:3, :3], axis = 0).max()
+		distance = -(modelView @ np.append(center, 1))[2] - radius * scale
+		if distance <= 0:
+			return 0
+
+		# Pixeles que mide una unidad a esa distancia
+		pixelsPerUnit = self.viewportMatrix[1, 1] * self.projectionMatrix[1, 1] / distance
+
+		level = 0
+		for candidate in range(1, len(model.lods) + 1):
+			if model.GetLODError(candidate) * scale * pixelsPerUnit > self.lodThreshold:
+				break
+			level = candidate
+		return level
+
+	def glBoundsRect(self, points, margin = 0):
+		# Rectangulo entero (x0, y0, x1, y1) que cubre los puntos (N,2) con
+		# un pixel de margen por el redondeo mas margin pixeles, recortado a
+		# la ventana. None si queda vacio
+		with np.errstate(invalid = "ignore"):
+			points = points[np.isfinite(points).all(axis = 1)]
+
+		if len(points) == 0:
+			return None
+
+		x0, y0 = np.floor(points.min(axis = 0)) - 1 - margin
+		x1, y1 = np.ceil(points.max(axis = 0)) + 2 + margin
+
+		x0 = int(max(x0, 0))
+		y0 = int(max(y0, 0))
+		x1 = int(min(x1, self.width))
+		y1 = int(min(y1, self.height))
+
+		if x0 >= x1 or y0 >= y1:
+			return None
+
+		return (x0, y0, x1, y1)
+
+	def glPointMargin(self):
+		# Pixeles que un punto de pointSize se extiende fuera de su centro,
+		# ver glDrawPoints. Solo los puntos del modo POINTS tienen tamano
+		if self.primitiveType != POINTS:
+			return 0
+		return max(1, int(self.pointSize)) // 2
+
+	def glUnionRect(self, a, b):
+		if a is None:
+			return b
+		if b is None:
+			return a
+		return (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+
+
+	def glVertexStage(self, model, viewMatrix, vertexIds = None, instances = None):
+		# Etapa de vertices en lote: se compone una sola matriz por modelo
+		# y se transforman todas las posiciones y normales como arreglos.
+		# Retorna las posiciones homogeneas (N,4) y las normales (N,3).
+		# vertexIds transforma solo esos vertices. En un InstancedModel se
+		# compone una matriz por instancia (todas, o las de instances) y se
+		# retornan los I * N vertices, instancia por instancia
+		positions = model.GetVertexArray()
+		normals = model.GetNormalArray()
+		if vertexIds is not None:
+			positions = positions[vertexIds]
+			normals = normals[vertexIds]
+
+		if model.instanced:
+			modelMatrix = model.GetInstanceMatrices()
+			if instances is not None:
+				modelMatrix = modelMatrix[instances]
+			mvpMatrix = np.asarray(self.viewportMatrix * self.projectionMatrix * viewMatrix) @ modelMatrix
+		else:
+			modelMatrix = np.asarray(self.activeModelMatrix)
+			mvpMatrix = np.asarray(self.viewportMatrix * self.projectionMatrix * viewMatrix * self.activeModelMatrix)
+
+		vt, nt = self.activeVertexShader(positions,
+										normals = normals,
+										modelMatrix = modelMatrix,
+										mvpMatrix = mvpMatrix)
+
+		return vt, nt
+
+
+	def glFrustumPlanes(self, matrix):
+		# Planos (6,4) del volumen de vista despues del viewport, los mismos
+		# de glPrimitiveAssembly, llevados al espacio de donde parte matrix
+		# (viewport * projection * ...). Estan normalizados: plano @ (x, y,
+		# z, 1) es la distancia con signo, positiva hacia adentro
+		clipPlanes = np.array([[1, 0, 0, -self.vpX],
+							   [-1, 0, 0, self.vpX + self.vpWidth],
+							   [0, 1, 0, -self.vpY],
+							   [0, -1, 0, self.vpY + self.vpHeight],
+							   [0, 0, 1, 0],
+							   [0, 0, -1, 1]], dtype = float)
+		planes = clipPlanes @ matrix
+		with np.errstate(invalid = "ignore", divide = "ignore"):
+			planes /= np.linalg.norm(planes[:, 0:3], axis = 1, keepdims = True)
+		return planes
+
+	def glCullInstances(self, model, viewMatrix):
+		# Indices de las instancias de un InstancedModel cuya esfera
+		# envolvente toca el volumen de vista, de adelante hacia atras con
+		# depthSort. Las demas no se transforman
+		count = model.GetInstanceCount()
+		if not self.clusterCulling:
+			return np.arange(count)
+
+		center, radius = model.GetBoundingSphere()
+		matrices = model.GetInstanceMatrices()
+		centers = matrices[:, 0:3, 0:3] @ center + matrices[:, 0:3, 3]
+		radii = radius * np.linalg.norm(matrices[:, 0:3, 0:3], axis = 1).max(axis = 1)
+
+		planes = self.glFrustumPlanes(np.asarray(self.viewportMatrix * self.projectionMatrix * viewMatrix))
+		outside = (centers @ planes[:, 0:3].T + planes[:, 3] < -radii[:, None]).any(axis = 1)
+		self.primitiveStats["instancesCulled"] += int(outside.sum())
+
+		visible = np.flatnonzero(~outside)
+		if self.depthSort:
+			distance = -(centers[visible] @ np.asarray(viewMatrix)[2, 0:3] + np.asarray(viewMatrix)[2, 3])
+			visible = visible[np.argsort(distance, kind = "stable")]
+		return visible
+
+	def glCullMeshlets(self, model, viewMatrix):
+		# Prueba los meshlets del modelo contra los planos del volumen de
+		# vista y, con descarte de caras, contra su cono de normales, todo
+		# en coordenadas del modelo. Retorna los indices ordenados de los
+		# triangulos de los meshlets que pasan, o None si pasan todos.
+		# Solo se descartan meshlets cuyos triangulos descartaria tambien
+		# glPrimitiveAssembly, asi que la imagen no cambia
+		if not self.clusterCulling or len(model.GetIndexArray()) == 0:
+			return None
+
+		meshlets = model.GetMeshlets()
+		centers = meshlets["centers"]
+		radii = meshlets["radii"]
+
+		modelView = np.asarray(viewMatrix) @ np.asarray(self.activeModelMatrix)
+		mvpMatrix = np.asarray(self.viewportMatrix * self.projectionMatrix) @ modelView
+
+		planes = self.glFrustumPlanes(mvpMatrix)
+		distances = centers @ planes[:, 0:3].T + planes[:, 3]
+		outside = (distances < -radii[:, None]).any(axis = 1)
+
+		backfacing = np.zeros(len(centers), dtype = bool)
+		if self.cullFace != CULL_NONE:
+			# Un meshlet queda de espaldas si todo su cono de normales
+			# apunta lejos de la camara desde cualquier punto de su esfera
+			camera = np.linalg.inv(modelView)[0:3, 3]
+			toCenter = centers - camera
+			facing = np.einsum("ij,ij->i", toCenter, meshlets["coneAxes"])
+
+			# El sentido del frente se invierte con una transformacion
+			# que refleja, con frontFace CW y al descartar el frente
+			if (np.linalg.det(modelView[0:3, 0:3]) < 0) ^ (self.frontFace == CW) ^ (self.cullFace == CULL_FRONT):
+				facing = -facing
+
+			backfacing = facing > np.linalg.norm(toCenter, axis = 1) * meshlets["coneSines"] + radii
+			backfacing &= ~outside
+
+		stats = self.primitiveStats
+		stats["meshletsTested"] += len(centers)
+		stats["meshletsFrustumCulled"] += int(outside.sum())
+		stats["meshletsBackfaceCulled"] += int(backfacing.sum())
+
+		rejected = outside | backfacing
+		offsets = meshlets["offsets"]
+
+		if self.depthSort:
+			# Meshlets de adelante hacia atras, cada uno con sus triangulos
+			distance = -(centers @ modelView[2, 0:3] + modelView[2, 3])
+			order = np.flatnonzero(~rejected)
+			order = order[np.argsort(distance[order], kind = "stable")]
+
+			sizes = offsets[order + 1] - offsets[order]
+			positions = np.repeat(offsets[order] - (np.cumsum(sizes) - sizes), sizes) + np.arange(sizes.sum())
+			return meshlets["triangles"][positions]
+
+		if not rejected.any():
+			return None
+
+		# Los triangulos quedan en su orden original
+		keep = np.zeros(len(meshlets["triangles"]), dtype = bool)
+		keep[meshlets["triangles"][np.repeat(~rejected, np.diff(offsets))]] = True
+		return np.flatnonzero(keep)
+
+	def glPrimitiveAssembly(self, positions, attributes, indices, sourceIds = False):
+		# Arma los triangulos (T,3) del buffer de indices a partir de las
+		# posiciones homogeneas (N,4) y los atributos (N,A) ya transformados
+		# una sola vez por vertice. Descarta los que estan fuera del volumen
+		# de vista o de espaldas, recorta contra el plano cercano y hace la
+		# division de perspectiva. Retorna el buffer de vertices (T*3, 3+A).
+		# Con sourceIds tambien retorna el indice del triangulo original de
+		# cada triangulo ensamblado; los que salieron del recorte tienen
+		# -1 - indice del triangulo recortado
+		count = len(indices)
+		positions = positions[indices]
+		attributes = attributes[indices]
+		ids = np.arange(count)
+
+		stats = self.primitiveStats
+		stats["submitted"] += count
+
+		# Las posiciones ya incluyen la matriz de viewport, asi que los planos
+		# del volumen de vista son los limites del viewport multiplicados por w
+		x, y, z, w = np.moveaxis(positions, 2, 0)
+		outside = np.stack((x < self.vpX * w,
+							x > (self.vpX + self.vpWidth) * w,
+							y < self.vpY * w,
+							y > (self.vpY + self.vpHeight) * w,
+							z < 0,
+							z > w), axis = 2)
+
+		# Un triangulo se descarta si sus tres vertices estan
+		# fuera del mismo plano
+		rejected = outside.all(axis = 1).any(axis = 1)
+		stats["frustumCulled"] += int(rejected.sum())
+
+		if rejected.any():
+			positions = positions[~rejected]
+			attributes = attributes[~rejected]
+			outside = outside[~rejected]
+			ids = ids[~rejected]
+
+		# Los triangulos que cruzan el plano cercano se recortan
+		crossing = outside[:, :, 4].any(axis = 1)
+		if crossing.any():
+			clippedPositions, clippedAttributes = self.glClipNear(positions[crossing], attributes[crossing])
+			clippedIds = -1 - self.glClipSources(ids[crossing], positions[crossing])
+			stats["nearClipped"] += int(crossing.sum())
+			stats["clipGenerated"] += len(clippedPositions)
+
+			positions = np.concatenate((positions[~crossing], clippedPositions))
+			attributes = np.concatenate((attributes[~crossing], clippedAttributes))
+			ids = np.concatenate((ids[~crossing], clippedIds))
+
+		screen = self.glPerspectiveDivide(positions.reshape(-1, 4)).reshape(-1, 3, 3)
+
+		if self.cullFace != CULL_NONE:
+			A, B, C = screen[:, 0], screen[:, 1], screen[:, 2]
+			area = (B[:, 0] - A[:, 0]) * (C[:, 1] - A[:, 1]) - (B[:, 1] - A[:, 1]) * (C[:, 0] - A[:, 0])
+
+			if self.frontFace == CW:
+				area = -area
+
+			# Los triangulos sin area tampoco se dibujan
+			keep = area > 0 if self.cullFace == CULL_BACK else area < 0
+			stats["backfaceCulled"] += int(len(keep) - keep.sum())
+
+			screen = screen[keep]
+			attributes = attributes[keep]
+			ids = ids[keep]
+
+		stats["assembled"] += len(screen)
+
+		vertexBuffer = np.concatenate((screen, attributes), axis = 2).reshape(-1, 3 + attributes.shape[2])
+
+		if sourceIds:
+			return vertexBuffer, ids
+		return vertexBuffer
+
+
+	def glClipNear(self, positions, attributes):
+		# Recorta contra el plano cercano (z = 0 despues del viewport) los
+		# triangulos que lo cruzan. Los que tienen un vertice adentro generan
+		# un triangulo y los que tienen dos generan dos, con el mismo orden
+		vertices = np.concatenate((positions, attributes), axis = 2)
+		distance = positions[:, :, 2]
+		inside = distance >= 0
+		insideCount = inside.sum(axis = 1)
+
+		def rotate(first, mask):
+			# Rota los vertices para que el indicado quede de primero
+			order = (first[:, None] + np.arange(3)) % 3
+			return (np.take_along_axis(vertices[mask], order[:, :, None], axis = 1),
+					np.take_along_axis(distance[mask], order, axis = 1))
+
+		def intersect(a, b, da, db):
+			t = (da / (da - db))[:, None]
+			return a + t * (b - a)
+
+		triangles = []
+
+		one = insideCount == 1
+		if one.any():
+			v, d = rotate(np.argmax(inside[one], axis = 1), one)
+			pAB = intersect(v[:, 0], v[:, 1], d[:, 0], d[:, 1])
+			pAC = intersect(v[:, 0], v[:, 2], d[:, 0], d[:, 2])
+			triangles.append(np.stack((v[:, 0], pAB, pAC), axis = 1))
+
+		two = insideCount == 2
+		if two.any():
+			# El vertice de afuera queda de ultimo
+			v, d = rotate((np.argmin(inside[two], axis = 1) + 1) % 3, two)
+			pBC = intersect(v[:, 1], v[:, 2], d[:, 1], d[:, 2])
+			pAC = intersect(v[:, 0], v[:, 2], d[:, 0], d[:, 2])
+			triangles.append(np.stack((v[:, 0], v[:, 1], pBC), axis = 1))
+			triangles.append(np.stack((v[:, 0], pBC, pAC), axis = 1))
+
+		if not triangles:
+			return positions[:0], attributes[:0]
+
+		triangles = np.concatenate(triangles)
+		return triangles[:, :, 0:4], triangles[:, :, 4:]
+
+
+	def glClipSources(self, ids, positions):
+		# Triangulo original de cada triangulo que genera glClipNear, en el
+		# mismo orden: los de un vertice adentro y luego dos por cada uno
+		# de los de dos vertices adentro
+		insideCount = (positions[:, :, 2] >= 0).sum(axis = 1)
+		one = ids[insideCount == 1]
+		two = ids[insideCount == 2]
+		return np.concatenate((one, two, two))
+
+	def glPerspectiveDivide(self, vt):
+		# Division de perspectiva vectorizada sobre coordenadas homogeneas (N,4)
+		with np.errstate(divide = "ignore", invalid = "ignore"):
+			return vt[:, 0:3] / vt[:, 3:4]
+
+
+	def glVertexStageLegacy(self, model, viewMatrix):
+		vertexBuffer = []
+
+		# Procesar vértices de 3 en 3 para formar triángulos
+		vertices = model.GetVertexArray().tolist()
+		normals = model.GetNormalArray().tolist()
+
+		for vertex_idx, (vertex, normal) in enumerate(zip(vertices, normals)):
+			triangle_index = vertex_idx // 3
+
+			# Aplicar vertex shader si está disponible
+			if self.activeVertexShader:
+				# El vertex shader retorna (vt, nt) como tupla
+				vt, nt = self.activeVertexShader(
+					vertex,
+					modelMatrix=self.activeModelMatrix,
+					triangle_index=triangle_index,
+					normal=normal,
+					viewMatrix = viewMatrix,
+					projectionMatrix = self.projectionMatrix,
+					viewportMatrix = self.viewportMatrix)
+				
+				# Combinar posición transformada y normal transformada
+				# Convertir nt de numpy array a lista si es necesario
+				if hasattr(nt, 'tolist'):
+					nt = nt.tolist()
+				
+				vertexBuffer.extend(vt + nt)
+			else:
+				# Si no hay vertex shader, usar vértice original con normal
+				vertexBuffer.extend(vertex + normal)
+
+		return vertexBuffer
+
+
+
+	def glDrawWireframe(self, model, positions, vertexBuffer, triangleIds):
+		# Dibuja cada arista de la malla una sola vez. La lista de aristas
+		# unicas sale de los indices del modelo y se calcula una vez por
+		# malla; en cada frame solo se eligen las aristas de los triangulos
+		# que sobrevivieron al ensamblaje. positions son las posiciones
+		# homogeneas (N,4) de los vertices y triangleIds lo que retorna
+		# glPrimitiveAssembly con sourceIds. Con varias instancias de la
+		# malla, positions tiene los vertices de una instancia tras otra
+		edges, triangleEdges = model.GetEdgeArray()
+		vertexCount = len(model.GetVertexArray())
+		instances = len(positions) // max(vertexCount, 1)
+
+		original = triangleIds >= 0
+		instance, triangle = np.divmod(triangleIds[original], max(len(triangleEdges), 1))
+		visible = np.zeros(instances * len(edges), dtype = bool)
+		visible[triangleEdges[triangle] + (instance * len(edges))[:, None]] = True
+		instance, edge = np.divmod(np.flatnonzero(visible), len(edges))
+		edges = edges[edge] + (instance * vertexCount)[:, None]
+
+		screen = self.glPerspectiveDivide(positions)
+		starts = [screen[edges[:, 0]]]
+		ends = [screen[edges[:, 1]]]
+
+		# Los triangulos recortados contra el plano cercano tienen vertices
+		# nuevos, sus aristas se dibujan directamente
+		if not original.all():
+			triangles = vertexBuffer.reshape(-1, 3, vertexBuffer.shape[1])[~original, :, 0:3]
+			starts.append(triangles.reshape(-1, 3))
+			ends.append(np.roll(triangles, -1, axis = 1).reshape(-1, 3))
+
+		self.glDrawLines(np.concatenate(starts), np.concatenate(ends))
+
+	def glDrawLines(self, starts, ends, color = None):
+		# Dibuja los segmentos starts[i] -> ends[i] (E,3) en pantalla. Los
+		# pixeles de todas las lineas se generan juntos con numpy, un paso
+		# por pixel sobre el eje mas largo de cada linea. Con
+		# lineDepthTest se prueban y escriben en el zBuffer
+		color = [int(c * 255) for c in (color or self.currColor)[:3]]
+		x0, y0, x1, y1 = self.glScissorRect()
+
+		with np.errstate(invalid = "ignore"):
+			valid = np.isfinite(starts).all(axis = 1) & np.isfinite(ends).all(axis = 1)
+		starts = starts[valid]
+		ends = ends[valid]
+
+		delta = ends - starts
+		steps = np.ceil(np.abs(delta[:, 0:2]).max(axis = 1)).astype(np.int64) + 1
+
+		# Por bloques de lineas para acotar la memoria de los pixeles
+		limit = 1 << 20
+		first = 0
+		while first < len(steps):
+			last = first + max(1, int(np.searchsorted(np.cumsum(steps[first:]), limit)))
+
+			blockSteps = steps[first:last]
+			owner = np.repeat(np.arange(first, last), blockSteps)
+			k = np.arange(len(owner)) - np.repeat(np.cumsum(blockSteps) - blockSteps, blockSteps)
+			t = (k / np.maximum(steps[owner] - 1, 1))[:, None]
+
+			points = starts[owner] + t * delta[owner]
+			xs = np.rint(points[:, 0]).astype(np.int64)
+			ys = np.rint(points[:, 1]).astype(np.int64)
+
+			inside = (xs >= x0) & (xs < x1) & (ys >= y0) & (ys < y1)
+			xs = xs[inside]
+			ys = ys[inside]
+
+			if self.lineDepthTest:
+				self.glWriteNearest(xs, ys, points[inside, 2], color)
+			else:
+				self.frameBuffer[ys, xs] = color
+			first = last
+
+	def glDrawPointCloud(self, model, positions, triangleIds):
+		# Dibuja cada vertice usado por los triangulos que sobrevivieron al
+		# ensamblaje una sola vez, aunque lo compartan varios triangulos.
+		# Una malla sin triangulos se dibuja como nube de puntos completa.
+		# positions son las posiciones homogeneas (N,4) de los vertices, de
+		# una instancia tras otra si hay varias
+		indices = model.GetIndexArray()
+
+		if len(indices):
+			sources = np.where(triangleIds >= 0, triangleIds, -1 - triangleIds)
+			instance, triangle = np.divmod(sources, len(indices))
+			used = np.zeros(len(positions), dtype = bool)
+			used[indices[triangle] + (instance * len(model.GetVertexArray()))[:, None]] = True
+			positions = positions[used]
+
+		# Los puntos detras de la camara o fuera del rango de profundidad
+		# se descartan antes de dividir
+		w = positions[:, 3]
+		z = positions[:, 2]
+		positions = positions[(w > 0) & (z >= 0) & (z <= w)]
+
+		# Retorna los puntos (N,3) de pantalla que dibujo
+		points = self.glPerspectiveDivide(positions)
+		self.glDrawPoints(points)
+		return points
+
+	def glDrawPoints(self, points, color = None):
+		# Dibuja los puntos (N,3) de pantalla como cuadrados de pointSize
+		# pixeles, con prueba de profundidad. Todo se resuelve con arreglos:
+		# los puntos fuera de la ventana se descartan con una mascara y en
+		# cada pixel queda el punto mas cercano
+		color = [int(c * 255) for c in (color or self.currColor)[:3]]
+		x0, y0, x1, y1 = self.glScissorRect()
+
+		with np.errstate(invalid = "ignore"):
+			points = points[np.isfinite(points).all(axis = 1)]
+
+		xs = np.rint(points[:, 0]).astype(np.int64)
+		ys = np.rint(points[:, 1]).astype(np.int64)
+		z = points[:, 2]
+
+		size = max(1, int(self.pointSize))
+		if size > 1:
+			offsets = np.arange(size) - (size - 1) // 2
+			dx, dy = np.meshgrid(offsets, offsets)
+			xs = (xs[:, None] + dx.ravel()).ravel()
+			ys = (ys[:, None] + dy.ravel()).ravel()
+			z = np.repeat(z, size * size)
+
+		inside = (xs >= x0) & (xs < x1) & (ys >= y0) & (ys < y1)
+		self.glWriteNearest(xs[inside], ys[inside], z[inside], color)
+
+	def glWriteNearest(self, xs, ys, z, color):
+		# Escribe un color en los pixeles (xs, ys) con prueba de
+		# profundidad. Cuando varios fragmentos caen en el mismo pixel gana
+		# el mas cercano: np.minimum.at hace un scatter-min directo sobre el
+		# zBuffer y luego se pintan los fragmentos que quedaron en el
+		pixels = ys * self.width + xs
+		z = z.astype(self.zBuffer.dtype)
+
+		depth = self.zBuffer.reshape(-1)
+		before = depth[pixels]
+		np.minimum.at(depth, pixels, z)
+		won = (z < before) & (depth[pixels] == z)
+
+		self.primitiveStats["fragmentsTested"] += len(pixels)
+		self.primitiveStats["fragmentsPassed"] += int(won.sum())
+
+		self.frameBuffer.reshape(-1, 3)[pixels[won]] = color
 
 	def glDrawPrimitives(self, buffer, vertexOffset):
+		buffer = np.asarray(buffer, dtype = float).ravel()
+
 		if self.primitiveType == POINTS:
-			for i in range(0, len(buffer), vertexOffset):
-				x = buffer[i]
-				y = buffer[i + 1]
-				self.glPoint(x, y, None)
+			count = len(buffer) // vertexOffset
+			self.glDrawPoints(buffer[:count * vertexOffset].reshape(count, vertexOffset)[:, 0:3])
 
 		elif self.primitiveType == LINES:
-			for i in range(0, len(buffer), vertexOffset * 3):
-				for j in range(3):
-					x0 = buffer[i + vertexOffset * j + 0]
-					y0 = buffer[i + vertexOffset * j + 1]
-					
-					x1 = buffer[i + vertexOffset * ((j + 1) % 3) + 0]
-					y1 = buffer[i + vertexOffset * ((j + 1) % 3) + 1]
-
-					self.glLine((x0, y0), (x1, y1))
+			# Las tres aristas de cada triangulo, sin informacion de indices
+			# para quitar las compartidas
+			count = len(buffer) // (vertexOffset * 3)
+			triangles = buffer[:count * vertexOffset * 3].reshape(count, 3, vertexOffset)[:, :, 0:3]
+			self.glDrawLines(triangles.reshape(-1, 3), np.roll(triangles, -1, axis = 1).reshape(-1, 3))
 
 		elif self.primitiveType == TRIANGLES:
-			# Verificar que tenemos suficientes datos para al menos un triángulo
-			if len(buffer) < vertexOffset * 3:
-				print(f"Warning: Not enough data for triangle. Buffer size: {len(buffer)}, needed: {vertexOffset * 3}")
+			# Validar que los vértices tengan al menos 3 componentes (x, y, z)
+			if vertexOffset < 3:
+				print(f"Warning: Invalid vertex data. Vertex size: {vertexOffset}")
 				return
-				
-			for i in range(0, len(buffer), vertexOffset * 3):
-				# Verificar que no nos salgamos del buffer
-				if i + vertexOffset * 3 > len(buffer):
-					break
-					
-				# Extraer los tres vértices del triángulo
-				A = [buffer[i + j + vertexOffset * 0] for j in range(vertexOffset)]
-				B = [buffer[i + j + vertexOffset * 1] for j in range(vertexOffset)]
-				C = [buffer[i + j + vertexOffset * 2] for j in range(vertexOffset)]
-
-				# Validar que los vértices tengan al menos 3 componentes (x, y, z)
-				if len(A) >= 3 and len(B) >= 3 and len(C) >= 3:
-					self.glTriangle(A, B, C)
-				else:
-					print(f"Warning: Invalid vertex data. A={len(A)}, B={len(B)}, C={len(C)}")
\ No newline at end of file
+
+			# Un buffer vacio es normal: el ensamblaje descarta los modelos
+			# fuera de la vista o de espaldas. Uno que no completa sus
+			# triangulos es un error de quien lo armo
+			if len(buffer) % (vertexOffset * 3):
+				raise ValueError(f"Vertex buffer of {len(buffer)} values does not hold whole triangles "
+								 f"of {vertexOffset * 3} values")
+			if len(buffer) == 0:
+				return
+
+			count = len(buffer) // (vertexOffset * 3)
+			triangles = buffer.reshape(count, 3, vertexOffset)
+
+			if self.scissor is not None:
+				# Solo los triangulos que tocan el rectangulo a redibujar
+				x0, y0, x1, y1 = self.scissor
+				with np.errstate(invalid = "ignore"):
+					inside = ((triangles[:, :, 0].max(axis = 1) >= x0 - 1) & (triangles[:, :, 0].min(axis = 1) <= x1) &
+							  (triangles[:, :, 1].max(axis = 1) >= y0 - 1) & (triangles[:, :, 1].min(axis = 1) <= y1))
+				triangles = triangles[inside]
+				count = len(triangles)
+
+			if not self.occlusionCulling:
+				self.glRasterTriangles(triangles)
+				return
+
+			# Por bloques: cada bloque se prueba contra la piramide de
+			# profundidad con lo que dibujaron los anteriores. El rasterizador
+			# por tiles recibe todo de una vez para no repartir tareas
+			# pequenas a los procesos
+			block = max(count, 1) if self.glTiled() else OCCLUSION_BLOCK
+			allTriangles = triangles
+			for first in range(0, count, block):
+				triangles = allTriangles[first:first + block]
+				with np.errstate(invalid = "ignore"):
+					low = triangles[:, :, 0:3].min(axis = 1)
+					high = triangles[:, :, 0:2].max(axis = 1)
+
+				occluded = self.glHiZOccluded(np.column_stack((low[:, 0:2], high)), low[:, 2])
+				if occluded.any():
+					self.primitiveStats["occlusionCulled"] += int(occluded.sum())
+					triangles = triangles[~occluded]
+					low = low[~occluded]
+					high = high[~occluded]
+
+				if len(triangles) == 0:
+					continue
+
+				self.glRasterTriangles(triangles)
+
+				# Region del zBuffer que pudo cambiar
+				with np.errstate(invalid = "ignore"):
+					rect = self.glBoundsRect(np.concatenate((low[:, 0:2], high)))
+				self.hiZDirty = self.glUnionRect(self.hiZDirty, rect)
+
+	def glRasterTriangles(self, triangles):
+		# Rasteriza los triangulos (T,3,K) de pantalla en orden
+		count = len(triangles)
+
+		triangleBase = 0
+		if self.deferred:
+			# Los triangulos se guardan para el pase de resolucion
+			triangleBase = self.gTriangleCount
+			self.gBatches.append((triangleBase, triangles, self.activeFragmentShader, self.activeUniforms))
+			self.gTriangleCount += count
+
+		self.primitiveStats["trianglesRasterized"] += count
+
+		if self.glTiled():
+			tested, passed, errorCount, messages = self.tileRasterizer.draw(triangles, self.activeFragmentShader, self.currColor,
+																			self.dirLight, self.activeUniforms, self.scissor)
+			self.primitiveStats["fragmentsTested"] += tested
+			self.primitiveStats["fragmentsPassed"] += passed
+			self.primitiveStats["fragmentsShaded"] += passed
+			if errorCount:
+				self.profiler.shaderErrors(errorCount, messages)
+			return
+
+		for i, (A, B, C) in enumerate(triangles.tolist()):
+			self.activeTriangleId = triangleBase + i
+
+			# El modo por lineas divide y reordena los triangulos, asi que sus
+			# coordenadas baricentricas no sirven para el G-buffer
+			if self.rasterMode == EDGE_FUNCTION or self.deferred:
+				self.glTriangleEdge(A, B, C)
+			else:
+				self.glTriangle(A, B, C)
+
+
+def _blockMax(depth):
+	# Maximo de cada bloque de 2x2 del arreglo (alto, ancho). En los lados
+	# impares el ultimo bloque solo tiene una fila o columna
+	height, width = depth.shape[0] // 2, depth.shape[1] // 2
+	result = depth[0::2, 0::2].copy()
+	np.maximum(result[:height], depth[1::2, 0::2], out = result[:height])
+	np.maximum(result[:, :width], depth[0::2, 1::2], out = result[:, :width])
+	np.maximum(result[:height, :width], depth[1::2, 1::2], out = result[:height, :width])
+	return result
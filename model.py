@@ -1,28 +1,218 @@
 from MathLib import *
+from Transform import Transform
+from Meshlets import buildMeshlets
+import numpy as np
+
+class Model(Transform):
+    # Los modelos normales dibujan su malla una sola vez, ver InstancedModel
+    instanced = False
+
+    def __init__(self, vertices=None, normals=None, indices=None, texcoords=None):
+        super().__init__()
 
-class Model(object):
-    def __init__(self, vertices=None, normals=None):
         self.vertices = vertices if vertices is not None else []
         self.normals = normals if normals is not None else []
 
-        self.translation = [0, 0, 0]
-        self.rotation = [0, 0, 0]
-        self.scale = [1, 1, 1]
+        # Coordenadas de textura (N,2) alineadas con los vertices, opcionales
+        self.texcoords = texcoords
+        self.texture = None
+
+        # Buffer de indices (T,3) hacia los vertices. Si es None cada tres
+        # vertices seguidos forman un triangulo
+        self.indices = indices
+
+        # Niveles de detalle, del mas fino al mas grueso, como los retorna
+        # OBJ.lodChain: (vertexIds, indices, error). El nivel 0 es la malla
+        # completa y el nivel i usa lods[i - 1]. El renderer elige lodLevel
+        # en cada frame segun el tamano del modelo en pantalla
+        self.lods = []
+        self.lodLevel = 0
 
         self.vertexShader = None
         self.fragmentShader = None
 
+        self._vertexArray = None
+        self._normalArray = None
+        self._texcoordArray = None
+        self._edgeArrays = {}
+        self._boundingSphere = None
+        self._meshlets = {}
+        self._lodArrays = {}
+
+    def GetVertexArray(self):
+        # Copia (N,3) de los vertices para la etapa en lote. Los vertices
+        # pueden ser una lista plana o un arreglo, y la copia se guarda
+        # mientras sean los mismos
+        key = (id(self.vertices), len(self.vertices))
+        if self._vertexArray is None or self._vertexArray[0] != key:
+            array = np.asarray(self.vertices, dtype = float).reshape(-1, 3)
+            self._vertexArray = (key, array)
+        return self._LevelArray(self._vertexArray[1])
+
+    def GetNormalArray(self):
+        # Normales (N,3) alineadas con los vertices. Si no hay suficientes
+        # normales se usa la normal por defecto (0, 0, 1)
+        vertices = self.GetFullVertexArray()
+        key = (id(self.normals), len(self.normals), len(vertices))
+        if self._normalArray is None or self._normalArray[0] != key:
+            normals = np.asarray(self.normals, dtype = float).reshape(-1, 3)
+            if len(normals) >= len(vertices):
+                array = normals[:len(vertices)]
+            else:
+                array = np.tile([0.0, 0.0, 1.0], (len(vertices), 1))
+            self._normalArray = (key, array)
+        return self._LevelArray(self._normalArray[1])
+
+    def GetTexcoordArray(self):
+        # Coordenadas de textura (N,2) o None si el modelo no tiene
+        if self.texcoords is None or len(self.texcoords) == 0:
+            return None
+        key = (id(self.texcoords), len(self.texcoords))
+        if self._texcoordArray is None or self._texcoordArray[0] != key:
+            array = np.asarray(self.texcoords, dtype = float).reshape(-1, 2)
+            self._texcoordArray = (key, array)
+        return self._LevelArray(self._texcoordArray[1])
+
+    def GetIndexArray(self):
+        if self.lodLevel:
+            return self.lods[self.lodLevel - 1][1]
+        if self.indices is not None:
+            return np.asarray(self.indices).reshape(-1, 3)
+        count = len(self.GetVertexArray()) // 3
+        return np.arange(count * 3).reshape(count, 3)
+
+    def GetEdgeArray(self):
+        # Aristas unicas de la malla (E,2), con el indice menor primero, y
+        # la arista de cada lado de cada triangulo (T,3). Las aristas
+        # compartidas por dos triangulos aparecen una sola vez. Se guardan
+        # por nivel de detalle, como los meshlets
+        key = (id(self.indices), len(self.vertices), id(self.lods))
+        cached = self._edgeArrays.get(self.lodLevel)
+        if cached is None or cached[0] != key:
+            indices = self.GetIndexArray()
+            pairs = np.stack((indices, np.roll(indices, -1, axis = 1)), axis = 2).reshape(-1, 2)
+            pairs.sort(axis = 1)
+
+            edges, inverse = np.unique(pairs, axis = 0, return_inverse = True)
+            cached = self._edgeArrays[self.lodLevel] = (key, (edges, inverse.reshape(-1, 3)))
+        return cached[1]
+
+    def GetMeshlets(self):
+        # Meshlets del nivel de detalle activo, ver Meshlets.py. Se calculan
+        # una vez por nivel y se guardan mientras la malla sea la misma
+        key = (id(self.indices), len(self.vertices), id(self.lods))
+        cached = self._meshlets.get(self.lodLevel)
+        if cached is None or cached[0] != key:
+            cached = self._meshlets[self.lodLevel] = (key, buildMeshlets(self.GetVertexArray(), self.GetIndexArray()))
+        return cached[1]
+
+    def GetFullVertexArray(self):
+        # Vertices de la malla completa sin importar el nivel de detalle
+        level = self.lodLevel
+        self.lodLevel = 0
+        try:
+            return self.GetVertexArray()
+        finally:
+            self.lodLevel = level
+
+    def GetTriangleCount(self, level = 0):
+        if level:
+            return len(self.lods[level - 1][1])
+        if self.indices is not None:
+            return len(np.asarray(self.indices).reshape(-1, 3))
+        return len(self.GetFullVertexArray()) // 3
+
+    def GetLODError(self, level):
+        # Distancia aproximada, en unidades del modelo, entre el nivel y la
+        # malla completa
+        return self.lods[level - 1][2] if level else 0.0
+
+    def GetBoundingSphere(self):
+        # Centro y radio de una esfera que contiene la malla completa, en
+        # coordenadas del modelo
+        vertices = self.GetFullVertexArray()
+        key = (id(self.vertices), len(self.vertices))
+        if self._boundingSphere is None or self._boundingSphere[0] != key:
+            if len(vertices) == 0:
+                sphere = (np.zeros(3), 0.0)
+            else:
+                center = (vertices.min(axis = 0) + vertices.max(axis = 0)) / 2
+                sphere = (center, float(np.linalg.norm(vertices - center, axis = 1).max()))
+            self._boundingSphere = (key, sphere)
+        return self._boundingSphere[1]
+
+    def _LevelArray(self, array):
+        # Filas de un arreglo por vertice que usa el nivel de detalle activo
+        if not self.lodLevel:
+            return array
+
+        vertexIds = self.lods[self.lodLevel - 1][0]
+        key = (self.lodLevel, id(array))
+        cached = self._lodArrays.get(key)
+        if cached is None or cached[0] is not array or cached[1] is not vertexIds:
+            cached = self._lodArrays[key] = (array, vertexIds, array[vertexIds])
+        return cached[2]
+
     def GetModelMatrix(self):
-        translateMat = TranslationMatrix(self.translation[0],
-                                         self.translation[1],
-                                         self.translation[2])
+        # Matriz de mundo del modelo, cacheada hasta que cambie su
+        # transformacion o la de algun padre
+        return self.GetWorldMatrix()
+
+
+class InstancedModel(Model):
+    # Una sola malla dibujada varias veces, cada instancia con su propia
+    # traslacion, rotacion y escala (arreglos (I,3)) y opcionalmente su
+    # color (I,3), que multiplica el color actual del renderer. Todas las
+    # instancias se transforman juntas en la etapa de vertices.
+    #
+    # La transformacion del modelo (translation, rotation, scale) se aplica
+    # despues de la de cada instancia, como la de un padre. Los cambios dentro
+    # de los arreglos de instancias no se detectan; hay que llamar
+    # SetInstances o MarkInstancesDirty.
+    #
+    # Las instancias siempre usan la malla completa: no se eligen niveles de
+    # detalle ni meshlets por instancia, pero las que quedan fuera del
+    # volumen de vista se descartan antes de transformarlas
+    instanced = True
+
+    def __init__(self, vertices=None, normals=None, indices=None, texcoords=None,
+                 translations=None, rotations=None, scales=None, colors=None):
+        super().__init__(vertices, normals, indices, texcoords)
+
+        # Aumenta cada vez que cambian las instancias
+        self.instanceVersion = 0
+        self._instanceMatrices = None
+
+        self.SetInstances(translations if translations is not None else np.zeros((1, 3)),
+                          rotations, scales, colors)
+
+    def SetInstances(self, translations, rotations=None, scales=None, colors=None):
+        # Sin rotaciones o escalas se usan (0, 0, 0) y (1, 1, 1)
+        self.translations = np.asarray(translations, dtype = float).reshape(-1, 3)
+        count = len(self.translations)
+
+        self.rotations = np.zeros((count, 3)) if rotations is None else np.asarray(rotations, dtype = float).reshape(-1, 3)
+        self.scales = np.ones((count, 3)) if scales is None else np.asarray(scales, dtype = float).reshape(-1, 3)
+        self.colors = None if colors is None else np.asarray(colors, dtype = float).reshape(-1, 3)
+
+        for name, values in (("rotations", self.rotations), ("scales", self.scales), ("colors", self.colors)):
+            if values is not None and len(values) != count:
+                raise ValueError(f"Expected {count} instance {name}, got {len(values)}")
+
+        self.MarkInstancesDirty()
 
-        rotateMat = RotationMatrix(self.rotation[0],
-                                   self.rotation[1],
-                                   self.rotation[2])
+    def MarkInstancesDirty(self):
+        self._instanceMatrices = None
+        self.instanceVersion += 1
 
-        scaleMat = ScaleMatrix(self.scale[0],
-                               self.scale[1],
-                               self.scale[2])
+    def GetInstanceCount(self):
+        return len(self.translations)
 
-        return translateMat * rotateMat * scaleMat
\ No newline at end of file
+    def GetInstanceMatrices(self):
+        # Matrices de mundo (I,4,4) de las instancias: la del modelo por la
+        # de cada instancia
+        key = (self.instanceVersion, self.worldVersion)
+        if self._instanceMatrices is None or self._instanceMatrices[0] != key:
+            local = TransformMatrices(self.translations, self.rotations, self.scales)
+            self._instanceMatrices = (key, np.asarray(self.GetWorldMatrix()) @ local)
+        return self._instanceMatrices[1]
@@ -1,6 +1,25 @@
 import numpy as np
 import random
-import math
+from ShaderCompiler import compileShader, ShaderCompileError
+
+def batchShader(shader):
+    # Marca un shader que procesa todos los vertices o fragmentos
+    # de una sola vez con arreglos de numpy en lugar de uno por uno
+    shader.isBatch = True
+    return shader
+
+def animatedShader(shader):
+    # Marca un shader cuyo resultado cambia entre frames aunque la escena
+    # sea la misma (ruido, tiempo), para que el Renderer no lo salte
+    shader.isAnimated = True
+    return shader
+
+def seedShaders(seed):
+    # Fija la semilla del ruido de los shaders animados (fireShader) para
+    # que un frame se pueda repetir exactamente. Solo aplica al proceso
+    # actual, no a los procesos del rasterizador por tiles
+    random.seed(seed)
+    np.random.seed(seed)
 
 def vertexShader(vertex, **kwargs):
     modelMatrix = kwargs["modelMatrix"]
@@ -38,149 +57,328 @@ def vertexShader(vertex, **kwargs):
 
     return vt, nt
 
+@batchShader
+def batchVertexShader(vertices, **kwargs):
+    # vertices: arreglo (N,3). mvpMatrix ya viene compuesta como
+    # viewport * projection * view * model, una vez por modelo. Con
+    # instancias las matrices son (I,4,4) y se retornan los I * N vertices
+    # transformados, instancia por instancia
+    mvpMatrix = kwargs["mvpMatrix"]
+    modelMatrix = kwargs["modelMatrix"]
+
+    normals = kwargs.get("normals")
+    if normals is None:
+        normals = np.broadcast_to([0.0, 0.0, 1.0], vertices.shape)
+
+    if mvpMatrix.ndim == 3:
+        homogeneous = np.column_stack((vertices, np.ones(len(vertices))))
+        vt = (homogeneous @ mvpMatrix.swapaxes(1, 2)).reshape(-1, 4)
+        nt = (normals @ modelMatrix[:, :3, :3].swapaxes(1, 2)).reshape(-1, 3)
+
+        norm = np.linalg.norm(nt, axis = 1, keepdims = True)
+        nt = np.divide(nt, norm, out = np.zeros_like(nt), where = norm > 0)
+        return vt, nt
+
+    vt = vertices @ mvpMatrix[:3, :3].T + mvpMatrix[:3, 3]
+    w = vertices @ mvpMatrix[3, :3] + mvpMatrix[3, 3]
+    vt = np.column_stack((vt, w))
+
+    nt = normals @ modelMatrix[:3, :3].T
+
+    norm = np.linalg.norm(nt, axis = 1, keepdims = True)
+    nt = np.divide(nt, norm, out = np.zeros_like(nt), where = norm > 0)
+
+    # La division de perspectiva la hace el Renderer sobre todo el lote
+    return vt, nt
+
+def perPixelShader(shader):
+    # Adaptador para fragment shaders escritos pixel por pixel: recibe el
+    # lote de fragmentos y llama al shader original una vez por fragmento
+    # con listas, igual que antes
+    @batchShader
+    def adapter(**kwargs):
+        verts = kwargs.pop("verts")
+        bCoords = kwargs.pop("bCoords")
+        pixelColor = kwargs.pop("pixelColor")
+        kwargs.pop("attributes", None)
+
+        colors = np.empty((len(bCoords), 3))
+
+        for i in range(len(bCoords)):
+            color = shader(verts = verts[i].tolist(),
+                           bCoords = bCoords[i].tolist(),
+                           pixelColor = pixelColor[i].tolist(),
+                           **kwargs)
+
+            if not isinstance(color, (list, tuple, np.ndarray)):
+                color = pixelColor[i]
+
+            color = list(color[:3]) + [0] * (3 - len(color[:3]))
+            colors[i] = [c if isinstance(c, (int, float)) else 0 for c in color]
+
+        return colors
+
+    return adapter
+
+_kernels = {}
+
+# Con menos fragmentos que esto (el raster por scanlines manda lotes de
+# uno o dos) preparar el kernel compilado cuesta mas que llamar al shader
+MIN_COMPILED_BATCH = 8
+
+def vectorizedShader(shader):
+    # Kernel en lote para un fragment shader escrito pixel por pixel. Se
+    # compila una sola vez con ShaderCompiler y se guarda por shader. Si no
+    # se puede compilar, o si en el primer lote no da los mismos colores
+    # que el shader original, se usa perPixelShader. Los lotes pequenos
+    # siempre se ejecutan pixel por pixel
+    if shader in _kernels:
+        return _kernels[shader]
+
+    try:
+        compiled = compileShader(shader)
+    except (ShaderCompileError, SyntaxError) as e:
+        print(f"Warning: {shader.__name__} runs per pixel: {e}")
+        compiled = None
+
+    adapter = perPixelShader(shader)
+    if compiled is None:
+        _kernels[shader] = adapter
+        return adapter
+
+    verified = []
+
+    @batchShader
+    def kernel(**kwargs):
+        if len(kwargs["bCoords"]) < MIN_COMPILED_BATCH:
+            return adapter(**kwargs)
+        if verified:
+            return compiled(**kwargs)
+
+        try:
+            colors = compiled(**kwargs)
+
+            # Los shaders con ruido no dan los mismos valores
+            if not getattr(shader, "isAnimated", False):
+                sample = {name: value[:16] if name in ("verts", "bCoords", "pixelColor", "attributes") else value
+                          for name, value in kwargs.items()}
+                if not np.allclose(colors[:16], adapter(**sample), equal_nan = True):
+                    raise ShaderCompileError("compiled colors differ from the original shader")
+        except Exception as e:
+            print(f"Warning: {shader.__name__} runs per pixel: {e}")
+            _kernels[shader] = adapter
+            return adapter(**kwargs)
+
+        verified.append(True)
+        return colors
+
+    _kernels[shader] = kernel
+    return kernel
+
+def compiledShader(shader):
+    # Decorador: compila el shader pixel por pixel al definirlo y falla
+    # con ShaderCompileError si usa algo que el compilador no admite
+    return compileShader(shader)
+
+def runFragmentShader(shader, verts, bCoords, attributes, currColor, dirLight, onError = None, **uniforms):
+    # Ejecuta un fragment shader sobre un lote de fragmentos y retorna sus
+    # colores (N,3) en uint8. Los shaders pixel por pixel se compilan una
+    # sola vez a numpy con vectorizedShader. uniforms (layout, texture, ...) se pasan
+    # tal cual al shader. onError recibe las excepciones del shader; sin
+    # el solo se imprimen
+    count = len(bCoords)
+    pixelColor = np.broadcast_to(np.array(currColor, dtype = float), (count, 3))
+
+    # El color de cada instancia, si hay, multiplica el color actual
+    layout = uniforms.get("layout") or {}
+    if "color" in layout:
+        pixelColor = attributes[:, layout["color"]] * pixelColor
+
+    color = None
+    if shader:
+        if not getattr(shader, "isBatch", False):
+            shader = vectorizedShader(shader)
+
+        try:
+            color = shader(verts = verts,
+                           bCoords = bCoords,
+                           attributes = attributes,
+                           pixelColor = pixelColor,
+                           dirLight = dirLight,
+                           **uniforms)
+        except Exception as e:
+            if onError is None:
+                print(f"Error in fragment shader: {e}")
+            else:
+                onError(e)
+            color = None
+
+    if color is None:
+        color = pixelColor
+
+    # Validar y corregir los colores: exactamente 3 componentes
+    # en rango 0-1, los valores invalidos se vuelven 0
+    color = np.asarray(color, dtype = float)
+    if color.ndim == 1:
+        color = np.broadcast_to(color, (count, len(color)))
+    if color.shape[1] < 3:
+        color = np.pad(color, ((0, 0), (0, 3 - color.shape[1])))
+
+    # fmax descarta los NaN
+    color = np.fmax(np.minimum(color[:, :3], 1), 0)
+    return (color * 255).astype(np.uint8)
+
+# Fragment shaders en lote. Reciben por kwargs:
+#   verts      (N,3,K) vertices del triangulo de cada fragmento
+#   bCoords    (N,3)   coordenadas baricentricas
+#   attributes (N,K)   atributos de vertice interpolados
+#   pixelColor (N,3)   color actual
+#   dirLight   (3,)    direccion de la luz
+#   layout     dict    nombre de atributo -> slice dentro de cada vertice
+#                      ("position" y "normal"; "texcoord" y "color"
+#                      si hay)
+#   texture            textura del modelo o None
+# y retornan un arreglo de colores (N,3) en rango 0-1
+
+@batchShader
 def fragmentShader(**kwargs):
-    r, g , b = kwargs["pixelColor"]
-    return [r, g, b]
+    return kwargs["pixelColor"]
 
+@batchShader
 def flatShader(**kwargs):
-    A, B, C = kwargs["verts"]
-    r, g , b = kwargs["pixelColor"]
+    verts = kwargs["verts"]
+    pixelColor = kwargs["pixelColor"]
     dirLight = kwargs["dirLight"]
 
-    nA = [A[3], A[4], A[5]]
-    nB = [B[3], B[4], B[5]]
-    nC = [C[3], C[4], C[5]]
+    normal = verts[:, :, 3:6].mean(axis = 1)
 
-    normal = [(nA[0]+nB[0]+nC[0])/3,
-              (nA[1]+nB[1]+nC[1])/3,
-              (nA[2]+nB[2]+nC[2])/3]
-    
     #intensity = normal DOT -dirLight
-    intensity = np.dot(normal, -np.array(dirLight))
-    intensity = max(0, intensity)
+    intensity = normal @ -np.asarray(dirLight, dtype = float)
+    intensity = np.maximum(0, intensity)
 
-    r *= intensity
-    g *= intensity
-    b *= intensity
-
-    return [r, g, b]
+    return pixelColor * intensity[:, None]
 
+@batchShader
 def gouradShader(**kwargs):
-    A, B, C = kwargs["verts"]
-    u, v, w = kwargs["bCoords"]
-    r, g , b = kwargs["pixelColor"]
+    attributes = kwargs["attributes"]
+    pixelColor = kwargs["pixelColor"]
     dirLight = kwargs["dirLight"]
 
-    nA = [A[3], A[4], A[5]]
-    nB = [B[3], B[4], B[5]]
-    nC = [C[3], C[4], C[5]]
+    normal = attributes[:, 3:6]
 
-    normal = [u*nA[0] + v*nB[0] + w*nC[0],
-              u*nA[1] + v*nB[1] + w*nC[1],
-              u*nA[2] + v*nB[2] + w*nC[2]]
-    
     #intensity = normal DOT -dirLight
-    intensity = np.dot(normal, -np.array(dirLight))
-    intensity = max(0, intensity)
-
-    r *= intensity
-    g *= intensity
-    b *= intensity
+    intensity = normal @ -np.asarray(dirLight, dtype = float)
+    intensity = np.maximum(0, intensity)
 
-    return [r, g, b]
+    return pixelColor * intensity[:, None]
 
+RAINBOW_STEPS = np.array([0.166, 0.333, 0.5, 0.666, 0.833])
+RAINBOW_COLORS = np.array([[1.0, 0.0, 0.0],
+                           [1.0, 0.5, 0.0],
+                           [1.0, 1.0, 0.0],
+                           [0.0, 1.0, 0.0],
+                           [0.0, 0.0, 1.0],
+                           [0.5, 0.0, 0.5]])
 
+@batchShader
 def RainbowShader(**kwargs):
-    A, B, C = kwargs["verts"]
-    u, v, w = kwargs["bCoords"]
-    
-    pos = (u * 0.3 + v * 0.6 + w * 0.1)
-    
-    if pos < 0.166:
-        r, g, b = 1.0, 0.0, 0.0    
-    elif pos < 0.333:
-        r, g, b = 1.0, 0.5, 0.0    
-    elif pos < 0.5:
-        r, g, b = 1.0, 1.0, 0.0    
-    elif pos < 0.666:
-        r, g, b = 0.0, 1.0, 0.0    
-    elif pos < 0.833:
-        r, g, b = 0.0, 0.0, 1.0    
-    else:
-        r, g, b = 0.5, 0.0, 0.5    
-    
-    return [r, g, b]
+    bCoords = kwargs["bCoords"]
+
+    pos = bCoords @ [0.3, 0.6, 0.1]
+
+    return RAINBOW_COLORS[np.searchsorted(RAINBOW_STEPS, pos, side = "right")]
 
+@batchShader
 def oceanShader(**kwargs):
-    A, B, C = kwargs["verts"]
-    u, v, w = kwargs["bCoords"]
-    
+    u, v, w = kwargs["bCoords"].T
+    attributes = kwargs["attributes"]
+
     tx = u * 10
     ty = v * 10
-    
-    wave1 = math.sin(tx * 2 + ty) * 0.5
-    wave2 = math.sin(tx * 1.5 - ty * 2) * 0.3
+
+    wave1 = np.sin(tx * 2 + ty) * 0.5
+    wave2 = np.sin(tx * 1.5 - ty * 2) * 0.3
     wave = wave1 + wave2
-    
+
     base_blue = 0.6 + wave * 0.2
-    r = 0.1
+    r = np.full_like(u, 0.1)
     g = 0.3 + wave * 0.1
-    b = min(1.0, base_blue)
-    
-    nA = [A[3], A[4], A[5]]
-    nB = [B[3], B[4], B[5]]
-    nC = [C[3], C[4], C[5]]
-    normal = [u*nA[0] + v*nB[0] + w*nC[0],
-              u*nA[1] + v*nB[1] + w*nC[1],
-              u*nA[2] + v*nB[2] + w*nC[2]]
-    
-    highlight = max(0, np.dot(normal, [0, 1, 0])) ** 2
+    b = np.minimum(1.0, base_blue)
+
+    # normal DOT (0, 1, 0)
+    highlight = np.maximum(0, attributes[:, 4]) ** 2
     r += highlight * 0.5
     g += highlight * 0.3
     b += highlight * 0.1
-    
-    return [r, g, b]
 
+    return np.column_stack((r, g, b))
+
+@batchShader
 def discoShader(**kwargs):
-    A, B, C = kwargs["verts"]
-    u, v, w = kwargs["bCoords"]
-    
+    u, v, w = kwargs["bCoords"].T
+
     center_u = 1/3
     center_v = 1/3
     center_w = 1/3
-    
-    dist = math.sqrt((u-center_u)**2 + (v-center_v)**2 + (w-center_w)**2)
-    
-    rings = math.sin(dist * 50)  
-    
-    r = abs(math.sin(dist * 20))  
-    g = (rings + 1) / 2          
-    b = 1 - dist                 
-    
-    return [r, g, b]
 
+    dist = np.sqrt((u-center_u)**2 + (v-center_v)**2 + (w-center_w)**2)
+
+    rings = np.sin(dist * 50)
+
+    r = np.abs(np.sin(dist * 20))
+    g = (rings + 1) / 2
+    b = 1 - dist
+
+    return np.column_stack((r, g, b))
+
+@animatedShader
+@batchShader
 def fireShader(**kwargs):
-    A, B, C = kwargs["verts"]
-    u, v, w = kwargs["bCoords"]
-    
-    flame_base = 1.0 - v  
-    
-    noise1 = math.sin(u * 10.0 + v * 20.0) * 0.5
-    noise2 = math.sin(u * 7.0 - v * 15.0) * 0.3
-    noise3 = math.sin(u * 15.0 + v * 25.0) * 0.2
+    u, v, w = kwargs["bCoords"].T
+
+    flame_base = 1.0 - v
+
+    noise1 = np.sin(u * 10.0 + v * 20.0) * 0.5
+    noise2 = np.sin(u * 7.0 - v * 15.0) * 0.3
+    noise3 = np.sin(u * 15.0 + v * 25.0) * 0.2
     combined_noise = (noise1 + noise2 + noise3) * v
-    
+
     flame_shape = flame_base * (1.0 + combined_noise)
-    
-    r = min(1.0, flame_shape * 1.2)  
-    g = flame_shape * 0.6             
-    b = flame_shape * 0.1             
-    
-    hot_core = max(0.0, flame_shape - 0.7) * 2.0
+
+    r = np.minimum(1.0, flame_shape * 1.2)
+    g = flame_shape * 0.6
+    b = flame_shape * 0.1
+
+    hot_core = np.maximum(0.0, flame_shape - 0.7) * 2.0
     r += hot_core * 0.5
     g += hot_core * 0.3
-    
-    if random.random() > 0.98:
-        r, g, b = 1.0, 1.0, 0.8  
-    
-    return [r, g, b]
\ No newline at end of file
+
+    color = np.column_stack((r, g, b))
+
+    sparks = np.random.random(len(u)) > 0.98
+    color[sparks] = [1.0, 1.0, 0.8]
+
+    return color
+
+@batchShader
+def textureShader(**kwargs):
+    verts = kwargs["verts"]
+    attributes = kwargs["attributes"]
+    pixelColor = kwargs["pixelColor"]
+    texture = kwargs.get("texture")
+    texcoord = kwargs["layout"].get("texcoord")
+
+    if texture is None or texcoord is None:
+        return pixelColor
+
+    uv = attributes[:, texcoord]
+
+    # El mipmap se elige comparando el area del triangulo en la
+    # textura con su area en pantalla
+    def area(points):
+        a, b, c = points[:, 0], points[:, 1], points[:, 2]
+        return 0.5 * ((b[:, 0] - a[:, 0]) * (c[:, 1] - a[:, 1]) - (b[:, 1] - a[:, 1]) * (c[:, 0] - a[:, 0]))
+
+    lod = texture.get_lod(area(verts[:, :, texcoord]), area(verts[:, :, 0:2]))
+
+    return texture.sample(uv[:, 0], uv[:, 1], lod = lod) * pixelColor